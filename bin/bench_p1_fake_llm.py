@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+P1 端到端基准：把委员会指向本地 OpenAI 兼容替身服务 (bin.fake_llm_server)，
+在临时数据库上完整跑一遍第一遍，统计墙钟时间、LLM 请求数 / 错误数 / token 与产出模板数。
+
+用法：
+  python -m bin.bench_p1_fake_llm --lines 20000 --latency-ms 1500 --modes sync,async
+  python -m bin.bench_p1_fake_llm --path some.log --error-rate 0.1 --latency-ms 800
+
+说明：
+- 每种模式使用独立的临时库与临时配置，LLM 缓存关闭、对话追踪关闭，互不干扰
+- 依赖 langchain_openai（与真实委员会路径一致）
+"""
+import argparse
+import copy
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+import yaml
+
+from bin import fake_llm_server
+from core.utils.config import load_yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+_MODS = ["fusion", "vgnss", "planning", "perception", "control"]
+_LEVELS = ["I", "W", "E"]
+_BODIES = [
+    lambda r: f"seletct_mot_id: {r.randint(0, 99)} {r.randint(0, 99)}",
+    lambda r: f"link {r.randint(0, 9)} has {r.randint(0, 99)} lanes id=0x{r.randint(0, 65535):04x}",
+    lambda r: f"sensor:{r.randint(0, 9999)}, age={r.random():.2f}, ns_r={r.randint(0, 64)}",
+    lambda r: f"valid_goal_point_num : {r.randint(0, 20)}",
+    lambda r: f"Auto gen vx graph(DAADBevDetTemporal{r.randint(0, 9)}v) failed",
+    lambda r: f"front side mots: [({r.randint(0, 9)}, {r.randint(0, 9)}), ]",
+    lambda r: f"task {r.choice(['lane', 'obj', 'map', 'ego'])}_{r.randint(0, 300)} finished in {r.randint(1, 900)} ms",
+    lambda r: f"upload {r.choice(['success', 'retry', 'skipped'])} bytes={r.randint(0, 1 << 20)}",
+]
+
+
+def _synthetic_log(path: str, lines: int, seed: int = 7) -> None:
+    r = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines):
+            s = i // 10
+            f.write(
+                f"[20250929_{18 + (s // 3600) % 6:02d}{(s // 60) % 60:02d}{s % 60:02d}][{3499 + i * 0.1:.3f}]"
+                f"[{r.choice(_LEVELS)}][{40000 + i % 16}][MOD:{r.choice(_MODS)}][SMOD:log] {r.choice(_BODIES)(r)}\n"
+            )
+
+
+def _abs_path(base: str, path: str) -> str:
+    return path if os.path.isabs(path) else os.path.normpath(os.path.join(base, path))
+
+
+def _write_configs(workdir: str, fake_base_url: str) -> str:
+    """
+    复制 application.yaml / agents.yaml，把所有智能体指向替身服务，返回临时 application.yaml 路径。
+    P1 子进程在临时目录里运行，配置中的相对路径全部改成绝对路径：
+    输入（密钥文件）相对仓库根目录解析，产物（对话追踪、LLM 缓存）落在临时目录。
+    """
+    app = copy.deepcopy(load_yaml(os.path.join(ROOT, "configs/application.yaml")))
+    agents_all = copy.deepcopy(load_yaml(os.path.join(ROOT, "configs/agents.yaml")))
+    cm = agents_all.setdefault("committee", {})
+    cm["backend"] = "langchain"
+    orch = cm.setdefault("orchestration", {})
+    orch["trace_conversations"] = False
+    orch["trace_dir"] = _abs_path(workdir, orch.get("trace_dir") or "data/agent_traces")
+    orch["llm_cache"] = {"mode": "off", "path": os.path.join(workdir, "data", "llm_cache.sqlite3")}
+    for agent in (cm.get("agents") or {}).values():
+        model: Dict[str, Any] = agent.setdefault("model", {})
+        model.update(provider="openai", base_url=fake_base_url, api_key="fake-key", auth_scheme="Bearer")
+        model.pop("base_url_ref", None)
+        model.pop("api_key_ref", None)
+    agents_path = os.path.join(workdir, "agents.yaml")
+    with open(agents_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(agents_all, f, allow_unicode=True, sort_keys=False)
+
+    fp_cm = app.setdefault("first_pass", {}).setdefault("committee", {})
+    fp_cm["config_path"] = agents_path
+    fp_cm["secrets_path"] = _abs_path(ROOT, fp_cm.get("secrets_path") or "configs/secrets.yaml")
+    app_path = os.path.join(workdir, "application.yaml")
+    with open(app_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(app, f, allow_unicode=True, sort_keys=False)
+    return app_path
+
+
+def _run_once(mode: str, log_path: str, args, cfg: fake_llm_server.FakeLLMConfig) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix=f"bench_p1_{mode}_")
+    server = fake_llm_server.start_in_thread(cfg)
+    try:
+        app_path = _write_configs(workdir, fake_llm_server.base_url(server))
+        db_path = os.path.join(workdir, "bench.sqlite3")
+        src = os.path.join(workdir, os.path.basename(log_path))
+        shutil.copyfile(log_path, src)
+
+        # 委员会会话默认按相对路径找 application.yaml, 在临时目录里找不到, 用环境变量显式给出绝对路径
+        app_cm = (load_yaml(app_path).get("first_pass") or {}).get("committee") or {}
+        env = dict(os.environ, LOG_ANALYZER_DB=db_path, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+                   LOG_ANALYZER_AGENTS_PATH=app_cm["config_path"], LOG_ANALYZER_SECRETS_PATH=app_cm["secrets_path"])
+        subprocess.run([sys.executable, "-c", f"from store import dao; dao.init_db({db_path!r})"],
+                       cwd=ROOT, env=env, check=True)
+        cmd = [sys.executable, "-m", "bin.p1_run_first_pass", "--path", src, "--config", app_path, "--force-flush"]
+        if mode == "async":
+            cmd += ["--async-llm", "--max-in-flight", str(args.max_in_flight)]
+        if args.no_miner:
+            cmd.append("--no-miner")
+        t0 = time.perf_counter()
+        # 在临时目录里运行, 日志与 data/ 产物不落到仓库
+        proc = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True)
+        wall = time.perf_counter() - t0
+
+        import sqlite3
+        with sqlite3.connect(db_path) as conn:
+            n_tpl = conn.execute("SELECT COUNT(*) FROM regex_template").fetchone()[0]
+        out = dict(mode=mode, ok=proc.returncode == 0, wall_s=wall, templates=n_tpl, **server.stats.snapshot())
+        if proc.returncode != 0:
+            out["stderr_tail"] = proc.stderr[-2000:]
+        return out
+    finally:
+        server.shutdown()
+        server.server_close()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="P1 对接本地 LLM 替身服务的端到端基准")
+    ap.add_argument("--path", default=None, help="原始日志路径; 不给则生成合成日志")
+    ap.add_argument("--lines", type=int, default=20000, help="合成日志行数")
+    ap.add_argument("--modes", default="sync,async", help="逗号分隔: sync / async")
+    ap.add_argument("--max-in-flight", type=int, default=2, help="async 模式的在途轮次上限")
+    ap.add_argument("--no-miner", action="store_true", help="关闭本地挖掘, 让全部未命中都走替身 LLM")
+    ap.add_argument("--keep", action="store_true", help="保留临时目录便于排查")
+    fake_llm_server.add_server_args(ap)
+    args = ap.parse_args()
+
+    tmp_log_dir = None
+    log_path = args.path
+    if not log_path:
+        tmp_log_dir = tempfile.mkdtemp(prefix="bench_p1_log_")
+        log_path = os.path.join(tmp_log_dir, "synthetic.log")
+        _synthetic_log(log_path, args.lines)
+
+    try:
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            r = _run_once(mode, log_path, args, fake_llm_server.config_from_args(args))
+            print(f"[{r['mode']:5s}] ok={r['ok']} wall={r['wall_s']:.2f}s templates={r['templates']} "
+                  f"llm_requests={r['requests']} errors={r['errors']} hangs={r['hangs']} "
+                  f"max_concurrent={r['max_concurrent']} tokens={r['prompt_tokens']}+{r['completion_tokens']}")
+            if not r["ok"]:
+                print(r.get("stderr_tail", ""))
+    finally:
+        if tmp_log_dir:
+            shutil.rmtree(tmp_log_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+时间戳处理基准：对比旧的“字符串时间戳 + strptime 分桶”与新的“整数秒 + 整数分桶”的单行开销。
+
+用法：
+  python -m bin.bench_ts_parse --lines 200000
+  python -m bin.bench_ts_parse --path xx.normal.txt
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import List
+
+from core import parser as parser_mod
+from core.aggregator import _minute_bucket
+
+
+def _synthetic_lines(n: int) -> List[str]:
+    out = []
+    for i in range(n):
+        s = i // 20
+        out.append(
+            f"[20250929_{(s // 3600) % 24:02d}{(s // 60) % 60:02d}{s % 60:02d}][{3499 + i * 0.05:.3f}][I][{40000 + i % 7}]"
+            f"[MOD:vgnss][SMOD:log][ INFO ] [RTK] sensor:{i}, age=1.00, ns_r=32"
+        )
+    return out
+
+
+def _load_lines(path: str, limit: int) -> List[str]:
+    out = []
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            out.append(line.rstrip("\n"))
+            if len(out) >= limit:
+                break
+    return out
+
+
+def _bench_legacy(parsed: List[parser_mod.ParsedLine]) -> float:
+    """旧路径：字符串 min/max 比较 + 每行 strptime 分钟分桶。"""
+    t0 = time.perf_counter()
+    first, last = "", ""
+    buckets = {}
+    for p in parsed:
+        ts = (p.ts or "").strip()
+        if ts:
+            if not first or ts < first:
+                first = ts
+            if not last or ts > last:
+                last = ts
+            b = datetime.strptime(ts, "%Y%m%d %H%M%S").replace(second=0).isoformat()
+            buckets[b] = buckets.get(b, 0) + 1
+    return time.perf_counter() - t0
+
+
+def _bench_epoch(parsed: List[parser_mod.ParsedLine]) -> float:
+    """新路径：整数秒 min/max 比较 + 整数分钟分桶。"""
+    none = parser_mod.TS_NONE
+    t0 = time.perf_counter()
+    first, last = none, none
+    buckets = {}
+    for p in parsed:
+        ts = p.epoch
+        if ts != none:
+            if first == none or ts < first:
+                first = ts
+            if ts > last:
+                last = ts
+            b = _minute_bucket(ts)
+            buckets[b] = buckets.get(b, 0) + 1
+    return time.perf_counter() - t0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="时间戳处理单行开销基准")
+    ap.add_argument("--path", default=None, help="可选：用真实 normal 文件做输入")
+    ap.add_argument("--lines", type=int, default=200000, help="参与基准的行数")
+    ap.add_argument("--repeat", type=int, default=3, help="重复次数，取最好成绩")
+    args = ap.parse_args()
+
+    lines = _load_lines(args.path, args.lines) if args.path else _synthetic_lines(args.lines)
+    t0 = time.perf_counter()
+    parsed = [p for p in (parser_mod.parse_fields(x) for x in lines) if p]
+    parse_cost = time.perf_counter() - t0
+    n = max(1, len(parsed))
+
+    legacy = min(_bench_legacy(parsed) for _ in range(args.repeat))
+    epoch = min(_bench_epoch(parsed) for _ in range(args.repeat))
+
+    print(f"lines={n}")
+    print(f"parse_fields (含 epoch)        : {parse_cost / n * 1e9:8.1f} ns/line")
+    print(f"legacy  字符串比较 + strptime  : {legacy / n * 1e9:8.1f} ns/line")
+    print(f"epoch   整数比较 + 整数分桶    : {epoch / n * 1e9:8.1f} ns/line")
+    print(f"单行节省                       : {(legacy - epoch) / n * 1e9:8.1f} ns/line ({legacy / max(epoch, 1e-12):.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+本地 OpenAI 兼容替身服务：用于在不访问真实网关的情况下压测委员会的吞吐、重试与超时行为。
+
+- 接口: POST /v1/chat/completions (兼容不带 /v1 前缀), GET /v1/models, GET /stats
+- 应答:
+    * 脚本模式: --script 指向 JSON 文件 {key: content}, 与 tests/fakes.FakeLLM 的 scripted_outputs 同构;
+      用户消息中包含某个 key 即返回对应 content, 否则用 "default", 都没有再走启发式
+    * 启发式: 把用户消息里的样本 JSON 数组用本地挖掘器聚簇, 输出 _lc_draft 期望的 JSON 模板数组
+- 可配置: 固定延迟 + 抖动 + 按输出 token 计的生成耗时、错误率与错误码、挂起率(触发客户端超时)、usage token 数
+
+用法：
+  python -m bin.fake_llm_server --port 18080 --latency-ms 800 --jitter-ms 200 --error-rate 0.05
+  # agents.yaml 中 drafter.model.base_url 指向 http://127.0.0.1:18080/v1, api_key 任意
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from core import miner as miner_mod
+from core.committee import _estimate_tokens
+
+
+class FakeLLMConfig:
+    def __init__(self, script: Optional[Dict[str, str]] = None, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 ms_per_output_token: float = 0.0, error_rate: float = 0.0, error_codes=(429, 500),
+                 hang_rate: float = 0.0, hang_s: float = 30.0, prompt_tokens: Optional[int] = None,
+                 completion_tokens: Optional[int] = None, model: str = "fake-llm", seed: Optional[int] = None):
+        self.script = dict(script or {})
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.ms_per_output_token = float(ms_per_output_token)
+        self.error_rate = float(error_rate)
+        self.error_codes = tuple(int(c) for c in error_codes) or (500,)
+        self.hang_rate = float(hang_rate)
+        self.hang_s = float(hang_s)
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.model = model
+        self.rng = random.Random(seed)
+
+
+class FakeLLMStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.hangs = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.max_concurrent = 0
+        self._active = 0
+
+    def enter(self):
+        with self._lock:
+            self.requests += 1
+            self._active += 1
+            self.max_concurrent = max(self.max_concurrent, self._active)
+
+    def leave(self):
+        with self._lock:
+            self._active -= 1
+
+    def add(self, **kw):
+        with self._lock:
+            for k, v in kw.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(requests=self.requests, errors=self.errors, hangs=self.hangs,
+                        prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens,
+                        max_concurrent=self.max_concurrent)
+
+
+def _message_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content)
+    return str(content or "")
+
+
+def _extract_samples(user_text: str) -> List[str]:
+    """_lc_draft 的用户消息是样本 JSON 数组; 解析失败时按行切分。"""
+    try:
+        data = json.loads(user_text)
+        if isinstance(data, list):
+            return [x for x in data if isinstance(x, str) and x.strip()]
+    except Exception:
+        pass
+    return [ln for ln in user_text.splitlines() if ln.strip()]
+
+
+def heuristic_answer(samples: List[str]) -> str:
+    """用本地挖掘器把样本聚簇: 可泛化的簇给出通配模板, 其余逐条转义, 输出 _lc_draft 期望的 JSON 数组。"""
+    miner = miner_mod.DrainMiner()
+    cands, rest = miner_mod.mine_candidates(miner, samples, min_support=2)
+    out = [dict(pattern=c["pattern"], sample_log=c["sample_log"], semantic_info="替身服务启发式模板", advise="")
+           for c in cands]
+    for s in rest:
+        out.append(dict(pattern="^" + re.escape(s) + "$", sample_log=s, semantic_info="替身服务逐条模板", advise=""))
+    return json.dumps(out, ensure_ascii=False, separators=(",", ":"))
+
+
+def _answer(cfg: FakeLLMConfig, user_text: str) -> str:
+    for key, content in cfg.script.items():
+        if key != "default" and key in user_text:
+            return content
+    if "default" in cfg.script:
+        return cfg.script["default"]
+    return heuristic_answer(_extract_samples(user_text))
+
+
+def _make_handler(cfg: FakeLLMConfig, stats: FakeLLMStats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send_json(self, code: int, obj: Dict[str, Any]):
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": cfg.model, "object": "model"}]})
+            elif self.path.rstrip("/") == "/stats":
+                self._send_json(200, stats.snapshot())
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                req = json.loads(self.rfile.read(length) or b"{}")
+            except Exception:
+                self._send_json(400, {"error": {"message": "invalid json"}})
+                return
+            stats.enter()
+            try:
+                self._complete(req)
+            finally:
+                stats.leave()
+
+        def _complete(self, req: Dict[str, Any]):
+            messages = req.get("messages") or []
+            prompt_text = "".join(_message_text(m.get("content")) for m in messages if isinstance(m, dict))
+            user_text = next((_message_text(m.get("content")) for m in reversed(messages)
+                              if isinstance(m, dict) and m.get("role") == "user"), "")
+
+            delay = cfg.latency_ms + (cfg.rng.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0.0)
+            roll = cfg.rng.random()
+            if roll < cfg.hang_rate:
+                stats.add(hangs=1)
+                time.sleep(cfg.hang_s)
+                self._send_json(504, {"error": {"message": "fake upstream timeout", "type": "timeout"}})
+                return
+            if roll < cfg.hang_rate + cfg.error_rate:
+                stats.add(errors=1)
+                time.sleep(max(0.0, delay) / 1000.0)
+                code = cfg.rng.choice(cfg.error_codes)
+                self._send_json(code, {"error": {"message": f"fake error {code}", "type": "fake_error", "code": code}})
+                return
+
+            content = _answer(cfg, user_text)
+            p_tok = cfg.prompt_tokens if cfg.prompt_tokens is not None else _estimate_tokens(prompt_text)
+            c_tok = cfg.completion_tokens if cfg.completion_tokens is not None else _estimate_tokens(content)
+            time.sleep(max(0.0, delay + c_tok * cfg.ms_per_output_token) / 1000.0)
+            stats.add(prompt_tokens=p_tok, completion_tokens=c_tok)
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": req.get("model") or cfg.model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": p_tok, "completion_tokens": c_tok, "total_tokens": p_tok + c_tok},
+            })
+
+    return Handler
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, cfg: Optional[FakeLLMConfig] = None) -> ThreadingHTTPServer:
+    """创建替身服务 (port=0 自动分配); server.stats 为计数器, 调用方自行 serve_forever / shutdown。"""
+    cfg = cfg or FakeLLMConfig()
+    stats = FakeLLMStats()
+    server = ThreadingHTTPServer((host, port), _make_handler(cfg, stats))
+    server.daemon_threads = True
+    server.stats = stats
+    server.cfg = cfg
+    return server
+
+
+def start_in_thread(cfg: Optional[FakeLLMConfig] = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    server = make_server(host, port, cfg)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def load_script(path: Optional[str]) -> Dict[str, str]:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # 值允许直接写 JSON 数组/对象, 统一转成 content 字符串
+    return {k: v if isinstance(v, str) else json.dumps(v, ensure_ascii=False) for k, v in data.items()}
+
+
+def add_server_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--script", default=None, help="脚本应答 JSON 文件 {key: content}, 结构同 FakeLLM.scripted_outputs")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="每次请求的固定延迟")
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="延迟的均匀抖动幅度")
+    ap.add_argument("--ms-per-output-token", type=float, default=0.0, help="按输出 token 计的生成耗时")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="返回错误码的请求比例")
+    ap.add_argument("--error-codes", default="429,500", help="错误码列表, 逗号分隔")
+    ap.add_argument("--hang-rate", type=float, default=0.0, help="挂起不应答的请求比例, 用于触发客户端超时")
+    ap.add_argument("--hang-s", type=float, default=30.0, help="挂起时长(秒)")
+    ap.add_argument("--prompt-tokens", type=int, default=None, help="固定 usage.prompt_tokens, 默认按提示词估计")
+    ap.add_argument("--completion-tokens", type=int, default=None, help="固定 usage.completion_tokens, 默认按输出估计")
+    ap.add_argument("--seed", type=int, default=None, help="随机种子, 便于复现错误注入")
+
+
+def config_from_args(args) -> FakeLLMConfig:
+    return FakeLLMConfig(
+        script=load_script(args.script),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        ms_per_output_token=args.ms_per_output_token,
+        error_rate=args.error_rate,
+        error_codes=[c for c in args.error_codes.split(",") if c.strip()],
+        hang_rate=args.hang_rate,
+        hang_s=args.hang_s,
+        prompt_tokens=args.prompt_tokens,
+        completion_tokens=args.completion_tokens,
+        seed=args.seed,
+    )
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=18080)
+    add_server_args(ap)
+    args = ap.parse_args()
+
+    server = make_server(args.host, args.port, config_from_args(args))
+    print(f"[fake-llm] listening on {base_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"[fake-llm] stats: {server.stats.snapshot()}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
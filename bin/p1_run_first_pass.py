@@ -8,17 +8,27 @@
 2) 匹配与缓冲基于 xx_uniq.txt 进行, 减少重复匹配
 3) 阈值触发 LLM 改为【同步】执行, 新模板写库后立即用同步索引重建使之生效
    - 使用 Indexer.build_new_index_sync 同步原子切换活动索引
+   - 可选 --async-llm: 委员会轮次在后台线程执行(在途轮次有上限), 主循环继续用当前索引匹配,
+     每轮完成切换索引后复查缓冲中积压的未命中
 4) 新增: 将 run_id 与 file_id 通过 run_context 传入委员会, 便于按需记录“会话内容”
+5) 结束前用最终索引 (pattern, 原始关键文本, 与 P2 一致) 对全部 uniq 记录再匹配一遍,
+   写出 xx_uniq_assign.bin 并记下模板代数, 模板集合未变时 P2 uniq 模式直接按归属聚合
 """
 import os, argparse, sys
+import itertools
 import re
-from typing import List, Dict, Any
+import shutil
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
 # 现有依赖
 from store import dao
 from core import reader, preprocessor, parser as parser_mod, matcher, buffer as buffer_mod, indexer as indexer_mod, committee, templates
 from core.utils.config import load_yaml
-from core import keytext
+from core import keytext, uniq_spill, uniqbin, uniq_assign, miner as miner_mod, selection as selection_mod, validation, slowlog
+from core.symbols import SymbolTable
 import logging
 from core.utils.logger import get_logger  
 logger = get_logger("myapp", level=logging.DEBUG, rotate="day")  
@@ -57,6 +67,16 @@ def _derive_uniq_paths(normal_path: str) -> tuple:
     return base + "_uniq.txt", base + "_uniq_with_count.tsv"
 
 
+def _derive_uniq_bin_path(normal_path: str) -> str:
+    base, _ = os.path.splitext(normal_path)
+    return base + "_uniq.bin"
+
+
+def _derive_uniq_assign_path(normal_path: str) -> str:
+    base, _ = os.path.splitext(normal_path)
+    return base + "_uniq_assign.bin"
+
+
 def write_normal_file(path: str, out_path: str, chunk_lines: int = 10000) -> int:
     """在 normalize_lines 之前先清洗 ANSI/控制字符, 保持一行一日志与轻量标准化一致性。"""
     os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
@@ -87,79 +107,233 @@ def _safe_field(value: Any) -> str:
     return str(value).replace("\t", " ")
 
 
-def build_uniq_files(normal_path: str, chunk_lines: int = 10000) -> tuple:
-    """从 xx.normal.txt 抽取关键文本, 排序去重并计数, 产出 xx_uniq.txt 与 xx_uniq_with_count.tsv"""
+def _format_hist(hist: Dict[int, int], min_ts: int) -> str:
+    """TSV 直方图列: 相对 min_ts 所在分钟的偏移:行数, 逗号分隔, 如 0:3,1:5,17:2。"""
+    if not hist or min_ts == parser_mod.TS_NONE:
+        return ""
+    base = min_ts - min_ts % 60
+    return ",".join(f"{(m - base) // 60}:{hist[m]}" for m in sorted(hist))
+
+
+def build_uniq_files(normal_path: str, chunk_lines: int = 10000, spill_keys: int = 0,
+                     write_tsv: bool = True, write_bin: bool = True, time_hist: bool = True) -> tuple:
+    """从 xx.normal.txt 抽取关键文本, 排序去重并计数, 产出 xx_uniq.txt 与 xx_uniq_with_count.tsv
+
+    spill_keys > 0 时启用外排: 内存中的去重关键文本数超过该阈值即排序溢写为有序段,
+    最后 k 路归并输出, 用于关键文本基数极高(未归一的 ID / 十六进制串等)的文件。
+    write_bin 时同时产出 xx_uniq.bin (供 P2 mmap 直读); write_tsv 为 False 时不再导出 TSV,
+    同时删除旧的 TSV 以免 P2 回退时读到上一轮的产物, 返回的 TSV 路径为空串。
+    mod / smod / level 在计数期间以符号表整数编码保存, 写产物时再解码。
+    time_hist 时每个关键文本另记稀疏的分钟直方图 {分钟起点整数秒: 行数}, 写入 TSV 第 10 列与 bin 的直方图段,
+    P2 uniq 模式据此折叠出按模板的时间桶。
+    """
     uniq_txt, uniq_tsv = _derive_uniq_paths(normal_path)
+    uniq_bin = _derive_uniq_bin_path(normal_path)
+    if not write_tsv and os.path.exists(uniq_tsv):
+        os.remove(uniq_tsv)
+    symbols = SymbolTable()
+    os.makedirs(os.path.dirname(uniq_txt) or ".", exist_ok=True)
 
     counter: Dict[str, Dict[str, Any]] = {}
-    for chunk in reader.read_in_chunks(normal_path, chunk_lines=chunk_lines):
-        for line in chunk:
+    run_dir = None
+    run_paths: List[str] = []
+    try:
+        for chunk in reader.read_in_chunks(normal_path, chunk_lines=chunk_lines):
+            for line in chunk:
+                if not line:
+                    continue
+                key_text = keytext.extract_key_text(line)
+                if not key_text:
+                    continue
+                parsed = parser_mod.parse_fields(line, symbols)
+                # 编码 0 即空串, 首见字段的“空值补齐”判断保持不变
+                mod, smod, level = parsed.dims[:3] if parsed else (0, 0, 0)
+                epoch = parsed.epoch if parsed else parser_mod.TS_NONE
+                sample_original = parsed.key_text if parsed else _extract_original_key_text(line)
+
+                info = counter.get(key_text)
+                if info is None:
+                    info = {
+                        "count": 0,
+                        "mod": mod,
+                        "smod": smod,
+                        "min_ts": epoch,
+                        "max_ts": epoch,
+                        "level": level,
+                        "sample_log": key_text,
+                        "sample_log_orien": sample_original,
+                    }
+                    if time_hist:
+                        info["hist"] = {}
+                    counter[key_text] = info
+                info["count"] += 1
+                # 时间戳为整数秒, TS_NONE(-1) 表示缺失
+                if epoch != parser_mod.TS_NONE:
+                    if info["min_ts"] == parser_mod.TS_NONE or epoch < info["min_ts"]:
+                        info["min_ts"] = epoch
+                    if epoch > info["max_ts"]:
+                        info["max_ts"] = epoch
+                    if time_hist:
+                        hist = info["hist"]
+                        m = epoch - epoch % 60
+                        hist[m] = hist.get(m, 0) + 1
+                if not info["mod"] and mod:
+                    info["mod"] = mod
+                if not info["smod"] and smod:
+                    info["smod"] = smod
+                if not info["level"] and level:
+                    info["level"] = level
+                if not info["sample_log_orien"] and sample_original:
+                    info["sample_log_orien"] = sample_original
+
+                # 逐条检查阈值: 按块检查时, 一个块内全是新键即可超出阈值 chunk_lines 条
+                if spill_keys and len(counter) >= spill_keys:
+                    if run_dir is None:
+                        run_dir = tempfile.mkdtemp(prefix="uniq_runs_", dir=os.path.dirname(uniq_txt) or ".")
+                    run_paths.append(uniq_spill.write_sorted_run(counter, run_dir, len(run_paths)))
+                    logger.info(f"[P1] uniq 溢写有序段 #{len(run_paths)}: keys={len(counter)}")
+                    counter.clear()
+
+        if run_paths:
+            if counter:
+                run_paths.append(uniq_spill.write_sorted_run(counter, run_dir, len(run_paths)))
+                counter.clear()
+            merged = uniq_spill.iter_merged_runs(run_paths)
+        else:
+            merged = ((k, counter[k]) for k in sorted(counter.keys()))
+
+        uniq_count = 0
+        uniq_distinct = 0
+        f2 = open(uniq_tsv, "w", encoding="utf-8") if write_tsv else None
+        bw = uniqbin.UniqBinWriter(uniq_bin) if write_bin else None
+        try:
+            with open(uniq_txt, "w", encoding="utf-8") as f1:
+                for k, info in merged:
+                    f1.write(k + "\n")
+                    mod = symbols.decode("mod", info["mod"])
+                    smod = symbols.decode("smod", info["smod"])
+                    level = symbols.decode("level", info["level"])
+                    if f2 is not None:
+                        row = [
+                            str(info["count"]),
+                            _safe_field(k),
+                            _safe_field(mod),
+                            _safe_field(smod),
+                            parser_mod.epoch_to_ts(info["min_ts"]),
+                            parser_mod.epoch_to_ts(info["max_ts"]),
+                            _safe_field(level),
+                            _safe_field(info.get("sample_log")),
+                            # 原始关键文本可逆转义, P2 读回的就是下面 bin / 归属产物所用的同一个键
+                            keytext.encode_tsv_key(info.get("sample_log_orien") or k),
+                        ]
+                        if time_hist:
+                            row.append(_format_hist(info.get("hist"), info["min_ts"]))
+                        f2.write("\t".join(row) + "\n")
+                    if bw is not None:
+                        bw.add(info["count"], k, info.get("sample_log_orien") or k,
+                               mod, smod, level,
+                               info.get("min_ts"), info.get("max_ts"),
+                               sorted(info["hist"].items()) if info.get("hist") else None)
+                    uniq_count += info["count"]
+                    uniq_distinct += 1
+            if bw is not None:
+                bw.close()
+                bw = None
+        finally:
+            if f2 is not None:
+                f2.close()
+            if bw is not None:
+                bw.discard()
+    finally:
+        if run_dir is not None:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    return uniq_txt, (uniq_tsv if write_tsv else ""), uniq_count, uniq_distinct
+
+
+def iter_uniq_raw_keys(uniq_bin: str, uniq_tsv: str) -> Iterator[str]:
+    """
+    按产物记录顺序逐条读回原始关键文本 (即 P2 用于匹配的文本), 优先 bin, 其次 TSV;
+    流式读取, 外排模式下也不在内存中保留整份关键文本。
+    """
+    if uniq_bin and os.path.exists(uniq_bin):
+        with uniqbin.UniqBinReader(uniq_bin) as r:
+            for i in range(len(r)):
+                yield r.key_text_raw(i)
+        return
+    with open(uniq_tsv, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
             if not line:
                 continue
-            key_text = keytext.extract_key_text(line)
-            if not key_text:
+            parts = line.split("\t")
+            # 与 P2 读 TSV 一致: 第 9 列为可逆转义的原始关键文本, 缺失时退回归一关键文本
+            raw = keytext.decode_tsv_key(parts[8]) if len(parts) > 8 else ""
+            yield raw or parts[1].strip()
+
+
+def mine_misses(miner, misses: List[str], write_and_swap, get_active, min_support: int = 2,
+                max_wildcard_ratio: float = 0.5) -> Tuple[List[Dict[str, Any]], List[str], List[Tuple[str, int]]]:
+    """
+    本地挖掘快速通道: 每个微批的原始未命中先送挖掘器, 再进多样性缓冲。
+    缓冲的近重复过滤会去掉 Drain 聚簇所需的同结构样本, 放在其后挖掘器几乎产不出候选。
+    结构简单的簇经 write_and_swap 写模板并切换索引; 以切换后的活动索引为准划分:
+    返回 (本地候选, 仍未命中需进缓冲的 key, 已被新模板命中的 (key, template_id))。
+    """
+    if miner is None or not misses:
+        return [], misses, []
+    cands, _ = miner_mod.mine_candidates(miner, misses, min_support=min_support,
+                                         max_wildcard_ratio=max_wildcard_ratio)
+    if not cands:
+        return [], misses, []
+    write_and_swap(cands, misses)
+    active = get_active()
+    rest: List[str] = []
+    hits: List[Tuple[str, int]] = []
+    for k in misses:
+        tid = active.match_one(k)
+        if tid is None:
+            rest.append(k)
+        else:
+            hits.append((k, tid))
+    return cands, rest, hits
+
+
+class _KeyDictWriter:
+    """
+    全局字典写入攒批: 热循环里只记内存, 每 flush_batches 个微批或结束时一个事务落库,
+    避免每个微批都开连接、提交与 fsync。同一 key 多次写入时归属取最后一次, 送审次数累加。
+    """
+
+    def __init__(self, file_id: str, flush_batches: int = 50):
+        self.file_id = file_id
+        self.flush_batches = max(1, int(flush_batches))
+        self._rows: Dict[str, List[Any]] = {}
+        self._batches = 0
+
+    def add(self, rows, attempted: bool = False) -> None:
+        inc = 1 if attempted else 0
+        for k, tid in rows:
+            if not k:
                 continue
-            parsed = parser_mod.parse_fields(line)
-            mod = parsed.mod if parsed else ""
-            smod = parsed.smod if parsed else ""
-            ts = parsed.ts if parsed else ""
-            level = parsed.level if parsed else ""
-            sample_original = parsed.key_text if parsed else _extract_original_key_text(line)
-
-            info = counter.get(key_text)
-            if info is None:
-                info = {
-                    "count": 0,
-                    "mod": mod,
-                    "smod": smod,
-                    "min_ts": ts or "",
-                    "max_ts": ts or "",
-                    "level": level or "",
-                    "sample_log": key_text,
-                    "sample_log_orien": sample_original,
-                }
-                counter[key_text] = info
-            info["count"] += 1
-            if ts:
-                if not info["min_ts"] or ts < info["min_ts"]:
-                    info["min_ts"] = ts
-                if not info["max_ts"] or ts > info["max_ts"]:
-                    info["max_ts"] = ts
-            if not info["mod"] and mod:
-                info["mod"] = mod
-            if not info["smod"] and smod:
-                info["smod"] = smod
-            if not info["level"] and level:
-                info["level"] = level
-            if not info["sample_log_orien"] and sample_original:
-                info["sample_log_orien"] = sample_original
-
-    uniq_list = sorted(counter.keys())
-    os.makedirs(os.path.dirname(uniq_txt) or ".", exist_ok=True)
-
-    with open(uniq_txt, "w", encoding="utf-8") as f1:
-        for k in uniq_list:
-            f1.write(k + "\n")
-
-    with open(uniq_tsv, "w", encoding="utf-8") as f2:
-        for k in uniq_list:
-            info = counter[k]
-            row = [
-                str(info["count"]),
-                _safe_field(k),
-                _safe_field(info.get("mod")),
-                _safe_field(info.get("smod")),
-                _safe_field(info.get("min_ts")),
-                _safe_field(info.get("max_ts")),
-                _safe_field(info.get("level")),
-                _safe_field(info.get("sample_log")),
-                _safe_field(info.get("sample_log_orien")),
-            ]
-            f2.write("\t".join(row) + "\n")
-
-    uniq_count = sum(info["count"] for info in counter.values())
-    uniq_distinct = len(uniq_list)
-    return uniq_txt, uniq_tsv, uniq_count, uniq_distinct
+            cur = self._rows.get(k)
+            if cur is None:
+                self._rows[k] = [tid, inc]
+            else:
+                cur[0] = tid
+                cur[1] += inc
+
+    def batch_done(self) -> None:
+        self._batches += 1
+        if self._batches >= self.flush_batches:
+            self.flush()
+
+    def flush(self) -> None:
+        self._batches = 0
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, {}
+        dao.upsert_key_dict_rows(((k, tid, inc) for k, (tid, inc) in rows.items()), file_id=self.file_id)
 
 
 class _KeyTextObj:
@@ -178,8 +352,14 @@ def main():
     ap.add_argument("--chunk-lines", type=int, default=None, help="大块读取行数")
     ap.add_argument("--micro-batch", type=int, default=None, help="微批大小")
     ap.add_argument("--match-workers", type=int, default=None, help="每批匹配并发 worker 数")
+    ap.add_argument("--uniq-spill-keys", type=int, default=None, help="uniq 外排阈值: 内存去重关键文本数超过即溢写, 0 表示关闭")
     ap.add_argument("--config", type=str, default="configs/application.yaml", help="应用配置")
     ap.add_argument("--force-flush", action="store_true", help="结束时强制冲洗缓冲区并同步调用 LLM")
+    ap.add_argument("--async-llm", action="store_true", help="委员会轮次后台执行, 主循环继续匹配后续微批")
+    ap.add_argument("--max-in-flight", type=int, default=None, help="异步模式下同时在途的委员会轮次上限")
+    ap.add_argument("--no-miner", action="store_true", help="关闭本地模板挖掘, 所有未命中样本都交给委员会")
+    ap.add_argument("--no-selection", action="store_true", help="关闭候选覆盖选择, 委员会候选全部写库")
+    ap.add_argument("--no-key-dict", action="store_true", help="不使用全局关键文本字典, 所有关键文本都重新匹配")
     args = ap.parse_args()
 
     appcfg = load_yaml(args.config) or {}
@@ -193,11 +373,22 @@ def main():
     match_workers = args.match_workers or fp.get("match_workers_per_batch", 1)
     size_threshold = args.size_threshold or bufcfg.get("size_threshold", 100)
     max_per_mb = args.max_per_micro_batch or bufcfg.get("max_per_micro_batch", 15)
+    uniqcfg = fp.get("uniq") or {}
+    uniq_spill_keys = args.uniq_spill_keys if args.uniq_spill_keys is not None else uniqcfg.get("spill_keys", 0)
+    uniq_write_tsv = bool(uniqcfg.get("write_tsv", True))
+    uniq_write_bin = bool(uniqcfg.get("write_bin", True))
+    uniq_time_hist = bool(uniqcfg.get("time_hist", True))
+    uniq_write_assign = bool(uniqcfg.get("write_assign", True))
+    use_key_dict = (not args.no_key_dict) and bool((fp.get("key_dict") or {}).get("enabled", True))
+    key_dict_max_attempts = max(1, int((fp.get("key_dict") or {}).get("max_attempts", 3)))
+    key_dict_flush_batches = int((fp.get("key_dict") or {}).get("flush_batches", 50))
 
     # 从 agents.yaml 的 committee.backend 读取后端, 传入 committee.run 的 model 形参以保持兼容
     committee_backend = cmcfg.get("backend", cmcfg.get("model", "langgraph"))
     agents_cfg_path = cmcfg.get("config_path", "configs/agents.yaml")
     phase = cmcfg.get("phase", "v1点0")
+    async_llm = args.async_llm or bool(cmcfg.get("async_llm", False))
+    max_in_flight = max(1, int(args.max_in_flight or cmcfg.get("max_in_flight", 2)))
 
     path = args.path
     normal_path = _derive_normal_path(path, args.normal_out)
@@ -210,28 +401,56 @@ def main():
     # 1) 写 normal
     pre_lines = write_normal_file(path, normal_path, chunk_lines=chunk_lines)
 
-    # 2) 一次性抽取 MODULE/SUBMODULE 并 upsert
-    mods, mod_smods, parsed_all = set(), set(), []
+    # 2) 一次性抽取 MODULE/SUBMODULE 并 upsert (按整数编码去重, 不再常驻全部 ParsedLine)
+    symbols = SymbolTable()
+    mod_codes, mod_smod_codes, parsed_total = set(), set(), 0
     for chunk in reader.read_in_chunks(normal_path, chunk_lines=chunk_lines):
         for line in chunk:
-            p = parser_mod.parse_fields(line)
+            p = parser_mod.parse_fields(line, symbols)
             if p:
-                parsed_all.append(p)
-                if p.mod:
-                    mods.add(p.mod)
-                if p.mod and p.smod:
-                    mod_smods.add((p.mod, p.smod))
+                parsed_total += 1
+                mod_c, smod_c = p.dims[0], p.dims[1]
+                if mod_c:
+                    mod_codes.add(mod_c)
+                    if smod_c:
+                        mod_smod_codes.add((mod_c, smod_c))
+    mods = {symbols.decode("mod", c) for c in mod_codes}
+    mod_smods = {(symbols.decode("mod", m), symbols.decode("smod", sm)) for m, sm in mod_smod_codes}
     dao.upsert_modules(mods)
     dao.upsert_submodules(mod_smods)
 
-    # 3) 生成 uniq 文件
-    uniq_txt, uniq_tsv, uniq_total, uniq_distinct = build_uniq_files(normal_path, chunk_lines=chunk_lines)
-    print(f"[P1] 产物: uniq={uniq_txt} uniq_with_count={uniq_tsv} normal_lines={pre_lines} uniq_total={uniq_total} uniq_distinct={uniq_distinct}")
+    # 3) 生成 uniq 文件; 旧的关键文本归属与新产物不再对齐, 先删除, 结束前重写
+    uniq_assign_path = _derive_uniq_assign_path(normal_path)
+    if os.path.exists(uniq_assign_path):
+        os.remove(uniq_assign_path)
+    uniq_txt, uniq_tsv, uniq_total, uniq_distinct = build_uniq_files(
+        normal_path, chunk_lines=chunk_lines, spill_keys=uniq_spill_keys,
+        write_tsv=uniq_write_tsv, write_bin=uniq_write_bin, time_hist=uniq_time_hist,
+    )
+    uniq_bin = _derive_uniq_bin_path(normal_path) if uniq_write_bin else ""
+    print(f"[P1] 产物: uniq={uniq_txt} uniq_with_count={uniq_tsv or '-'} uniq_bin={uniq_bin or '-'} normal_lines={pre_lines} uniq_total={uniq_total} uniq_distinct={uniq_distinct}")
 
     # 4) 装载活动索引与缓冲器
     idx = indexer_mod.Indexer()
+    slow_rec = slowlog.from_config(appcfg, run_id)
+    idx.set_slow_recorder(slow_rec)
     idx.load_initial()
-    dbuf = buffer_mod.DiversityBuffer(size_threshold=size_threshold, max_per_micro_batch=max_per_mb)
+    divcfg = bufcfg.get("diversity") or {}
+    dbuf = buffer_mod.DiversityBuffer(
+        size_threshold=size_threshold,
+        max_per_micro_batch=max_per_mb,
+        jaccard_threshold=divcfg.get("jaccard_threshold", 0.7),
+        num_perm=divcfg.get("num_perm", 64),
+        bands=divcfg.get("bands", 16),
+    )
+
+    minercfg = fp.get("miner") or {}
+    miner = None
+    if not args.no_miner and bool(minercfg.get("enabled", True)):
+        miner = miner_mod.DrainMiner(
+            depth=minercfg.get("depth", 2),
+            sim_threshold=minercfg.get("sim_threshold", 0.5),
+        )
 
     # 5) 用 uniq.txt 作为匹配输入, 切分微批
     with open(uniq_txt, "r", encoding="utf-8") as f:
@@ -242,83 +461,284 @@ def main():
 
     micro_batches = _split_batches(key_lines, micro_batch)
 
-    def _run_llm_sync(samples: List[str]):
-        """同步触发智能体委员会, 写模板并同步原子切换索引。"""
-        if not samples:
-            return
+    selcfg = fp.get("selection") or {}
+    use_selection = (not args.no_selection) and bool(selcfg.get("enabled", True))
+    sel_corpus: List[Any] = []
+
+    def _selection_corpus():
+        """本文件 uniq 关键文本与行数, 首次选择时才装载; 没有计数产物时按每条 1 计。"""
+        if not sel_corpus:
+            c = validation.load_recent_uniq_keys([path], max_keys=len(key_lines) or 1)
+            if not len(c):
+                c = validation.Corpus("uniq", key_lines)
+            sel_corpus.append(c)
+        return sel_corpus[0]
+
+    def _write_and_swap(cands: List[Dict[str, Any]], samples: List[str] = ()):
+        """写模板并同步重建索引; 加锁保证多轮并发时“写库-重建-切换”串行, 不会用旧快照覆盖新索引。"""
+        with index_lock:
+            if use_selection and cands:
+                # 在锁内对照最新活动索引做覆盖选择, 并发轮次之间不会重复写同一批覆盖
+                res = selection_mod.select_candidates(
+                    cands, _selection_corpus(), samples=samples,
+                    active=idx.get_active(), min_gain=selcfg.get("min_gain", 1),
+                )
+                logger.info(f"[P1] 候选选择: 输入={len(cands)} 选中={len(res.selected)} "
+                            f"已被活动模板覆盖={len(res.covered_by_active)} 冗余={len(res.redundant)} "
+                            f"覆盖行数={res.covered_weight}")
+                cands = res.selected
+            if not cands:
+                return
+            templates.write_candidates(cands)
+            idx.build_new_index_sync()
+
+    def _mine_local(misses: List[str]) -> List[str]:
+        """原始未命中先经本地挖掘, 返回新索引仍未命中、需进入缓冲的 key。"""
+        if miner is None or not misses:
+            return misses
+        local_cands, rest, hits = mine_misses(
+            miner, misses, _write_and_swap, idx.get_active,
+            min_support=minercfg.get("min_support", 2),
+            max_wildcard_ratio=minercfg.get("max_wildcard_ratio", 0.5),
+        )
+        if local_cands:
+            if use_key_dict and hits:
+                dict_writer.add(hits)
+            logger.info(f"[P1] 本地挖掘: 候选={len(local_cands)} 命中未命中={len(hits)} 进缓冲候选={len(rest)}")
+        return rest
+
+    def _still_missing(samples: List[str]) -> List[str]:
+        """缓冲样本可能已被之后批次挖掘出的模板覆盖, 送委员会前按当前活动索引再筛一遍。"""
+        active = idx.get_active()
+        return [s for s in samples if active.match_one(s) is None]
+
+    def _committee_round(samples: List[str]) -> int:
+        """调用一次智能体委员会, 候选去重后写库并切换索引; 异步模式下在后台线程执行。"""
         # 将 run_id 与 file_id 传入, 供委员会在 trace_conversations 开启时记录“会话内容”
-        cands = committee.run(samples, model=committee_backend, phase=phase, config_path=agents_cfg_path,
-                              run_context={"file_id": file_id, "run_id": run_id})
         cands = committee.run(
             samples,
             model=committee_backend,
             phase=phase,
             config_path=agents_cfg_path,
             run_context={"file_id": file_id, "run_id": run_id},
-        ) 
-        if cands:
-            seen = set()
-            deduped = []
-            for c in cands:
-                pnorm = (c.get("pattern_nomal") or c.get("pattern") or "").strip()
-                if not pnorm or pnorm in seen:
+        )
+        if not cands:
+            return 0
+        seen = set()
+        deduped = []
+        for c in cands:
+            pnorm = (c.get("pattern_nomal") or c.get("pattern") or "").strip()
+            if not pnorm or pnorm in seen:
+                continue
+            seen.add(pnorm)
+            deduped.append(c)
+        for cand in deduped:
+            logger.debug(f"{cand.get('pattern_nomal')}~~~{cand.get('semantic_info')}~~{cand.get('sample_log')}")
+        # 同步重建索引并切换, 让新规则立刻生效
+        _write_and_swap(deduped, samples)
+        return len(deduped)
+
+    def _run_llm_sync(samples: List[str]):
+        """同步触发智能体委员会, 写模板并同步原子切换索引。"""
+        if not samples:
+            return
+        rest = _still_missing(samples)
+        if rest:
+            _committee_round(rest)
+        _record_sent_samples(samples)
+
+    def _run_llm_async(samples: List[str]):
+        """异步提交一轮委员会; 在途轮次达到上限时先等最早完成的一轮, 形成背压。"""
+        if not samples:
+            return
+        rest = _still_missing(samples)
+        if not rest:
+            _record_sent_samples(samples)
+            return
+        while len(inflight) >= max_in_flight:
+            _reap_rounds(block=True)
+        inflight.append((llm_pool.submit(_committee_round, rest), samples))
+
+    def _reap_rounds(block: bool = False):
+        """回收已完成的委员会轮次: 记入全局字典, 并用新索引复查缓冲中积压的未命中。"""
+        nonlocal recheck_hits
+        if not inflight:
+            return
+        if block:
+            wait([f for f, _ in inflight], return_when=FIRST_COMPLETED)
+        done = [(f, s) for f, s in inflight if f.done()]
+        if not done:
+            return
+        inflight[:] = [(f, s) for f, s in inflight if not f.done()]
+        for fut, samples in done:
+            fut.result()
+            _record_sent_samples(samples)
+        if dbuf.samples:
+            active = idx.get_active()
+            hits = {k for k in dbuf.samples if active.match_one(k) is not None}
+            recheck_hits += dbuf.discard(hits)
+            if use_key_dict and hits:
+                dict_writer.add((k, active.match_one(k)) for k in hits)
+
+    def _record_sent_samples(samples: List[str]):
+        """
+        已送入委员会的样本写入全局字典并累计送审次数: 用最新索引重匹配, 命中记模板, 未命中记 None。
+        None 的 key 在送审次数达到 key_dict.max_attempts 之前, 后续文件仍会再送委员会。
+        """
+        if not use_key_dict or not samples:
+            return
+        active = idx.get_active()
+        dict_writer.add(((k, active.match_one(k)) for k in samples), attempted=True)
+
+    def _filter_known_keys(batch: List[str]) -> List[str]:
+        """
+        查全局字典: 归属模板仍在活动索引中的直接视为命中; 其余为新 key。
+        已送过委员会但尚无模板覆盖的 key 用当前活动索引重匹配: 之后轮次新增的模板命中即回写字典;
+        仍未命中的, 送审次数未达 max_attempts 的照常进入匹配与缓冲 (再送委员会), 达到上限的才跳过。
+        """
+        nonlocal dict_hits, dict_pending, dict_recovered, dict_retry
+        if not use_key_dict:
+            return batch
+        # 本文件全部 uniq key 的字典条目已在循环前一次装载
+        known = key_dict
+        if not known:
+            return batch
+        active = idx.get_active()
+        active_ids = active.template_ids
+        new_keys = []
+        recovered = []
+        for k in batch:
+            if k in known:
+                tid, attempts = known[k]
+                if tid is None:
+                    tid = active.match_one(k)
+                    if tid is not None:
+                        recovered.append((k, tid))
+                    elif attempts >= key_dict_max_attempts:
+                        dict_pending += 1
+                    else:
+                        dict_retry += 1
+                        new_keys.append(k)
                     continue
-                seen.add(pnorm)
-                deduped.append(c)
-            templates.write_candidates(cands)
-            # 同步重建索引并切换, 让新规则立刻生效
-            for cand in cands:
-                logger.debug(f"{cand.get('pattern_nomal')}~~~{cand.get('semantic_info')}~~{cand.get('sample_log')}" )
-            idx.build_new_index_sync()
-    total_lines = 0
-    
-    for i, batch in enumerate(micro_batches, 1):
-        objs = [_KeyTextObj(k) for k in batch]
-        logger.info(f"[P1] {i}/{len(micro_batches)}: {len(objs)}") 
-        total_lines += len(objs)
-        logger.info(total_lines)
-        # 6) 批量匹配
-
-        results = matcher.match_batch(idx.get_active(), objs, workers=match_workers,nomal=True)
-        misses = [r.key_text for r in results if not getattr(r, "is_hit", False)]
-
-        if misses:
-            picked = dbuf.pick_for_buffer(misses)
-            dbuf.add(picked)
-
-        # 阈值触发 同步 LLM
-        if dbuf.reached_threshold():
-            samples = dbuf.snapshot_and_lock()
-            try:
-                for r in samples:
-                    logger.debug(r)
-                _run_llm_sync(samples)
-            finally:
-                dbuf.clear_locked_batch()
-        misses = [r.key_text for r in results if not getattr(r, "is_hit", False)]
+                if tid in active_ids:
+                    dict_hits += 1
+                    continue
+            new_keys.append(k)
+        if recovered:
+            dict_recovered += len(recovered)
+            dict_writer.add(recovered)
+        return new_keys
 
-        if misses:
-            picked = dbuf.pick_for_buffer(misses)
-            dbuf.add(picked)
+    total_lines = 0
+    dict_hits = 0
+    dict_pending = 0
+    dict_recovered = 0
+    dict_retry = 0
+    recheck_hits = 0
+    index_lock = threading.Lock()
+    # 全局字典: 本文件 uniq key 的条目一次批量装载, 写入攒批落库
+    key_dict = dao.lookup_key_dict(key_lines) if use_key_dict else {}
+    dict_writer = _KeyDictWriter(file_id, flush_batches=key_dict_flush_batches)
+    inflight: List[Tuple[Future, List[str]]] = []
+    llm_pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="p1-llm") if async_llm else None
+    run_llm = _run_llm_async if async_llm else _run_llm_sync
 
-        # 阈值触发 同步 LLM
-        if dbuf.reached_threshold():
-            samples = dbuf.snapshot_and_lock()
-            try:
+    try:
+        for i, batch in enumerate(micro_batches, 1):
+            objs = [_KeyTextObj(k) for k in batch]
+            logger.info(f"[P1] {i}/{len(micro_batches)}: {len(objs)}")
+            total_lines += len(objs)
+            logger.info(total_lines)
+            if async_llm:
+                _reap_rounds()
+            # 6) 先查全局字典, 仅对从未见过的 key 批量匹配
+            if use_key_dict:
+                objs = [_KeyTextObj(k) for k in _filter_known_keys(batch)]
+
+            # 异步模式下后台轮次进行中也继续匹配, 用的是当前活动索引
+            results = matcher.match_batch(idx.get_active(), objs, workers=match_workers, nomal=True)
+            if use_key_dict:
+                dict_writer.add((r.key_text, r.template_id) for r in results if r.is_hit)
+            misses = [r.key_text for r in results if not getattr(r, "is_hit", False)]
+            # 原始未命中先给本地挖掘器 (须在近重复过滤之前), 剩余的再进多样性缓冲
+            misses = _mine_local(misses)
+
+            if misses:
+                picked = dbuf.pick_for_buffer(misses)
+                dbuf.add(picked)
+
+            # 阈值触发 LLM: 同步模式阻塞至新索引生效; 异步模式提交后立即继续匹配
+            if dbuf.reached_threshold():
+                samples = dbuf.snapshot_and_lock()
+                try:
+                    for r in samples:
+                        logger.debug(r)
+                    run_llm(samples)
+                finally:
+                    dbuf.clear_locked_batch()
+            dict_writer.batch_done()
+
+        # 异步模式: 等在途轮次全部完成, 期间积压的未命中已按新索引复查
+        while inflight:
+            _reap_rounds(block=True)
+
+        # 结束时可选强制冲洗一次缓冲, 同步 LLM
+        samples = dbuf.snapshot_and_lock() if args.force_flush else []
+        try:
+            if samples:
                 _run_llm_sync(samples)
-            finally:
+        finally:
+            if samples:
                 dbuf.clear_locked_batch()
-
-    # 结束时可选强制冲洗一次缓冲, 同步 LLM
-    samples = dbuf.snapshot_and_lock() if args.force_flush else []
-    try:
-        if samples:
-            _run_llm_sync(samples)
     finally:
-        if samples:
-            dbuf.clear_locked_batch()
-
-    dao.complete_run_session(run_id, total_lines=len(parsed_all), preprocessed_lines=pre_lines, unmatched_lines=0, status="成功")
+        if llm_pool is not None:
+            llm_pool.shutdown(wait=True)
+        dict_writer.flush()
+        # 委员会轮次全部结束：关闭会话内复用的 LLM 连接池与校验引擎进程池
+        committee.close_sessions()
+
+    # 7) 最后一遍: 用最终模板集合 (pattern, nomal=False) 匹配原始关键文本, 写出按记录顺序的归属
+    #    代数须在加载索引之前读取, 加载期间新增的模板会让 P2 判定代数不一致而回退匹配
+    #    原始关键文本从刚写出的 bin / TSV 产物按 chunk_lines 分批流式读回, 不随运行常驻内存
+    if uniq_write_assign and (uniq_bin or uniq_tsv):
+        generation = dao.get_template_generation()
+        final_idx = indexer_mod.Indexer()
+        final_idx.set_slow_recorder(slow_rec)
+        final_idx.load_initial(nomal=False)
+        hits = 0
+
+        def _final_assignments():
+            nonlocal hits
+            keys = iter_uniq_raw_keys(uniq_bin, uniq_tsv)
+            while True:
+                batch = list(itertools.islice(keys, chunk_lines))
+                if not batch:
+                    break
+                for r in matcher.match_batch(final_idx.get_active(), [_KeyTextObj(k) for k in batch],
+                                             workers=match_workers, nomal=False):
+                    hits += bool(r.is_hit)
+                    yield r.template_id if r.is_hit else None
+
+        n = uniq_assign.write_assignments(uniq_assign_path, file_id, generation, uniq_total, _final_assignments())
+        logger.info(f"[P1] 关键文本归属: {uniq_assign_path} file_id={file_id} 记录={n} 命中={hits} 模板代数={generation}")
+
+    if use_key_dict:
+        logger.info(f"[P1] 全局字典: 直接命中={dict_hits} 待定重匹配命中={dict_recovered} 待定重试={dict_retry} "
+                    f"送审达上限跳过={dict_pending} "
+                    f"uniq_distinct={uniq_distinct}")
+    logger.info(f"[P1] 缓冲近重复过滤跳过: {dbuf.near_dup_skipped}")
+    if async_llm:
+        logger.info(f"[P1] 异步轮次完成后复查缓冲命中: {recheck_hits}")
+    if slow_rec is not None:
+        slow_rec.close()
+        st = slow_rec.stats()
+        if st["seen"]:
+            logger.info(f"[P1] 慢匹配: 超阈值={st['seen']} 记录={st['recorded']} 缓冲溢出={st['dropped']} 涉及模板={st['templates']}")
+    tu = committee.TOKEN_USAGE.snapshot()
+    if tu["calls"]:
+        logger.info(f"[P1] 草拟 token: 调用={tu['calls']} 估计输入={tu['estimated_input']} 实际输入={tu['actual_input']} "
+                    f"实际输出={tu['actual_output']} 实际/估计={tu['actual_over_estimated']}")
+    dao.complete_run_session(run_id, total_lines=parsed_total, preprocessed_lines=pre_lines, unmatched_lines=0, status="成功")
     print(f"[OK] 第一遍完成 file_id={file_id}, normal={normal_path}")
 
 
@@ -6,15 +6,29 @@
 - 读取第一遍生成的 normal 文本（每行一条原始日志，已清洗 ANSI 控制字符）。
 - 使用 core.parser.parse_fields 提取 ts / level / thread_id / mod / smod 等字段。
 - 使用 Indexer + matcher.match_batch 做批量匹配（使用 regex_template.pattern，nomal=False）。
-- 在进程内按 (template_id, mod, smod, classification, level, thread_id) 聚合
+- 在进程内按 (template_id, mod, smod, level) 的整数编码聚合（classification 暂空、thread_id 暂记 0），
   first_ts / last_ts / line_count，最后一次性写入 log_match_summary。
+- normal 模式下每个微批的命中行以 (template_id, 维度编码, 整数秒) 三列交给 TimeRollup 整批分组，
+  单遍得到 minute / hour / day（可选 second）级联计数，键数超过 bucket_max_keys 时暂存到临时文件，结束时与 summary 同一事务累加写入 key_time_bucket
+  （second_pass.bucket_granularity 选择粒度，off 关闭）。
+- uniq 模式下由 P1 产物中每个关键文本的分钟直方图折叠出按模板的时间桶（最细到分钟），无需回读 normal 文件。
+- P1 结束前写出的 xx_uniq_assign.bin 记有逐记录的 template_id 与模板代数；uniq 模式整文件运行时若代数与当前一致、
+  记录数与总行数也对得上，直接按归属聚合，不再匹配，否则回退为重新匹配。
+- uniq 模式记录逐关键文本的匹配结果与所基于的模板代数（dao.get_template_generation），
+  再次运行时若输入产物未变，只重匹配未命中 / 归属模板已停用的关键文本，并只重算受影响模板的 summary 与时间桶。
+- normal 模式可按字节切成行首对齐的分片交给进程池：每个 worker 自建索引与符号表，产出部分 summary / 时间桶，
+  父进程经 SymbolTable.absorb 统一编码后做满足结合律的合并，结果与串行一致。
+- 时间戳全程以整数秒（ParsedLine.epoch）比较，仅在写库时格式化为字符串。
 """
 import os
 import argparse
-from typing import Dict, Any, List, Tuple, Optional, NamedTuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterable, List, Tuple, Optional, NamedTuple
 
 from store import dao
-from core import reader, parser as parser_mod, matcher, indexer as indexer_mod
+from core import reader, parser as parser_mod, matcher, indexer as indexer_mod, uniqbin, uniq_assign, slowlog, keytext
+from core.aggregator import ROLLUP_LEVELS, TimeRollup
+from core.symbols import SymbolTable
 from core.utils.config import load_yaml
 import logging
 from core.utils.logger import get_logger  
@@ -39,6 +53,20 @@ def _derive_uniq_tsv_path(normal_path: str, override: str = None) -> str:
     return base + "_uniq_with_count.tsv"
 
 
+def _derive_uniq_bin_path(normal_path: str, override: str = None) -> str:
+    if override:
+        return override
+    base, _ = os.path.splitext(normal_path)
+    return base + "_uniq.bin"
+
+
+def _derive_uniq_assign_path(normal_path: str, override: str = None) -> str:
+    if override:
+        return override
+    base, _ = os.path.splitext(normal_path)
+    return base + "_uniq_assign.bin"
+
+
 def _calc_file_id(path: str) -> str:
     """
     与第一遍保持一致的 file_id 计算方式：
@@ -51,6 +79,19 @@ def _calc_file_id(path: str) -> str:
     return hashlib.sha256(key).hexdigest()[:32]
 
 
+def _parse_bucket_levels(value: Any) -> Tuple[str, ...]:
+    """bucket_granularity 可写单个粒度、逗号分隔串或列表；off / 空表示不写时间桶。"""
+    if not value or value == "off":
+        return ()
+    if isinstance(value, str):
+        value = value.split(",")
+    levels = {str(v).strip() for v in value if str(v).strip()}
+    unknown = levels.difference(ROLLUP_LEVELS)
+    if unknown:
+        raise ValueError(f"second_pass.bucket_granularity 含未知粒度: {sorted(unknown)}")
+    return tuple(g for g in ROLLUP_LEVELS if g in levels)
+
+
 def _load_second_pass_cfg(app_cfg: Dict[str, Any]) -> Dict[str, Any]:
     """
     兼容不同命名的二遍配置字段，尽量不破坏你现有的 application.yaml。
@@ -73,7 +114,13 @@ def _load_second_pass_cfg(app_cfg: Dict[str, Any]) -> Dict[str, Any]:
         or sp.get("match_workers_per_batch")
         or 4
     )
-    cfg["bucket_granularity"] = sp.get("bucket_granularity") or "minute"
+    cfg["bucket_levels"] = _parse_bucket_levels(sp.get("bucket_granularity", "minute"))
+    cfg["bucket_max_keys"] = sp.get("bucket_max_keys") or 200000
+    cfg["parallel_workers"] = sp.get("parallel_workers", 0)
+    cfg["parallel_min_bytes"] = sp.get("parallel_min_bytes", 64 * 1024 * 1024)
+    cfg["shards_per_worker"] = sp.get("shards_per_worker") or 4
+    cfg["incremental"] = bool(sp.get("incremental", True))
+    cfg["use_p1_assign"] = bool(sp.get("use_p1_assign", True))
     cfg["agg_flush_lines"] = sp.get("agg_flush_lines") or 2000
     return cfg
 
@@ -92,8 +139,24 @@ class _UniqAggRecord(NamedTuple):
     mod: str
     smod: str
     level: str
-    min_ts: str
-    max_ts: str
+    min_ts: int  # 整数秒，缺失为 parser.TS_NONE
+    max_ts: int
+    hist: Tuple[Tuple[int, int], ...] = ()  # ((分钟起点整数秒, 行数), ...)，旧产物为空
+
+
+def _parse_hist(field: str, min_ts: int) -> Tuple[Tuple[int, int], ...]:
+    """解析 TSV 第 10 列 "偏移:行数,..."，偏移为相对 min_ts 所在分钟的分钟数。"""
+    if not field or min_ts == parser_mod.TS_NONE:
+        return ()
+    base = min_ts - min_ts % 60
+    out = []
+    for item in field.split(","):
+        off, _, cnt = item.partition(":")
+        try:
+            out.append((base + int(off) * 60, int(cnt)))
+        except ValueError:
+            return ()
+    return tuple(out)
 
 
 def _load_uniq_records(path: str) -> List[_UniqAggRecord]:
@@ -116,26 +179,86 @@ def _load_uniq_records(path: str) -> List[_UniqAggRecord]:
             key_norm = parts[1].strip()
             mod = parts[2].strip() if len(parts) > 2 else ""
             smod = parts[3].strip() if len(parts) > 3 else ""
-            min_ts = parts[4].strip() if len(parts) > 4 else ""
-            max_ts = parts[5].strip() if len(parts) > 5 else ""
+            min_ts = parser_mod.ts_to_epoch(parts[4].strip()) if len(parts) > 4 else parser_mod.TS_NONE
+            max_ts = parser_mod.ts_to_epoch(parts[5].strip()) if len(parts) > 5 else parser_mod.TS_NONE
             level = parts[6].strip() if len(parts) > 6 else ""
-            sample_norm = parts[7].strip() if len(parts) > 7 else key_norm
-            sample_raw = parts[8].strip() if len(parts) > 8 else sample_norm
+            # 第 9 列是 P1 可逆转义后的原始关键文本, 原样解码不做 strip, 与 bin / 归属产物用同一个键
+            sample_raw = keytext.decode_tsv_key(parts[8]) if len(parts) > 8 else ""
+            hist = _parse_hist(parts[9].strip(), min_ts) if len(parts) > 9 else ()
             records.append(
                 _UniqAggRecord(
                     count=count,
                     key_text_norm=key_norm,
-                    key_text_raw=sample_raw or sample_norm or key_norm,
+                    key_text_raw=sample_raw or key_norm,
                     mod=mod,
                     smod=smod,
                     level=level,
                     min_ts=min_ts,
                     max_ts=max_ts,
+                    hist=hist,
                 )
             )
     return records
 
 
+class _BinUniqRecords:
+    """
+    xx_uniq.bin 的只读视图：底层 mmap 直接映射，按需把单条记录转换为 _UniqAggRecord（时间戳保持整数），
+    对外表现为与 _load_uniq_records 返回值相同的序列（支持 len / 下标 / 切片 / 迭代）。
+    """
+
+    def __init__(self, reader: uniqbin.UniqBinReader):
+        self._reader = reader
+
+    def _to_agg(self, r: uniqbin.UniqBinRecord) -> _UniqAggRecord:
+        return _UniqAggRecord(
+            count=r.count,
+            key_text_norm=r.key_text_norm,
+            key_text_raw=r.key_text_raw or r.key_text_norm,
+            mod=r.mod,
+            smod=r.smod,
+            level=r.level,
+            min_ts=r.min_ts,
+            max_ts=r.max_ts,
+            hist=r.hist,
+        )
+
+    def __len__(self) -> int:
+        return len(self._reader)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._to_agg(r) for r in self._reader[i]]
+        return self._to_agg(self._reader[i])
+
+    def __iter__(self):
+        for r in self._reader:
+            yield self._to_agg(r)
+
+    def total_count(self) -> int:
+        return self._reader.total_count()
+
+    def close(self) -> None:
+        self._reader.close()
+
+
+def _records_total(records) -> int:
+    """展开后的总行数；二进制视图直接对计数段求和，无需逐条解码。"""
+    if isinstance(records, _BinUniqRecords):
+        return records.total_count()
+    return sum(r.count for r in records)
+
+
+def _load_uniq_bin(path: str) -> Optional[_BinUniqRecords]:
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return _BinUniqRecords(uniqbin.UniqBinReader(path))
+    except (ValueError, OSError) as e:
+        logger.info("uniq 二进制产物不可用: %s (%s)", path, e)
+        return None
+
+
 def _iter_batches(items: List[Any], size: int):
     size = max(1, int(size or 1))
     for i in range(0, len(items), size):
@@ -143,19 +266,21 @@ def _iter_batches(items: List[Any], size: int):
 
 
 def _update_summary_from_agg(
-    summary: Dict[Tuple[int, str, str, str, str, str], Dict[str, Any]],
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]],
     file_id: str,
     run_id: int,
     template_id: int,
     record: _UniqAggRecord,
+    symbols: SymbolTable,
 ) -> None:
-    mod = (record.mod or "").strip()
-    smod = (record.smod or "").strip()
-    level = (record.level or "").strip()
+    mod = symbols.encode("mod", record.mod or "")
+    smod = symbols.encode("smod", record.smod or "")
+    level = symbols.encode("level", record.level or "")
     classification = ""
-    key = (template_id, mod, smod, classification, level, 0)
-    first_ts = record.min_ts or record.max_ts or ""
-    last_ts = record.max_ts or record.min_ts or ""
+    key = (template_id, mod, smod, level)
+    none = parser_mod.TS_NONE
+    first_ts = record.min_ts if record.min_ts != none else record.max_ts
+    last_ts = record.max_ts if record.max_ts != none else record.min_ts
     row = summary.get(key)
     if row is None:
         summary[key] = dict(
@@ -173,14 +298,10 @@ def _update_summary_from_agg(
         )
     else:
         row["line_count"] = int(row.get("line_count", 0) or 0) + record.count
-        if first_ts:
-            prev_first = row.get("first_ts") or ""
-            if not prev_first or first_ts < prev_first:
-                row["first_ts"] = first_ts
-        if last_ts:
-            prev_last = row.get("last_ts") or ""
-            if not prev_last or last_ts > prev_last:
-                row["last_ts"] = last_ts
+        if first_ts != none and (row["first_ts"] == none or first_ts < row["first_ts"]):
+            row["first_ts"] = first_ts
+        if last_ts > row["last_ts"]:
+            row["last_ts"] = last_ts
 
 
 def _process_normal_mode(
@@ -189,13 +310,19 @@ def _process_normal_mode(
     micro_batch: int,
     match_workers: int,
     idx: indexer_mod.Indexer,
-    summary: Dict[Tuple[int, str, str, str, str, str], Dict[str, Any]],
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]],
     file_id: str,
     run_id: int,
+    symbols: SymbolTable,
+    buckets: Optional[TimeRollup] = None,
+    chunks: Optional[Iterable[List[str]]] = None,
 ) -> Tuple[int, int]:
+    """chunks 为空时顺序读取整个 normal 文件；分片 worker 传入 reader.read_shard_in_chunks 的结果。"""
     total_lines = 0
     matched_total = 0
     buffer: List[parser_mod.ParsedLine] = []
+    if chunks is None:
+        chunks = reader.read_in_chunks(normal_path, chunk_lines=chunk_lines)
 
     def _consume_buffer() -> None:
         nonlocal matched_total
@@ -207,6 +334,10 @@ def _process_normal_mode(
             workers=match_workers,
             nomal=False,
         )
+        # 命中行的三列，整批交给时间桶计数器；维度与 summary 一致只取 (mod, smod, level)
+        hit_tids: List[int] = []
+        hit_dims: List[Tuple[int, ...]] = []
+        hit_epochs: List[int] = []
         for parsed_line, res in zip(buffer, results):
             if not getattr(res, "is_hit", False):
                 continue
@@ -219,15 +350,21 @@ def _process_normal_mode(
                 continue
             matched_total += 1
             _update_summary_from_line(summary, file_id, run_id, tid, parsed_line)
+            if buckets is not None:
+                hit_tids.append(tid)
+                hit_dims.append(parsed_line.dims[:3])
+                hit_epochs.append(parsed_line.epoch)
+        if buckets is not None:
+            buckets.add_batch(hit_tids, hit_dims, hit_epochs)
         buffer.clear()
 
-    for chunk in reader.read_in_chunks(normal_path, chunk_lines=chunk_lines):
+    for chunk in chunks:
         for line in chunk:
             total_lines += 1
             line = line.strip()
             if not line:
                 continue
-            parsed = parser_mod.parse_fields(line)
+            parsed = parser_mod.parse_fields(line, symbols)
             if parsed is None:
                 continue
             buffer.append(parsed)
@@ -243,39 +380,273 @@ def _process_normal_mode(
     return total_lines, matched_total
 
 
+# ------------------------------ 分片并行 normal 模式 ------------------------------
+_W_STATE: Dict[str, Any] = {}
+
+
+def _shard_worker_init(run_id: int, file_id: str, bucket_levels: Tuple[str, ...],
+                       chunk_lines: int, micro_batch: int, app_cfg: Dict[str, Any]) -> None:
+    """每个 worker 进程只加载一次索引（nomal=False），后续分片复用。"""
+    idx = indexer_mod.Indexer()
+    rec = slowlog.from_config(app_cfg, run_id)
+    idx.set_slow_recorder(rec)
+    idx.load_initial(nomal=False)
+    _W_STATE.update(idx=idx, rec=rec, run_id=run_id, file_id=file_id, bucket_levels=bucket_levels,
+                    bucket_max_keys=_load_second_pass_cfg(app_cfg)["bucket_max_keys"],
+                    chunk_lines=chunk_lines, micro_batch=micro_batch)
+
+
+def _shard_worker(job: Tuple[str, int, int]):
+    normal_path, start, end = job
+    st = _W_STATE
+    symbols = SymbolTable()
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]] = {}
+    buckets = None
+    if st["bucket_levels"]:
+        buckets = TimeRollup(st["run_id"], st["file_id"], symbols, levels=st["bucket_levels"],
+                             fields=("mod", "smod", "level"), max_keys=st["bucket_max_keys"])
+    total, matched = _process_normal_mode(
+        normal_path,
+        st["chunk_lines"],
+        st["micro_batch"],
+        1,  # worker 内不再开匹配线程，并行度由进程数提供
+        st["idx"],
+        summary,
+        st["file_id"],
+        st["run_id"],
+        symbols,
+        buckets,
+        chunks=reader.read_shard_in_chunks(normal_path, start, end, st["chunk_lines"]),
+    )
+    if st["rec"] is not None:
+        st["rec"].flush()
+    return total, matched, summary, symbols, buckets
+
+
+def _merge_summary(
+    dst: Dict[Tuple[int, int, int, int], Dict[str, Any]],
+    src: Dict[Tuple[int, int, int, int], Dict[str, Any]],
+    code_maps: Dict[str, List[int]],
+) -> None:
+    """line_count 相加、first_ts 取最小、last_ts 取最大（TS_NONE 视为缺失），与合并顺序无关。"""
+    none = parser_mod.TS_NONE
+    mods, smods, levels = code_maps["mod"], code_maps["smod"], code_maps["level"]
+    for (tid, m, sm, lv), row in src.items():
+        key = (tid, mods[m], smods[sm], levels[lv])
+        cur = dst.get(key)
+        if cur is None:
+            cur = dict(row)
+            cur["mod"], cur["smod"], cur["level"] = key[1], key[2], key[3]
+            dst[key] = cur
+            continue
+        cur["line_count"] = int(cur.get("line_count", 0) or 0) + int(row.get("line_count", 0) or 0)
+        if row["first_ts"] != none and (cur["first_ts"] == none or row["first_ts"] < cur["first_ts"]):
+            cur["first_ts"] = row["first_ts"]
+        if row["last_ts"] > cur["last_ts"]:
+            cur["last_ts"] = row["last_ts"]
+
+
+def _process_normal_parallel(
+    normal_path: str,
+    workers: int,
+    shards_per_worker: int,
+    chunk_lines: int,
+    micro_batch: int,
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]],
+    file_id: str,
+    run_id: int,
+    symbols: SymbolTable,
+    buckets: Optional[TimeRollup],
+    app_cfg: Dict[str, Any],
+) -> Tuple[int, int]:
+    shards = reader.byte_shards(normal_path, workers * max(1, int(shards_per_worker)))
+    logger.info("[parallel] normal 文件分片: shards=%d workers=%d", len(shards), workers)
+    total_lines = 0
+    matched_total = 0
+    levels = buckets.levels if buckets is not None else ()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_shard_worker_init,
+        initargs=(run_id, file_id, levels, chunk_lines, micro_batch, app_cfg),
+    ) as pool:
+        jobs = [(normal_path, a, b) for a, b in shards]
+        for i, (total, matched, part, part_symbols, part_buckets) in enumerate(pool.map(_shard_worker, jobs), 1):
+            code_maps = symbols.absorb(part_symbols)
+            _merge_summary(summary, part, code_maps)
+            if buckets is not None and part_buckets is not None:
+                buckets.merge(part_buckets, code_maps)
+            total_lines += total
+            matched_total += matched
+            logger.info(
+                "[parallel] merged shards: %d/%d, processed_lines: %d, matched_lines: %d",
+                i,
+                len(shards),
+                total_lines,
+                matched_total,
+            )
+    return total_lines, matched_total
+
+
+def _hit_template_id(res) -> Optional[int]:
+    if not getattr(res, "is_hit", False):
+        return None
+    template_id = getattr(res, "template_id", None)
+    if template_id is None:
+        return None
+    try:
+        return int(template_id)
+    except Exception:
+        return None
+
+
+def _fold_record(
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]],
+    buckets: Optional[TimeRollup],
+    file_id: str,
+    run_id: int,
+    template_id: int,
+    record: _UniqAggRecord,
+    symbols: SymbolTable,
+) -> bool:
+    """把一条命中的 uniq 记录并入 summary 与时间桶；记录缺少分钟直方图而无法计入时间桶时返回 False。"""
+    _update_summary_from_agg(summary, file_id, run_id, template_id, record, symbols)
+    if buckets is None:
+        return True
+    if not record.hist:
+        return False
+    series = (
+        template_id,
+        symbols.encode("mod", record.mod or ""),
+        symbols.encode("smod", record.smod or ""),
+        symbols.encode("level", record.level or ""),
+    )
+    for minute, cnt in record.hist:
+        buckets.add(series, minute, cnt)
+    return True
+
+
+def _process_uniq_incremental(
+    records: List[_UniqAggRecord],
+    prev: Dict[str, Optional[int]],
+    changes: Dict[str, List[int]],
+    micro_batch: int,
+    match_workers: int,
+    idx: indexer_mod.Indexer,
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]],
+    file_id: str,
+    run_id: int,
+    symbols: SymbolTable,
+    buckets: Optional[TimeRollup] = None,
+) -> Tuple[int, int, List[int], List[Tuple[str, Optional[int]]]]:
+    """
+    基于上次的逐关键文本匹配结果增量重跑：
+    - 只重匹配上次未命中（且之后新增过模板）或归属模板已被停用的关键文本
+    - 归属发生变化的关键文本所涉及的模板（新旧归属）即受影响模板，summary / 时间桶只为它们重新聚合
+    - 受影响模板的旧统计行由调用方在最终写库的同一事务里删除后替换
+    返回 (total_lines, matched_lines, 受影响模板, 归属变化的 (key_text_norm, template_id))
+    """
+    deactivated = set(changes.get("deactivate") or [])
+    rematch_unmatched = bool(changes.get("add"))
+    current: List[Optional[int]] = []
+    redo: List[int] = []
+    for i, record in enumerate(records):
+        key = record.key_text_norm
+        tid = prev.get(key)
+        current.append(tid)
+        if key not in prev or (tid is None and rematch_unmatched) or tid in deactivated:
+            redo.append(i)
+
+    changed: List[Tuple[str, Optional[int]]] = []
+    affected = set()
+    for batch_idx in _iter_batches(redo, micro_batch):
+        batch = [records[i] for i in batch_idx]
+        wrappers = [_KeyTextWrapper(r.key_text_raw or r.key_text_norm) for r in batch]
+        results = matcher.match_batch(idx.get_active(), wrappers, workers=match_workers, nomal=False)
+        for i, record, res in zip(batch_idx, batch, results):
+            tid = _hit_template_id(res)
+            old = current[i]
+            if tid != old or record.key_text_norm not in prev:
+                changed.append((record.key_text_norm, tid))
+                affected.update(t for t in (old, tid) if t is not None)
+            current[i] = tid
+    logger.info(
+        "[uniq-incremental] uniq_rows=%d, rematched=%d, changed=%d, affected_templates=%d",
+        len(records),
+        len(redo),
+        len(changed),
+        len(affected),
+    )
+
+    matched_total = 0
+    for record, tid in zip(records, current):
+        if tid is None:
+            continue
+        matched_total += record.count
+        if tid in affected:
+            _fold_record(summary, buckets, file_id, run_id, tid, record, symbols)
+    return _records_total(records), matched_total, sorted(affected), changed
+
+
+def _load_p1_assignments(path: str, file_id: str, generation: int, records) -> Optional[List[Optional[int]]]:
+    """读取 P1 的关键文本归属；不属于本文件、模板代数变化或与当前 uniq 产物对不齐时返回 None，回退重新匹配。"""
+    assigned = uniq_assign.read_assignments(path)
+    if assigned is None:
+        return None
+    if assigned.file_id != file_id:
+        logger.info("P1 关键文本归属属于 file_id=%s，当前为 %s，重新匹配", assigned.file_id, file_id)
+        return None
+    if assigned.generation != generation:
+        logger.info("P1 关键文本归属基于模板代数 %d，当前为 %d，重新匹配", assigned.generation, generation)
+        return None
+    if len(assigned.template_ids) != len(records) or assigned.total_count != _records_total(records):
+        logger.info("P1 关键文本归属与 uniq 产物不一致，重新匹配: %s", path)
+        return None
+    logger.info("使用 P1 关键文本归属直接聚合: %s, 模板代数=%d", path, generation)
+    return assigned.template_ids
+
+
 def _process_uniq_mode(
     records: List[_UniqAggRecord],
     micro_batch: int,
     match_workers: int,
     idx: indexer_mod.Indexer,
-    summary: Dict[Tuple[int, str, str, str, str, str], Dict[str, Any]],
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]],
     file_id: str,
     run_id: int,
+    symbols: SymbolTable,
+    buckets: Optional[TimeRollup] = None,
+    assign_out: Optional[List[Tuple[str, Optional[int]]]] = None,
+    preassigned: Optional[List[Optional[int]]] = None,
 ) -> Tuple[int, int]:
-    total_lines = sum(r.count for r in records)
+    """
+    assign_out 非空时按记录顺序收集 (key_text_norm, template_id 或 None)，供增量重跑使用。
+    preassigned 为与记录同序的 template_id 列表（P1 归属产物）时不再匹配，直接按归属聚合。
+    """
+    total_lines = _records_total(records)
     matched_total = 0
     processed_rows = 0
     total_rows = len(records)
+    no_hist_lines = 0
     for batch in _iter_batches(records, micro_batch):
-        wrappers = [_KeyTextWrapper(r.key_text_raw or r.key_text_norm) for r in batch]
-        results = matcher.match_batch(
-            idx.get_active(),
-            wrappers,
-            workers=match_workers,
-            nomal=False,
-        )
-        for record, res in zip(batch, results):
-            if not getattr(res, "is_hit", False):
-                continue
-            template_id = getattr(res, "template_id", None)
-            if template_id is None:
-                continue
-            try:
-                tid = int(template_id)
-            except Exception:
+        if preassigned is not None:
+            tids = preassigned[processed_rows:processed_rows + len(batch)]
+        else:
+            wrappers = [_KeyTextWrapper(r.key_text_raw or r.key_text_norm) for r in batch]
+            results = matcher.match_batch(
+                idx.get_active(),
+                wrappers,
+                workers=match_workers,
+                nomal=False,
+            )
+            tids = [_hit_template_id(res) for res in results]
+        for record, tid in zip(batch, tids):
+            if assign_out is not None:
+                assign_out.append((record.key_text_norm, tid))
+            if tid is None:
                 continue
             matched_total += record.count
-            _update_summary_from_agg(summary, file_id, run_id, tid, record)
+            if not _fold_record(summary, buckets, file_id, run_id, tid, record, symbols):
+                no_hist_lines += record.count
         processed_rows += len(batch)
         logger.info(
             "[uniq-mode] processed uniq_rows: %d/%d, matched_lines: %d",
@@ -283,30 +654,28 @@ def _process_uniq_mode(
             total_rows,
             matched_total,
         )
+    if no_hist_lines:
+        logger.info("[uniq-mode] %d 行命中的关键文本缺少分钟直方图（旧产物或未开启 time_hist），未计入时间桶", no_hist_lines)
     return total_lines, matched_total
 
 
 def _update_summary_from_line(
-    summary: Dict[Tuple[int, str, str, str, str, str], Dict[str, Any]],
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]],
     file_id: str,
     run_id: int,
     template_id: int,
     parsed: parser_mod.ParsedLine,
 ) -> None:
     """
-    使用 parse_fields 提取到的字段更新一条汇总记录。
-    维度：template_id, mod, smod, classification(暂空), level, thread_id
+    使用 parse_fields(symbols=...) 提取到的字段更新一条汇总记录。
+    维度：template_id, mod, smod, classification(暂空), level, thread_id(暂记 0)
+    mod / smod / level 为符号表整数编码，写库前由 _summary_rows_for_db 解码。
     """
-    # ParsedLine 定义：ts, level, thread_id, mod, smod, key_text, raw
-    mod = (parsed.mod or "").strip()
-    smod = (parsed.smod or "").strip()
-    level = (parsed.level or "").strip()
-    thread_id = (parsed.thread_id or "").strip()
-    ts = (parsed.ts or "").strip()
+    mod, smod, level, _thread = parsed.dims
+    ts = parsed.epoch
     classification = ""  # 目前不从模板库回填分类，保持为空串
 
-    # key = (template_id, mod, smod, classification, level, thread_id)
-    key = (template_id, mod, smod, classification, level, 0)
+    key = (template_id, mod, smod, level)
     row = summary.get(key)
     if row is None:
         summary[key] = dict(
@@ -326,16 +695,31 @@ def _update_summary_from_line(
     else:
         # 行数累加
         row["line_count"] = int(row.get("line_count", 0) or 0) + 1
-        # first_ts / last_ts 更新（ts 形如 "YYYYMMDD HHMMSS"，字符串比较即可）
-        if ts:
-            first_ts = row.get("first_ts") or ""
-            last_ts = row.get("last_ts") or ""
-            if not first_ts or ts < first_ts:
+        # first_ts / last_ts 更新（整数秒比较，写库前再格式化为 "YYYYMMDD HHMMSS"）
+        if ts != parser_mod.TS_NONE:
+            if row["first_ts"] == parser_mod.TS_NONE or ts < row["first_ts"]:
                 row["first_ts"] = ts
-            if not last_ts or ts > last_ts:
+            if ts > row["last_ts"]:
                 row["last_ts"] = ts
 
 
+def _summary_rows_for_db(
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]],
+    symbols: SymbolTable,
+) -> List[Dict[str, Any]]:
+    """聚合期间维度为整数编码、first_ts / last_ts 为整数秒，仅在写库时解码与格式化。"""
+    rows = []
+    for row in summary.values():
+        out = dict(row)
+        out["mod"] = symbols.decode("mod", row["mod"])
+        out["smod"] = symbols.decode("smod", row["smod"])
+        out["level"] = symbols.decode("level", row["level"])
+        out["first_ts"] = parser_mod.epoch_to_ts(row["first_ts"])
+        out["last_ts"] = parser_mod.epoch_to_ts(row["last_ts"])
+        rows.append(out)
+    return rows
+
+
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--path", required=True, help="原始 gz 日志文件路径（或已解压的原始日志路径）")
@@ -349,9 +733,26 @@ def main() -> None:
         default=None,
         help="第一遍生成的 *_uniq_with_count.tsv 路径；若不指定，则与 normal 文件同名推导",
     )
+    ap.add_argument(
+        "--uniq-bin",
+        default=None,
+        help="第一遍生成的 *_uniq.bin 路径；若不指定，则与 normal 文件同名推导，存在时优先于 TSV",
+    )
+    ap.add_argument(
+        "--uniq-assign",
+        default=None,
+        help="第一遍生成的 *_uniq_assign.bin 路径；若不指定，则与 normal 文件同名推导",
+    )
     ap.add_argument("--chunk-lines", type=int, default=None, help="read_in_chunks 每块行数")
     ap.add_argument("--micro-batch", type=int, default=None, help="每批送给 matcher 的条数")
     ap.add_argument("--match-workers", type=int, default=None, help="匹配并发 worker 数")
+    ap.add_argument(
+        "--parallel-workers",
+        type=int,
+        default=None,
+        help="normal 模式分片并行的进程数：0 为 CPU 核数，1 为串行；文件小于 parallel_min_bytes 时仍走串行",
+    )
+    ap.add_argument("--full", action="store_true", help="忽略上次的逐关键文本匹配结果，整文件重新匹配")
     ap.add_argument("--config", type=str, default="configs/application.yaml", help="应用配置文件路径")
     args = ap.parse_args()
 
@@ -362,8 +763,9 @@ def main() -> None:
     user_defined_micro = args.micro_batch is not None
     micro_batch = int(args.micro_batch or sp_cfg["micro_batch"])
     match_workers = int(args.match_workers or sp_cfg["match_workers"])
-    bucket_granularity = sp_cfg["bucket_granularity"]
-    # agg_flush_lines = int(sp_cfg["agg_flush_lines"])  # 当前版本不使用时间桶，可按需开启
+    bucket_levels = sp_cfg["bucket_levels"]
+    parallel_workers = args.parallel_workers if args.parallel_workers is not None else sp_cfg["parallel_workers"]
+    parallel_workers = int(parallel_workers) if parallel_workers else (os.cpu_count() or 1)
     # 针对未显式指定 micro_batch 的情况，按 worker 数动态调整，减少调度开销
     min_recommended_batch = max(match_workers * 200, 1000)
     if micro_batch < min_recommended_batch:
@@ -390,8 +792,35 @@ def main() -> None:
     # 与第一遍保持一致的 file_id
     file_id = _calc_file_id(path)
     dao.register_file(file_id, path)
-    # rerun 前先清理旧的统计，避免重复写入
-    dao.delete_log_match_summary_by_file(file_id)
+
+    uniq_tsv_path = _derive_uniq_tsv_path(normal_path, args.uniq_tsv)
+    uniq_bin_path = _derive_uniq_bin_path(normal_path, args.uniq_bin)
+    uniq_records = _load_uniq_bin(uniq_bin_path)
+    uniq_src = uniq_bin_path
+    if uniq_records is None or not len(uniq_records):
+        if uniq_records is not None:
+            uniq_records.close()
+        uniq_records = _load_uniq_records(uniq_tsv_path)
+        uniq_src = uniq_tsv_path
+
+    use_uniq = bool(len(uniq_records))
+    # uniq 产物的直方图最细到分钟，uniq 模式下不产出秒级桶
+    levels = tuple(g for g in bucket_levels if g != "second") if use_uniq else bucket_levels
+
+    # 增量重跑：输入产物与时间桶粒度不变、且有上次的逐关键文本结果时，只处理模板集合的变化
+    # 代数须在加载索引之前读取，加载期间新增的模板留给下一次增量
+    generation = dao.get_template_generation()
+    source_sig = ""
+    prev_state = None
+    if use_uniq:
+        st = os.stat(uniq_src)
+        source_sig = f"{os.path.abspath(uniq_src)}|{int(st.st_mtime)}|{st.st_size}|{','.join(levels)}"
+        if sp_cfg["incremental"] and not args.full:
+            prev_state = dao.get_p2_file_state(file_id)
+            if prev_state is not None and prev_state["source_sig"] != source_sig:
+                logger.info("uniq 产物或时间桶粒度已变化，整文件重新匹配")
+                prev_state = None
+    incremental = prev_state is not None
 
     # 记录第二遍 run_session
     run_id = dao.create_run_session(
@@ -401,27 +830,74 @@ def main() -> None:
             chunk_lines=chunk_lines,
             micro_batch=micro_batch,
             match_workers=match_workers,
-            bucket_granularity=bucket_granularity,
+            bucket_granularity=",".join(bucket_levels) or "off",
+            incremental=incremental,
+            template_generation=generation,
         ),
     )
 
     # 加载“未归一化的正则”，用于原始日志匹配
     idx = indexer_mod.Indexer()
+    slow_rec = slowlog.from_config(app_cfg, run_id)
+    idx.set_slow_recorder(slow_rec)
     idx.load_initial(nomal=False)
 
-    uniq_tsv_path = _derive_uniq_tsv_path(normal_path, args.uniq_tsv)
-    uniq_records = _load_uniq_records(uniq_tsv_path)
-
-    summary: Dict[Tuple[int, str, str, str, str, str], Dict[str, Any]] = {}
+    summary: Dict[Tuple[int, int, int, int], Dict[str, Any]] = {}
+    # 本次运行的符号表：mod / smod / level / thread_id 编码为小整数，写库时再解码
+    symbols = SymbolTable()
+    buckets: Optional[TimeRollup] = None
+    if levels:
+        buckets = TimeRollup(
+            run_id,
+            file_id,
+            symbols,
+            levels=levels,
+            fields=("mod", "smod", "level"),
+            max_keys=sp_cfg["bucket_max_keys"],
+        )
 
-    if uniq_records:
-        expanded_total = sum(r.count for r in uniq_records)
+    affected: Optional[List[int]] = None
+    # 逐关键文本结果与文件状态在结束时与 summary / 时间桶同一事务写入；normal 模式不记录
+    final_assignments: Optional[List[Tuple[str, Optional[int]]]] = None
+    final_state: Optional[Tuple[int, str, int]] = None
+    if incremental:
+        changes = dao.get_template_changes(prev_state["generation"])
+        logger.info(
+            "增量重跑: 上次模板代数=%d 当前=%d 新增模板=%d 停用模板=%d",
+            prev_state["generation"],
+            generation,
+            len(changes.get("add") or []),
+            len(changes.get("deactivate") or []),
+        )
+        total_lines, matched_total, affected, changed = _process_uniq_incremental(
+            uniq_records,
+            dao.get_p2_key_assignments(file_id),
+            changes,
+            micro_batch,
+            match_workers,
+            idx,
+            summary,
+            file_id,
+            run_id,
+            symbols,
+            buckets,
+        )
+        final_assignments = changed
+        final_state = (generation, source_sig, run_id)
+    elif use_uniq:
+        expanded_total = _records_total(uniq_records)
         logger.info(
-            "使用 uniq TSV 进行匹配: %s, uniq_rows=%d, expanded_lines=%d",
-            uniq_tsv_path,
+            "使用 uniq 产物进行匹配: %s, uniq_rows=%d, expanded_lines=%d",
+            uniq_src,
             len(uniq_records),
             expanded_total,
         )
+        preassigned = None
+        if sp_cfg["use_p1_assign"]:
+            preassigned = _load_p1_assignments(
+                _derive_uniq_assign_path(normal_path, args.uniq_assign), file_id, generation, uniq_records
+            )
+        assignments: List[Tuple[str, Optional[int]]] = []
         total_lines, matched_total = _process_uniq_mode(
             uniq_records,
             micro_batch,
@@ -430,27 +906,78 @@ def main() -> None:
             summary,
             file_id,
             run_id,
+            symbols,
+            buckets,
+            assignments,
+            preassigned,
         )
+        final_assignments = assignments
+        final_state = (generation, source_sig, run_id)
     else:
         if args.uniq_tsv or os.path.exists(uniq_tsv_path):
             logger.info(
                 "uniq TSV 不可用或格式不匹配，回退 normal 模式: %s",
                 uniq_tsv_path,
             )
-        total_lines, matched_total = _process_normal_mode(
-            normal_path,
-            chunk_lines,
-            micro_batch,
-            match_workers,
-            idx,
-            summary,
-            file_id,
-            run_id,
+        use_parallel = (
+            parallel_workers > 1
+            and not normal_path.endswith(".gz")
+            and os.path.getsize(normal_path) >= int(sp_cfg["parallel_min_bytes"])
         )
+        if use_parallel:
+            total_lines, matched_total = _process_normal_parallel(
+                normal_path,
+                parallel_workers,
+                sp_cfg["shards_per_worker"],
+                chunk_lines,
+                micro_batch,
+                summary,
+                file_id,
+                run_id,
+                symbols,
+                buckets,
+                app_cfg,
+            )
+        else:
+            total_lines, matched_total = _process_normal_mode(
+                normal_path,
+                chunk_lines,
+                micro_batch,
+                match_workers,
+                idx,
+                summary,
+                file_id,
+                run_id,
+                symbols,
+                buckets,
+            )
 
-    # 将聚合结果写入 log_match_summary
-    if summary:
-        dao.batch_upsert_log_match_summary(list(summary.values()))
+    if isinstance(uniq_records, _BinUniqRecords):
+        uniq_records.close()
+
+    if slow_rec is not None:
+        slow_rec.close()
+        st = slow_rec.stats()
+        if st["seen"]:
+            logger.info("慢匹配: 超阈值=%d 记录=%d 缓冲溢出=%d 涉及模板=%d", st["seen"], st["recorded"], st["dropped"], st["templates"])
+
+    # 同一事务内删除旧统计行（增量重跑只删受影响模板）并写入 log_match_summary / key_time_bucket，
+    # 逐关键文本结果与文件状态最后写
+    try:
+        dao.commit_p2_results(
+            file_id,
+            _summary_rows_for_db(summary, symbols),
+            buckets.iter_rows() if buckets is not None else [],
+            final_assignments,
+            final_state,
+            affected,
+        )
+    finally:
+        if buckets is not None:
+            buckets.discard()
+    if buckets is not None:
+        if buckets.flushed_rows:
+            logger.info("key_time_bucket: granularity=%s rows=%d", ",".join(buckets.levels), buckets.flushed_rows)
 
     # 更新 run_session
     dao.complete_run_session(
@@ -461,6 +988,7 @@ def main() -> None:
     )
     print(
         f"[OK] 第二遍完成 file_id={file_id}, total_lines={total_lines}, matched_lines={matched_total}"
+        + (f", incremental affected_templates={len(affected)}" if affected is not None else "")
     )
 
 
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+慢匹配排名报告：读取 slow_match 表，按累计耗时给模板排序，给出建议处理方式。
+
+建议规则：
+  - 最慢一次 >= --deactivate-ms，或在 >= --deactivate-runs 次运行中出现：建议停用
+  - 其余：建议改写（可先用 bin.scan_regex_templates --slow-only 复核）
+
+用法示例：
+
+  LOG_ANALYZER_DB=./data/log_analyzer.sqlite3 \
+    python -m bin.report_slow_matches --limit 20 --report-json ./slow_match_report.json
+"""
+import argparse
+import json
+from typing import Any, Dict, List
+
+from store.dao import get_slow_match_ranking
+
+
+def build_report(limit: int = 50, min_run_id: int = 0, min_hits: int = 1,
+                 deactivate_ms: float = 1000.0, deactivate_runs: int = 3) -> List[Dict[str, Any]]:
+    out = []
+    for r in get_slow_match_ranking(limit=limit, min_run_id=min_run_id, min_hits=min_hits):
+        item = dict(r)
+        severe = (item["max_ms"] or 0) >= deactivate_ms or (item["runs"] or 0) >= deactivate_runs
+        item["action"] = "deactivate" if severe else "rewrite"
+        item["slowest_text"] = (item.get("slowest_text") or "")[:300]
+        out.append(item)
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="slow_match 慢匹配模板排名")
+    ap.add_argument("--limit", type=int, default=50, help="输出前 N 个模板")
+    ap.add_argument("--min-run-id", type=int, default=0, help="只统计 run_id >= 该值的记录")
+    ap.add_argument("--min-hits", type=int, default=1, help="慢匹配次数下限")
+    ap.add_argument("--deactivate-ms", type=float, default=1000.0, help="最慢一次超过该耗时建议停用")
+    ap.add_argument("--deactivate-runs", type=int, default=3, help="在该数量及以上的运行中出现建议停用")
+    ap.add_argument("--report-json", type=str, default="", help="将排名写入 JSON 文件（可选）")
+    args = ap.parse_args()
+
+    rows = build_report(args.limit, args.min_run_id, args.min_hits, args.deactivate_ms, args.deactivate_runs)
+    print("========================================")
+    print(" 慢匹配模板排名（按累计耗时）")
+    print("========================================")
+    for i, r in enumerate(rows, 1):
+        state = "启用" if r["is_active"] else "已停用"
+        print(f"{i:3d}. template_id={r['template_id']} [{state}] 建议={'停用' if r['action'] == 'deactivate' else '改写'} "
+              f"次数={r['hits']} 运行数={r['runs']} 累计={r['total_ms']:.1f}ms 最慢={r['max_ms']:.1f}ms 平均={r['avg_ms']:.1f}ms")
+        print(f"     pattern_nomal: {(r['pattern_nomal'] or '')[:160]}")
+        print(f"     最慢文本     : {r['slowest_text'][:160]}")
+    if not rows:
+        print("（暂无慢匹配记录）")
+
+    if args.report_json:
+        with open(args.report_json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"[OK] 报告已写入: {args.report_json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,15 +1,19 @@
 # bin/scan_regex_templates.py
 # -*- coding: utf-8 -*-
 """
-离线扫描 regex_template 表中的所有 pattern / pattern_nomal，做正则安全检测。
+离线扫描 regex_template 表中的所有模板，做正则安全检测。
 
 功能：
   1) 检测每条模板是否存在灾难性回溯风险或编译问题；
-  2) 对 pattern 与 pattern_nomal 各测一次，取“更危险”的等级；
-  3) 输出 summary 到控制台；
-  4) 可将详细结果写入 JSON 报告；
-  5) 可选：对 level = 'danger' 的模板自动软删除（调用 deactivate_template）；
-  6) 可选：把所有 warning 也当 danger 禁用（推荐，彻底一点）。
+  2) 检测写库后的 pattern 列（NUMNUM 已展开，覆盖 pattern_nomal 的风险）；
+     仅当 pattern_nomal 展开后与 pattern 不一致时才额外检测 pattern_nomal，取“更危险”的等级；
+  3) 结论按 (模式, 样本, 时限) 的内容哈希与分析器版本缓存在 regex_safety_verdict 表，
+     只有新增或变更的模板才重新压测；未命中缓存的模板在进程池中并行检测；
+  4) slow_match 表中采集到的真实慢文本作为该模板的压测样本，并按累计慢匹配耗时给出排名（--slow-only 只扫这些模板）；
+  5) 输出 summary 到控制台；
+  6) 可将详细结果写入 JSON 报告；
+  7) 可选：对 level = 'danger' 的模板自动软删除（调用 deactivate_template）；
+  8) 可选：把所有 warning 也当 danger 禁用（推荐，彻底一点）。
 
 用法示例：
 
@@ -23,10 +27,12 @@
 
 import argparse
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
-from store.dao import fetch_all_templates, deactivate_template
-from core.regex_safety import analyze_regex_safety, RegexSafetyResult
+from store.dao import (NUMERIC_PATTERN, fetch_all_templates, deactivate_template,
+                       get_safety_verdicts, upsert_safety_verdicts,
+                       get_slow_match_ranking, get_slow_match_texts)
+from core.regex_safety import ANALYZER_VERSION, RegexSafetyResult, analyze_many, verdict_key
 
 
 _LEVEL_RANK = {"ok": 0, "warning": 1, "danger": 2}
@@ -40,40 +46,81 @@ def _pick_worse(a: RegexSafetyResult, b: RegexSafetyResult | None) -> RegexSafet
     return a
 
 
+def _texts_to_check(pattern: str, pattern_nomal: str) -> List[str]:
+    texts = [pattern]
+    if pattern_nomal and pattern_nomal.replace("NUMNUM", NUMERIC_PATTERN) != pattern:
+        texts.append(pattern_nomal)
+    return texts
+
+
 def scan_templates(
     active_only: bool = True,
     timeout_sec: float = 0.5,
     auto_deactivate_danger: bool = False,
     ban_warning_too: bool = False,
+    workers: int = 0,
+    use_cache: bool = True,
+    use_slow_matches: bool = True,
+    slow_only: bool = False,
+    slow_texts_per_template: int = 3,
 ) -> Dict[str, Any]:
     rows = fetch_all_templates(active_only=active_only)
 
+    # 0) 生产运行中采集到的慢匹配: 排名 + 真实慢文本
+    slow_rank: Dict[int, Dict[str, Any]] = {}
+    slow_texts: Dict[int, List[str]] = {}
+    if use_slow_matches or slow_only:
+        slow_rank = {r["template_id"]: dict(r) for r in get_slow_match_ranking(limit=1_000_000)}
+        if slow_only:
+            rows = [r for r in rows if r["template_id"] in slow_rank]
+        slow_texts = get_slow_match_texts([r["template_id"] for r in rows if r["template_id"] in slow_rank],
+                                          per_template=slow_texts_per_template)
+
+    # 1) 展开待检测的 (模式, 样本) 并查缓存
+    jobs: List[Tuple[str, List[str], str]] = []
+    per_row: List[List[int]] = []
+    for row in rows:
+        sample_log = row["sample_log"] or ""
+        samples = ([sample_log] if sample_log else []) + slow_texts.get(row["template_id"], [])
+        idxs = []
+        for text in _texts_to_check(row["pattern"], row["pattern_nomal"]):
+            idxs.append(len(jobs))
+            jobs.append((text, samples, verdict_key(text, samples, timeout_sec)))
+        per_row.append(idxs)
+
+    keys = list({k for _, _, k in jobs})
+    cached = get_safety_verdicts(keys, ANALYZER_VERSION) if use_cache else {}
+
+    # 2) 未命中的去重后并行检测, 结论写回缓存
+    todo: Dict[str, Tuple[str, List[str]]] = {}
+    for text, samples, k in jobs:
+        if k not in cached and k not in todo:
+            todo[k] = (text, samples)
+    fresh: Dict[str, RegexSafetyResult] = {}
+    if todo:
+        todo_keys = list(todo)
+        results = analyze_many([todo[k] for k in todo_keys], timeout_sec=timeout_sec, workers=workers)
+        fresh = dict(zip(todo_keys, results))
+        upsert_safety_verdicts(
+            [(k, r.to_dict()) for k, r in fresh.items() if r.runtime_error != "analysis_timeout"],
+            ANALYZER_VERSION,
+        )
+
+    def _result(k: str) -> RegexSafetyResult:
+        return fresh[k] if k in fresh else RegexSafetyResult.from_dict(cached[k])
+
     results: List[Dict[str, Any]] = []
     total = len(rows)
     ok_cnt = warning_cnt = danger_cnt = 0
 
-    for row in rows:
+    for row, idxs in zip(rows, per_row):
         template_id = row["template_id"]
-        pattern = row["pattern"]
         pattern_nomal = row["pattern_nomal"]
         sample_log = row["sample_log"] or ""
 
-        # 分别对 pattern 和 pattern_nomal 做检测，取“更危险”的那个结果
-        res_pattern: RegexSafetyResult = analyze_regex_safety(
-            pattern=pattern,
-            sample_texts=[sample_log] if sample_log else [],
-            timeout_sec=timeout_sec,
-        )
-
-        res_nomal: RegexSafetyResult | None = None
-        if pattern_nomal:
-            res_nomal = analyze_regex_safety(
-                pattern=pattern_nomal,
-                sample_texts=[sample_log] if sample_log else [],
-                timeout_sec=timeout_sec,
-            )
-
-        best = _pick_worse(res_pattern, res_nomal)
+        best = _result(jobs[idxs[0]][2])
+        for i in idxs[1:]:
+            best = _pick_worse(best, _result(jobs[i][2]))
 
         if best.level == "ok":
             ok_cnt += 1
@@ -86,6 +133,12 @@ def scan_templates(
         item["template_id"] = template_id
         item["pattern_nomal"] = pattern_nomal
         item["sample_log_preview"] = sample_log[:200]
+        item["cached"] = all(jobs[i][2] in cached for i in idxs)
+        sr = slow_rank.get(template_id)
+        if sr:
+            item["slow_hits"] = sr["hits"]
+            item["slow_total_ms"] = sr["total_ms"]
+            item["slow_max_ms"] = sr["max_ms"]
         results.append(item)
 
         # 是否禁用：danger 必禁；ban_warning_too 时，warning 也禁
@@ -99,6 +152,14 @@ def scan_templates(
         "ok": ok_cnt,
         "warning": warning_cnt,
         "danger": danger_cnt,
+        "analyzed": len(fresh),
+        "cache_hits": len(cached),
+        "analyzer_version": ANALYZER_VERSION,
+        # 有慢匹配记录的模板按累计耗时排序, 排在前面的优先改写或停用
+        "slow_ranked": [
+            {k: d[k] for k in ("template_id", "level", "complexity", "degree", "slow_hits", "slow_total_ms", "slow_max_ms")}
+            for d in sorted((d for d in results if "slow_hits" in d), key=lambda d: -d["slow_total_ms"])
+        ],
     }
     return {"summary": summary, "details": results}
 
@@ -121,6 +182,27 @@ def main() -> int:
         default=0.5,
         help="单次动态检测 timeout 秒数，默认 0.5s（离线运行，一次性稍微慢点没关系）",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="并行检测的进程数，0 为 CPU 数",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="忽略已缓存的结论，全部重新检测（结果仍会写回缓存）",
+    )
+    parser.add_argument(
+        "--slow-only",
+        action="store_true",
+        help="只扫描 slow_match 表中有慢匹配记录的模板",
+    )
+    parser.add_argument(
+        "--no-slow-matches",
+        action="store_true",
+        help="不使用 slow_match 表中的慢文本做压测样本",
+    )
     parser.add_argument(
         "--report-json",
         type=str,
@@ -149,6 +231,10 @@ def main() -> int:
         timeout_sec=args.timeout_sec,
         auto_deactivate_danger=args.auto_deactivate_danger,
         ban_warning_too=args.ban_warning_too,
+        workers=args.workers,
+        use_cache=not args.no_cache,
+        use_slow_matches=not args.no_slow_matches,
+        slow_only=args.slow_only,
     )
 
     summary = result["summary"]
@@ -159,7 +245,11 @@ def main() -> int:
     print(f"✅ 安全 (ok)          : {summary['ok']}")
     print(f"⚠️  警告 (warning)    : {summary['warning']}")
     print(f"❌ 危险 (danger)      : {summary['danger']}")
+    print(f"本次检测 / 缓存命中    : {summary['analyzed']} / {summary['cache_hits']}（分析器版本 {summary['analyzer_version']}）")
     print("========================================")
+    for r in summary["slow_ranked"][:10]:
+        print(f"慢匹配 template_id={r['template_id']} level={r['level']} 复杂度={r['complexity']}/{r['degree']} "
+              f"次数={r['slow_hits']} 累计={r['slow_total_ms']:.1f}ms 最慢={r['slow_max_ms']:.1f}ms")
 
     if args.report_json:
         with open(args.report_json, "w", encoding="utf-8") as f:
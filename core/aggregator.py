@@ -1,45 +1,386 @@
 # -*- coding: utf-8 -*-
-from typing import Dict, Any, List, Tuple
+import os
+import pickle
+import tempfile
+import time
+from array import array
+from collections import Counter
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 from datetime import datetime
 
+try:
+    import numpy as np
+except ImportError:  # numpy 可选: 缺失时微批分组退回 Counter
+    np = None
+
 from store import dao
+from core.parser import TS_NONE, ts_to_epoch, epoch_to_ts
+from core.symbols import FIELDS, SymbolTable
+
+# 时间桶粒度 -> 桶宽（秒）
+GRANULARITY_SECONDS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+# 多粒度汇总的级联顺序，由细到粗
+ROLLUP_LEVELS = ("second", "minute", "hour", "day")
+# 默认不写秒级桶：秒级行数与日志行数同阶，按需显式开启
+DEFAULT_ROLLUP_LEVELS = ("minute", "hour", "day")
+# 可计入时间桶的整数秒范围 [1970-01-01, 10000-01-01)，越界的异常时间戳丢弃
+EPOCH_MIN = 0
+EPOCH_MAX = 253402300800
+
+
+def _minute_bucket(epoch: int) -> int:
+    """
+    将整数秒时间戳归一到分钟粒度（取整到分钟起点），纯整数运算，无需 strptime。
+    """
+    return epoch - epoch % 60
+
+
+def _bucket_label(epoch: int) -> str:
+    """分桶起点的写库表示，与旧版 isoformat 输出保持一致，如 2025-09-29T18:39:00；与 parser.epoch_to_ts 一样按 UTC 经 gmtime 格式化。"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(epoch))
+
+
+def _group_batch(template_ids: Sequence[int],
+                 dims: Sequence[Tuple[int, ...]],
+                 epochs: Sequence[int],
+                 width: int,
+                 numpy_min_batch: int = 256):
+    """
+    微批分组：返回 ((template_id, *维度编码, 桶起点), 行数) 的可迭代对象，跳过无时间戳的行。
+    numpy 可用且批足够大时用 np.unique(axis=0) 排序分组，否则用 Counter 对元组计数。
+    """
+    n = len(template_ids)
+    if not n:
+        return ()
+    if np is not None and n >= numpy_min_batch:
+        ep = np.asarray(epochs, dtype=np.int64)
+        ok = ep != TS_NONE
+        if not ok.any():
+            return ()
+        ep = ep[ok]
+        cols = np.column_stack((
+            np.asarray(template_ids, dtype=np.int64)[ok],
+            np.asarray(dims, dtype=np.int64).reshape(n, -1)[ok],
+            ep - ep % width,
+        ))
+        keys, cnts = np.unique(cols, axis=0, return_counts=True)
+        return zip(map(tuple, keys.tolist()), cnts.tolist())
+    c = Counter((t, d, e - e % width) for t, d, e in zip(template_ids, dims, epochs) if e != TS_NONE)
+    return (((t,) + tuple(d) + (b,), k) for (t, d, b), k in c.items())
+
+
+def _bucket_row(run_id: int, file_id: str, symbols: SymbolTable, fields: Sequence[str],
+                classification: str, series: Tuple[int, ...], granularity: str,
+                bucket_epoch: int, count: int) -> Dict[str, Any]:
+    """series 为 (template_id, *维度编码)，解码为一条 key_time_bucket 写库行。"""
+    row = dict(
+        run_id=run_id,
+        file_id=file_id,
+        template_id=series[0],
+        mod="",
+        smod="",
+        classification=classification,
+        level="",
+        thread_id="",
+        bucket_granularity=granularity,
+        bucket_start=_bucket_label(bucket_epoch),
+        count_in_bucket=count,
+    )
+    for f, code in zip(fields, series[1:]):
+        row[f] = symbols.decode(f, code)
+    return row
+
+
+class TimeBucketCounter:
+    """
+    key_time_bucket 的单粒度批量计数器：
+    - add_batch 一次接收一个微批的 (template_id, 维度编码, 整数秒) 三列，先经 _group_batch 在批内分组再并入计数表
+    - 计数表键为 (template_id, *维度编码, 桶起点整数秒)，只在写库时解码维度、格式化桶起点
+    - 键数达到 max_keys 即写库并清空；写库为累加 upsert，多次 flush 与一次 flush 结果相同
+    fields: dims 各列对应的符号表字段，未列出的字段写库为空串（P2 不区分 thread_id 时只传前三列）
+    """
+
+    def __init__(self, run_id: int, file_id: str, symbols: SymbolTable,
+                 granularity: str = "minute",
+                 fields: Sequence[str] = FIELDS,
+                 classification: str = "",
+                 max_keys: int = 200000,
+                 numpy_min_batch: int = 256) -> None:
+        if granularity not in GRANULARITY_SECONDS:
+            raise ValueError(f"未知的时间桶粒度: {granularity}")
+        self.run_id = run_id
+        self.file_id = file_id
+        self.symbols = symbols
+        self.granularity = granularity
+        self.width = GRANULARITY_SECONDS[granularity]
+        self.fields = tuple(fields)
+        self.classification = classification or ""
+        self.max_keys = max(1, int(max_keys or 1))
+        self.numpy_min_batch = int(numpy_min_batch)
+        self.counts: Dict[Tuple[int, ...], int] = {}
+        self.flushed_rows = 0
+
+    def add(self, template_id: int, dims: Tuple[int, ...], epoch: int, n: int = 1) -> None:
+        """逐条入口（Aggregator.add_coded 用），无时间戳的行不计入时间桶。"""
+        if epoch == TS_NONE:
+            return
+        key = (template_id,) + tuple(dims) + (epoch - epoch % self.width,)
+        self.counts[key] = self.counts.get(key, 0) + n
+        if len(self.counts) >= self.max_keys:
+            self.flush()
+
+    def add_batch(self,
+                  template_ids: Sequence[int],
+                  dims: Sequence[Tuple[int, ...]],
+                  epochs: Sequence[int]) -> None:
+        """三列等长；epoch 为 TS_NONE 的行跳过。"""
+        counts = self.counts
+        for key, k in _group_batch(template_ids, dims, epochs, self.width, self.numpy_min_batch):
+            counts[key] = counts.get(key, 0) + k
+        if len(counts) >= self.max_keys:
+            self.flush()
+
+    def rows(self) -> List[Dict[str, Any]]:
+        return [
+            _bucket_row(self.run_id, self.file_id, self.symbols, self.fields, self.classification,
+                        key[:-1], self.granularity, key[-1], cnt)
+            for key, cnt in self.counts.items()
+        ]
+
+    def flush(self) -> None:
+        if not self.counts:
+            return
+        rows = self.rows()
+        dao.batch_upsert_key_time_bucket(rows)
+        self.flushed_rows += len(rows)
+        self.counts.clear()
 
 
-def _minute_bucket(ts: str) -> str:
+class TimeRollup:
     """
-    将 "YYYYMMDD HHMMSS" 形式的时间戳归一到分钟粒度。
-    解析失败时直接返回原字符串，避免抛异常导致统计中断。
+    单遍多粒度时间桶：second -> minute -> hour -> day 级联汇总
+    - 每个序列 (template_id, *维度编码) 持有稀疏的 {分钟起点整数秒: 计数}，只为有日志的分钟占内存，
+      时间跨度再大（如混入 19700101 的异常时间戳）也不会按跨度分配
+    - 需要秒级时另存稀疏的 {整数秒: 计数}；默认不写秒级桶（DEFAULT_ROLLUP_LEVELS）
+    - 小时 / 天不单独计数，写库时由分钟计数逐级求和得到，入口开销与单粒度计数相同
+    - 内存中的 (序列, 分钟 / 秒) 键数达到 max_keys 即把当前行暂存到临时文件并清空，不中途写库；
+      iter_rows 结束时连同暂存行一并产出，由调用方在同一事务里累加 upsert，分多次暂存结果不变
+    - 超出 [EPOCH_MIN, EPOCH_MAX) 的时间戳不计入时间桶，计数记在 dropped
     """
-    try:
-        dt = datetime.strptime(ts, "%Y%m%d %H%M%S")
-        return dt.replace(second=0).isoformat()
-    except Exception:
-        return ts
+
+    def __init__(self, run_id: int, file_id: str, symbols: SymbolTable,
+                 levels: Sequence[str] = DEFAULT_ROLLUP_LEVELS,
+                 fields: Sequence[str] = FIELDS,
+                 classification: str = "",
+                 numpy_min_batch: int = 256,
+                 flush_rows: int = 5000,
+                 max_keys: int = 200000,
+                 spill_dir: Optional[str] = None) -> None:
+        unknown = [g for g in levels if g not in GRANULARITY_SECONDS]
+        if unknown:
+            raise ValueError(f"未知的时间桶粒度: {unknown}")
+        self.run_id = run_id
+        self.file_id = file_id
+        self.symbols = symbols
+        self.levels = tuple(g for g in ROLLUP_LEVELS if g in levels)
+        self.keep_seconds = "second" in self.levels
+        self.fields = tuple(fields)
+        self.classification = classification or ""
+        self.numpy_min_batch = int(numpy_min_batch)
+        self.flush_rows = max(1, int(flush_rows or 1))
+        self.max_keys = max(1, int(max_keys or 1))
+        self.minutes: Dict[Tuple[int, ...], Dict[int, int]] = {}
+        self.seconds: Dict[Tuple[int, ...], Dict[int, int]] = {}
+        self.n_keys = 0
+        self.dropped = 0
+        self.flushed_rows = 0
+        self.spill_dir = spill_dir
+        # 暂存文件路径；随对象 pickle 回主进程，merge 时由主汇总接管
+        self.spill_paths: List[str] = []
+
+    @staticmethod
+    def _bump(table: Dict[Tuple[int, ...], Dict[int, int]], series: Tuple[int, ...], at: int, n: int) -> int:
+        """累加一格，返回新建的键数（0 或 1）。"""
+        cells = table.get(series)
+        if cells is None:
+            cells = table[series] = {}
+        c = cells.get(at)
+        cells[at] = n if c is None else c + n
+        return c is None
+
+    def add(self, series: Tuple[int, ...], epoch: int, n: int = 1) -> None:
+        """series = (template_id, *维度编码)；epoch 为整数秒（秒级关闭时可传分钟起点）。"""
+        if epoch == TS_NONE:
+            return
+        if not EPOCH_MIN <= epoch < EPOCH_MAX:
+            self.dropped += n
+            return
+        new = self._bump(self.minutes, series, epoch - epoch % 60, n)
+        if self.keep_seconds:
+            new += self._bump(self.seconds, series, epoch, n)
+        if new:
+            self.n_keys += new
+            if self.n_keys >= self.max_keys:
+                self._spill()
+
+    def add_batch(self,
+                  template_ids: Sequence[int],
+                  dims: Sequence[Tuple[int, ...]],
+                  epochs: Sequence[int]) -> None:
+        """与 TimeBucketCounter.add_batch 相同的三列入口，批内先按 (序列, 秒) 分组。"""
+        width = 1 if self.keep_seconds else 60
+        add = self.add
+        for key, k in _group_batch(template_ids, dims, epochs, width, self.numpy_min_batch):
+            add(key[:-1], key[-1], k)
+
+    def merge(self, other: "TimeRollup", code_maps: Optional[Dict[str, List[int]]] = None) -> None:
+        """
+        并入另一份部分汇总（各分片 worker 的结果），按分钟 / 秒逐格相加，满足结合律，合并顺序不影响结果。
+        code_maps: SymbolTable.absorb 返回的编码映射，other 使用独立符号表时传入。
+        """
+        maps = [code_maps[f] for f in self.fields] if code_maps else None
+
+        def _remap(series: Tuple[int, ...]) -> Tuple[int, ...]:
+            if not maps:
+                return series
+            return (series[0],) + tuple(m[c] for m, c in zip(maps, series[1:]))
+
+        self.dropped += other.dropped
+        self.spill_paths.extend(other.spill_paths)
+        other.spill_paths = []
+        for src, dst in ((other.minutes, self.minutes), (other.seconds, self.seconds)):
+            if dst is self.seconds and not self.keep_seconds:
+                continue
+            for series, cells in src.items():
+                series = _remap(series)
+                for at, c in cells.items():
+                    self.n_keys += self._bump(dst, series, at, c)
+        if self.n_keys >= self.max_keys:
+            self._spill()
+
+    def total(self) -> int:
+        return sum(sum(cells.values()) for cells in self.minutes.values())
+
+    def iter_buckets(self) -> Iterator[Tuple[Tuple[int, ...], str, int, int]]:
+        """按序列逐级产出 (series, 粒度, 桶起点整数秒, 计数)，只产出非零桶。"""
+        levels = self.levels
+        for series, cells in self.minutes.items():
+            if self.keep_seconds:
+                for e, c in sorted(self.seconds.get(series, {}).items()):
+                    yield series, "second", e, c
+            minutes = sorted(cells.items())
+            if "minute" in levels:
+                for m, c in minutes:
+                    yield series, "minute", m, c
+            for g in ("hour", "day"):
+                if g not in levels:
+                    continue
+                width = GRANULARITY_SECONDS[g]
+                rolled: Dict[int, int] = {}
+                for m, c in minutes:
+                    b = m - m % width
+                    rolled[b] = rolled.get(b, 0) + c
+                for b, c in rolled.items():
+                    yield series, g, b, c
+
+    def _rows(self, buckets: Iterable[Tuple[Tuple[int, ...], str, int, int]]) -> Iterator[Dict[str, Any]]:
+        for series, g, e, c in buckets:
+            yield _bucket_row(self.run_id, self.file_id, self.symbols, self.fields, self.classification,
+                              series, g, e, c)
+
+    def _clear(self) -> None:
+        self.minutes.clear()
+        self.seconds.clear()
+        self.n_keys = 0
+
+    def _spill(self) -> None:
+        """当前全部粒度的行按 flush_rows 分块 pickle 到临时文件并清空内存。"""
+        fd, path = tempfile.mkstemp(prefix="rollup_", suffix=".pkl", dir=self.spill_dir)
+        self.spill_paths.append(path)
+        with os.fdopen(fd, "wb") as f:
+            chunk: List[Dict[str, Any]] = []
+            for row in self._rows(self.iter_buckets()):
+                chunk.append(row)
+                if len(chunk) >= self.flush_rows:
+                    pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            if chunk:
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._clear()
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        依次产出暂存文件中的行与内存中的行并清空，读完的暂存文件随即删除；
+        由调用方与其他结果放在同一个事务里写库（同一格可能出现多行，累加 upsert 即可）。
+        """
+        while self.spill_paths:
+            path = self.spill_paths[0]
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        chunk = pickle.load(f)
+                    except EOFError:
+                        break
+                    self.flushed_rows += len(chunk)
+                    yield from chunk
+            os.remove(path)
+            self.spill_paths.pop(0)
+        for row in self._rows(self.iter_buckets()):
+            self.flushed_rows += 1
+            yield row
+        self._clear()
+
+    def discard(self) -> None:
+        """放弃尚未写库的结果（写库失败时），删除暂存文件。"""
+        for path in self.spill_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.spill_paths = []
+        self._clear()
+
+    def flush(self) -> None:
+        """全部粒度（含暂存行）按 flush_rows 分批写库，随后清空。"""
+        chunk: List[Dict[str, Any]] = []
+        for row in self.iter_rows():
+            chunk.append(row)
+            if len(chunk) >= self.flush_rows:
+                dao.batch_upsert_key_time_bucket(chunk)
+                chunk = []
+        if chunk:
+            dao.batch_upsert_key_time_bucket(chunk)
 
 
 class Aggregator:
     """
     第二遍统计用的聚合器：
-    - 按 (template_id, mod, smod, classification, level, thread_id) 维度聚合
+    - 按 (template_id, mod, smod, classification, level, thread_id) 维度聚合，
+      其中 mod / smod / level / thread_id 为符号表整数编码，写库时才解码
     - 记录 first_ts / last_ts / line_count
-    - 支持按分钟粒度做时间桶统计（暂未写库，可按需打开）
+    - 按 bucket_granularity 做时间桶统计，经 TimeBucketCounter 累加写入 key_time_bucket
+      （bucket_granularity 为 "off" 时关闭）
     """
 
     def __init__(self, run_id: int, file_id: str,
                  bucket_granularity: str = "minute",
-                 flush_lines: int = 2000) -> None:
+                 flush_lines: int = 2000,
+                 symbols: Optional[SymbolTable] = None,
+                 bucket_max_keys: int = 200000) -> None:
         self.run_id = run_id
         self.file_id = file_id
         self.bucket_granularity = bucket_granularity or "minute"
         self.flush_lines = int(flush_lines) if flush_lines else 2000
+        # 与 parse_fields(symbols=...) 共用同一张表时，可直接用 ParsedLine.dims 调 add_coded
+        self.symbols = symbols if symbols is not None else SymbolTable()
 
-        # key: (template_id, mod, smod, classification, level, thread_id)
+        # key: (template_id, mod, smod, classification, level, thread_id)，维度为整数编码
         # val: row dict 写入 log_match_summary
-        self.summary: Dict[Tuple[int, str, str, str, str, str], Dict[str, Any]] = {}
+        self.summary: Dict[Tuple[int, int, int, str, int, int], Dict[str, Any]] = {}
 
-        # key: (template_id, mod, smod, classification, level, thread_id, bucket_str)
-        # val: count
-        self.time_bucket: Dict[Tuple[int, str, str, str, str, str, str], int] = {}
+        # 时间桶计数器按 classification 分开（分类为低基数字符串，不进数值键）
+        self.bucket_max_keys = bucket_max_keys
+        self.buckets: Dict[str, TimeBucketCounter] = {}
 
         self._line_acc: int = 0
 
@@ -50,29 +391,38 @@ class Aggregator:
                   classification: str,
                   level: str,
                   thread_id: str,
-                  ts: str) -> None:
+                  ts: Union[int, str]) -> None:
         """
         template_id: 命中的模板 ID
         mod/smod: 模块/子模块
         classification: 分类标签（功能/性能等），没有就传 "" 即可
         level: 日志级别
         thread_id: 线程 ID
-        ts: 原始时间戳字符串（尽量保持统一格式，如 "YYYYMMDD HHMMSS"）
+        ts: 整数秒时间戳（ParsedLine.epoch）；兼容传入 "YYYYMMDD HHMMSS" 字符串
+        """
+        dims = self.symbols.encode_dims(mod or "", smod or "", level or "", thread_id or "")
+        self.add_coded(template_id, dims, ts, classification=(classification or "").strip())
+
+    def add_coded(self,
+                  template_id: int,
+                  dims: Tuple[int, ...],
+                  ts: Union[int, str],
+                  classification: str = "") -> None:
+        """
+        dims: (mod, smod, level, thread_id) 的符号表编码，通常直接取 ParsedLine.dims
         """
         try:
             tid = int(template_id)
         except Exception:
             return
 
-        mod = (mod or "").strip()
-        smod = (smod or "").strip()
-        classification = (classification or "").strip()
-        level = (level or "").strip()
-        thread_id = (thread_id or "").strip()
-        ts = (ts or "").strip()
+        if isinstance(ts, str):
+            ts = ts_to_epoch(ts.strip())
+        elif ts is None:
+            ts = TS_NONE
 
+        mod, smod, level, thread_id = dims
         key = (tid, mod, smod, classification, level, thread_id)
-        now = datetime.utcnow().isoformat()
 
         row = self.summary.get(key)
         if row is None:
@@ -88,63 +438,102 @@ class Aggregator:
                 "first_ts": ts,
                 "last_ts": ts,
                 "line_count": 1,
-                "updated_at": now,
             }
             self.summary[key] = row
         else:
             # 行数累加
             row["line_count"] = int(row.get("line_count") or 0) + 1
-            # first_ts / last_ts 更新
-            if ts:
-                first_ts = row.get("first_ts") or ""
-                last_ts = row.get("last_ts") or ""
-                if not first_ts or ts < first_ts:
+            # first_ts / last_ts 更新（整数比较）
+            if ts != TS_NONE:
+                if row["first_ts"] == TS_NONE or ts < row["first_ts"]:
                     row["first_ts"] = ts
-                if not last_ts or ts > last_ts:
+                if ts > row["last_ts"]:
                     row["last_ts"] = ts
-            row["updated_at"] = now
 
-        # 时间桶统计（按需打开）
-        if ts and self.bucket_granularity == "minute":
-            bucket = _minute_bucket(ts)
-            bkey = (tid, mod, smod, classification, level, thread_id, bucket)
-            self.time_bucket[bkey] = self.time_bucket.get(bkey, 0) + 1
+        if ts != TS_NONE and self.bucket_granularity in GRANULARITY_SECONDS:
+            self._bucket_counter(classification).add(tid, dims, ts)
 
         self._line_acc += 1
         if self._line_acc >= self.flush_lines:
             self.flush()
 
-    def flush(self) -> None:
+    def add_batch(self,
+                  template_ids: Sequence[int],
+                  dims: Sequence[Tuple[int, ...]],
+                  epochs: Sequence[int],
+                  classification: str = "") -> None:
         """
-        将当前累积的 summary / time_bucket 写入数据库。
+        微批入口：三列等长，dims 为 (mod, smod, level, thread_id) 编码。
+        summary 逐条累加（纯整数比较），时间桶交给 TimeBucketCounter 整批分组。
         """
-        if not self.summary and not self.time_bucket:
-            return
+        summary = self.summary
+        for tid, d, ts in zip(template_ids, dims, epochs):
+            key = (tid, d[0], d[1], classification, d[2], d[3])
+            row = summary.get(key)
+            if row is None:
+                summary[key] = {
+                    "run_id": self.run_id,
+                    "file_id": self.file_id,
+                    "template_id": tid,
+                    "mod": d[0],
+                    "smod": d[1],
+                    "classification": classification,
+                    "level": d[2],
+                    "thread_id": d[3],
+                    "first_ts": ts,
+                    "last_ts": ts,
+                    "line_count": 1,
+                }
+                continue
+            row["line_count"] += 1
+            if ts != TS_NONE:
+                if row["first_ts"] == TS_NONE or ts < row["first_ts"]:
+                    row["first_ts"] = ts
+                if ts > row["last_ts"]:
+                    row["last_ts"] = ts
+
+        if self.bucket_granularity in GRANULARITY_SECONDS:
+            self._bucket_counter(classification).add_batch(template_ids, dims, epochs)
 
+        self._line_acc += len(template_ids)
+        if self._line_acc >= self.flush_lines:
+            self.flush()
+
+    def _decode_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        out = dict(row)
+        out["mod"] = self.symbols.decode("mod", row["mod"])
+        out["smod"] = self.symbols.decode("smod", row["smod"])
+        out["level"] = self.symbols.decode("level", row["level"])
+        out["thread_id"] = self.symbols.decode("thread_id", row["thread_id"])
+        return out
+
+    def _bucket_counter(self, classification: str) -> TimeBucketCounter:
+        bc = self.buckets.get(classification)
+        if bc is None:
+            bc = TimeBucketCounter(self.run_id, self.file_id, self.symbols,
+                                   granularity=self.bucket_granularity,
+                                   classification=classification,
+                                   max_keys=self.bucket_max_keys)
+            self.buckets[classification] = bc
+        return bc
+
+    def flush(self) -> None:
+        """
+        将当前累积的 summary / 时间桶写入数据库。
+        """
         if self.summary:
-            dao.batch_upsert_log_match_summary(list(self.summary.values()))
-
-        # 如需启用时间桶统计，取消下面注释，并确保 key_time_bucket 表结构与 dao 中函数一致
-        # if self.time_bucket:
-        #     trows: List[Dict[str, Any]] = []
-        #     for (template_id, mod, smod, classification, level, thread_id, b), cnt in self.time_bucket.items():
-        #         trows.append(
-        #             dict(
-        #                 run_id=self.run_id,
-        #                 file_id=self.file_id,
-        #                 template_id=template_id,
-        #                 mod=mod,
-        #                 smod=smod,
-        #                 classification=classification,
-        #                 level=level,
-        #                 thread_id=thread_id,
-        #                 bucket_granularity=self.bucket_granularity,
-        #                 bucket_start=b,
-        #                 count_in_bucket=cnt,
-        #             )
-        #         )
-        #     dao.batch_upsert_key_time_bucket(trows)
+            now = datetime.utcnow().isoformat()
+            rows = []
+            for row in self.summary.values():
+                out = self._decode_row(row)
+                out["first_ts"] = epoch_to_ts(row["first_ts"])
+                out["last_ts"] = epoch_to_ts(row["last_ts"])
+                out["updated_at"] = now
+                rows.append(out)
+            dao.batch_upsert_log_match_summary(rows)
+
+        for bc in self.buckets.values():
+            bc.flush()
 
         self.summary.clear()
-        self.time_bucket.clear()
         self._line_acc = 0
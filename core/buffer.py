@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
-from typing import List, Set
-import hashlib, re
+from typing import Dict, List, Optional, Set, Tuple
+import hashlib, random, re
 
 def _norm(s: str) -> str:
     s = re.sub(r'\s+', ' ', s).strip()
@@ -10,32 +10,160 @@ def _norm(s: str) -> str:
 def _hash(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8")).hexdigest()
 
+
+# ------------------------------ MinHash + LSH 分带 ------------------------------
+# 词元: 连续字母/下划线、连续数字、单个标点各算一个, 这样 "Temporal6v" 与 "Temporal5v" 只差一个词元
+_TOKEN_RE = re.compile(r"[A-Za-z_]+|\d+|[^\sA-Za-z_\d]")
+_MERSENNE_61 = (1 << 61) - 1
+_TOKEN_HASH_CACHE: Dict[str, int] = {}
+
+
+def _token_hash(tok: str) -> int:
+    h = _TOKEN_HASH_CACHE.get(tok)
+    if h is None:
+        h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+        if len(_TOKEN_HASH_CACHE) > 200000:
+            _TOKEN_HASH_CACHE.clear()
+        _TOKEN_HASH_CACHE[tok] = h
+    return h
+
+
+def _shingles(s: str, k: int = 1) -> Set[str]:
+    toks = _TOKEN_RE.findall(s)
+    if k <= 1 or len(toks) < k:
+        return set(toks) or {s}
+    return {" ".join(toks[i:i + k]) for i in range(len(toks) - k + 1)}
+
+
+class MinHasher:
+    """基于词元 shingle 的 MinHash 签名, 固定种子保证同一输入跨运行签名一致。"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 1, seed: int = 20240901):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._perms = [(rnd.randrange(1, _MERSENNE_61), rnd.randrange(0, _MERSENNE_61)) for _ in range(num_perm)]
+
+    def signature(self, s: str) -> Tuple[int, ...]:
+        hs = [_token_hash(t) for t in _shingles(s, self.shingle_size)]
+        p = _MERSENNE_61
+        return tuple(min((a * h + b) % p for h in hs) for a, b in self._perms)
+
+
+def _estimate_jaccard(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    same = sum(1 for x, y in zip(sig_a, sig_b) if x == y)
+    return same / max(1, len(sig_a))
+
+
 class DiversityBuffer:
-    def __init__(self, size_threshold: int = 100, max_per_micro_batch: int = 15):
+    """
+    委员会样本缓冲:
+    - 精确去重: key_text 的 SHA1, 每条只算一次 (pick 时算好, add 时复用)
+    - 近重复过滤: MinHash + LSH 分带, 与已缓冲样本(及同批已选样本)估计 Jaccard >= jaccard_threshold 的不再入缓冲
+      jaccard_threshold 为 None 或 >= 1 时仅做精确去重
+    """
+
+    def __init__(self, size_threshold: int = 100, max_per_micro_batch: int = 15,
+                 jaccard_threshold: Optional[float] = 0.7, num_perm: int = 64, bands: int = 16,
+                 shingle_size: int = 1):
         self.size_threshold = size_threshold
         self.max_per_micro_batch = max_per_micro_batch
         self.samples: List[str] = []
         self.hset: Set[str] = set()
         self._locked = False
 
+        self.jaccard_threshold = jaccard_threshold
+        self._near_dup = jaccard_threshold is not None and 0 < float(jaccard_threshold) < 1
+        bands = max(1, min(int(bands), int(num_perm)))
+        self._rows = max(1, int(num_perm) // bands)
+        self._bands = bands
+        self._hasher = MinHasher(num_perm=self._rows * bands, shingle_size=shingle_size)
+        self._sigs: List[Tuple[int, ...]] = []
+        self._lsh: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+        # pick_for_buffer 算好的 (sha1, 签名), 供随后的 add 复用
+        self._picked_meta: Dict[str, Tuple[str, Optional[Tuple[int, ...]]]] = {}
+        self.near_dup_skipped = 0
+
+    def _band_keys(self, sig: Tuple[int, ...]):
+        r = self._rows
+        for b in range(self._bands):
+            yield (b, sig[b * r:(b + 1) * r])
+
+    def _is_near_dup(self, sig: Tuple[int, ...], extra_lsh: Dict, extra_sigs: List[Tuple[int, ...]]) -> bool:
+        seen = set()
+        for bk in self._band_keys(sig):
+            for src, lsh, sigs in ((0, self._lsh, self._sigs), (1, extra_lsh, extra_sigs)):
+                for i in lsh.get(bk, ()):
+                    if (src, i) in seen:
+                        continue
+                    seen.add((src, i))
+                    if _estimate_jaccard(sig, sigs[i]) >= self.jaccard_threshold:
+                        return True
+        return False
+
     def pick_for_buffer(self, misses: List[str]) -> List[str]:
         out = []
+        batch_hashes: Set[str] = set()
+        batch_lsh: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+        batch_sigs: List[Tuple[int, ...]] = []
         for m in misses:
             if len(out) >= self.max_per_micro_batch:
                 break
             # nm = _norm(m)
             h = _hash(m)
-            if h in self.hset:
+            if h in self.hset or h in batch_hashes:
                 continue
+            sig = None
+            if self._near_dup:
+                sig = self._hasher.signature(m)
+                if self._is_near_dup(sig, batch_lsh, batch_sigs):
+                    self.near_dup_skipped += 1
+                    continue
+                for bk in self._band_keys(sig):
+                    batch_lsh.setdefault(bk, []).append(len(batch_sigs))
+                batch_sigs.append(sig)
+            batch_hashes.add(h)
+            self._picked_meta[m] = (h, sig)
             out.append(m)
         return out
 
     def add(self, picked: List[str]):
         for nm in picked:
-            h = _hash(nm)
-            if h not in self.hset:
-                self.hset.add(h)
-                self.samples.append(nm)
+            h, sig = self._picked_meta.pop(nm, (None, None))
+            if h is None:
+                h = _hash(nm)
+            if h in self.hset:
+                continue
+            if self._near_dup and sig is None:
+                sig = self._hasher.signature(nm)
+            self.hset.add(h)
+            self.samples.append(nm)
+            if sig is not None:
+                idx = len(self._sigs)
+                self._sigs.append(sig)
+                for bk in self._band_keys(sig):
+                    self._lsh.setdefault(bk, []).append(idx)
+        self._picked_meta.clear()
+
+    def discard(self, keys: Set[str]) -> int:
+        """从未锁定的缓冲中移除指定样本 (如新索引已能命中的), 同步重建 LSH; 返回移除条数。"""
+        if not keys:
+            return 0
+        keep = [i for i, s in enumerate(self.samples) if s not in keys]
+        removed = len(self.samples) - len(keep)
+        if not removed:
+            return 0
+        for s in self.samples:
+            if s in keys:
+                self.hset.discard(_hash(s))
+        if self._sigs:
+            self._sigs = [self._sigs[i] for i in keep]
+            self._lsh.clear()
+            for idx, sig in enumerate(self._sigs):
+                for bk in self._band_keys(sig):
+                    self._lsh.setdefault(bk, []).append(idx)
+        self.samples = [self.samples[i] for i in keep]
+        return removed
 
     def reached_threshold(self) -> bool:
         return (not self._locked) and len(self.samples) >= self.size_threshold
@@ -47,4 +175,7 @@ class DiversityBuffer:
     def clear_locked_batch(self):
         self.samples.clear()
         self.hset.clear()
+        self._sigs.clear()
+        self._lsh.clear()
+        self._picked_meta.clear()
         self._locked = False
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 from typing import List, Dict, Any, Optional
 import os, json, time, re
+import threading
+import contextlib
 
 from core.utils.config import load_yaml
+from core import llm_cache, regex_safety, validation
 from store import dao
 
 # ------------------------------ 通用小工具 ------------------------------
@@ -32,6 +35,185 @@ def _ensure_list_str(xs) -> List[str]:
     return [x for x in xs if isinstance(x, str) and x.strip()]
 
 
+_CJK_RE = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗估 token 数：中日韩字符按 1 字 1 token，其余按 4 字符 1 token。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _shard_samples(samples: List[str], max_tokens: int = 6000, max_items: int = 120) -> List[List[str]]:
+    """按估计 token 预算与条数上限顺序装箱，单条超预算的样本独占一个分片。"""
+    shards: List[List[str]] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for s in samples:
+        t = _sample_tokens(s)
+        if cur and (cur_tokens + t > max_tokens or len(cur) >= max_items):
+            shards.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(s)
+        cur_tokens += t
+    if cur:
+        shards.append(cur)
+    return shards
+
+
+def _sample_tokens(s: str) -> int:
+    """单条样本在草拟请求里的估计 token：按实际发送的 json.dumps 形式（非 ASCII 会被转义）计，另加分隔符。"""
+    return _estimate_tokens(json.dumps(s)) + 1
+
+
+def _structure_signature(s: str):
+    """结构签名：词数 + 前两个词（含数字/占位符的词记为 *），用于打包时轮转取样保证多样性。"""
+    words = s.split()
+    head = tuple("*" if re.search(r"\d|NUMNUM", w) else w for w in words[:2])
+    return (len(words), head)
+
+
+def _pack_samples_for_llm(samples: List[str], token_budget: int, max_items: int = 520):
+    """
+    按 token 预算打包样本：
+    - 去重后按结构签名分组，组内由短到长，组间按组大小降序轮转取样，先覆盖尽量多的结构
+    - 单条放不下就跳过继续尝试后面的，而不是一律丢弃长样本
+    返回 (packed, stats)，stats 含估计 token、预算与丢弃条数。
+    """
+    seen = set()
+    uniq: List[str] = []
+    for s in samples or []:
+        if s not in seen:
+            seen.add(s)
+            uniq.append(s)
+    groups: Dict[Any, List[str]] = {}
+    for s in uniq:
+        groups.setdefault(_structure_signature(s), []).append(s)
+    queues = sorted((sorted(g, key=len) for g in groups.values()), key=len, reverse=True)
+
+    packed: List[str] = []
+    used = 0
+    pos = [0] * len(queues)
+    active = list(range(len(queues)))
+    while active and len(packed) < max_items:
+        nxt = []
+        for qi in active:
+            if len(packed) >= max_items:
+                break
+            q = queues[qi]
+            # 当前组取下一条放得下的样本
+            while pos[qi] < len(q):
+                s = q[pos[qi]]
+                pos[qi] += 1
+                t = _sample_tokens(s)
+                if used + t <= token_budget:
+                    packed.append(s)
+                    used += t
+                    break
+            if pos[qi] < len(q):
+                nxt.append(qi)
+        active = nxt
+    stats = dict(estimated_tokens=used, budget=token_budget, kept=len(packed),
+                 dropped=len(uniq) - len(packed), structures=len(queues))
+    return packed, stats
+
+
+def _merge_drafts(draft_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """合并各分片草拟结果，按 pattern 去重并保持先到先得。"""
+    seen = set()
+    out: List[Dict[str, Any]] = []
+    for d_list in draft_lists:
+        if isinstance(d_list, dict):
+            d_list = [d_list]
+        for d in d_list or []:
+            if not isinstance(d, dict):
+                continue
+            pat = (d.get("pattern") or "").strip()
+            if not pat or pat in seen:
+                continue
+            seen.add(pat)
+            out.append(d)
+    return out
+
+
+class _TokenBucket:
+    """每分钟 token 限流（令牌桶）：容量为 tokens_per_minute，按秒匀速回填；<= 0 表示不限。"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute or 0)
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self, n: int) -> None:
+        if self.capacity <= 0:
+            return
+        import asyncio
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # 单个分片超过整桶容量时按整桶计，避免永远等不到
+        need = min(float(n), self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= need:
+                    self.tokens -= need
+                    return
+                await asyncio.sleep((need - self.tokens) / self.rate)
+
+
+def _draft_shards(llm, shards: List[List[str]], concurrency: int = 4, tokens_per_minute: int = 0,
+                  prompt_tokens: int = 0, trace=None, draft_fn=None) -> List[List[Dict[str, Any]]]:
+    """
+    并发草拟各分片：asyncio 信号量限制同时在途的调用数，令牌桶限制每分钟 token；
+    单个分片失败只丢弃该分片，结果按分片顺序返回。
+    draft_fn(llm, samples, trace) 默认为 _lc_draft，可传入带缓存的包装。
+    """
+    import asyncio
+    import threading
+
+    fn = draft_fn or _lc_draft
+
+    if trace:
+        # 多个分片在不同线程里写同一个 trace 文件，串行化写入
+        _trace_lock = threading.Lock()
+        _raw_trace = trace
+
+        def trace(event, payload):
+            with _trace_lock:
+                _raw_trace(event, payload)
+
+    async def _one(i: int, shard: List[str], sem, bucket) -> List[Dict[str, Any]]:
+        async with sem:
+            await bucket.acquire(prompt_tokens + sum(_sample_tokens(s) for s in shard))
+            try:
+                return await asyncio.to_thread(fn, llm, shard, trace)
+            except Exception as e:
+                print(f"Warning: draft shard {i} failed: {e}")
+                if trace:
+                    trace("draft.shard_error", {"shard": i, "size": len(shard), "error": str(e)})
+                return []
+
+    async def _all():
+        sem = asyncio.Semaphore(max(1, int(concurrency)))
+        bucket = _TokenBucket(tokens_per_minute)
+        return await asyncio.gather(*(_one(i, s, sem, bucket) for i, s in enumerate(shards)))
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_all())
+    # 调用方已处于事件循环中时，放到独立线程跑一个新循环
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, _all()).result()
+
+
 def _default_agents_cfg_path() -> str:
     return os.environ.get("LOG_ANALYZER_AGENTS_PATH", "configs/agents.yaml")
 
@@ -121,8 +303,9 @@ def _resolve_model_field(model_cfg: Dict[str, Any], field: str, secrets: Dict[st
     return default
 
 
-def _build_langchain_llm(model_cfg: Dict[str, Any], secrets: Dict[str, Any]):
+def _build_langchain_llm(model_cfg: Dict[str, Any], secrets: Dict[str, Any], http_client=None):
     # 支持私有云 OpenAI 兼容网关；读取顺序：agents.yaml -> secrets.yaml -> env -> 默认
+    # http_client: 可选的共享 httpx.Client，多个客户端复用同一个长连接池
     prov = (model_cfg or {}).get("provider", "").lower()
     if prov == "openai":
         from langchain_openai import ChatOpenAI
@@ -179,6 +362,8 @@ def _build_langchain_llm(model_cfg: Dict[str, Any], secrets: Dict[str, Any]):
             kwargs["api_key"] = api_key
         else:
             kwargs["default_headers"] = default_headers
+        if http_client is not None:
+            kwargs["http_client"] = http_client
 
         return ChatOpenAI(**kwargs)
 
@@ -332,6 +517,55 @@ def _lc_cluster(llm, samples: List[str], trace=None) -> List[List[str]]:
     return clusters
 
 
+class _TokenUsage:
+    """累计草拟调用的估计输入 token 与网关返回的实际 token，供调优 _estimate_tokens 与打包预算。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.calls_with_usage = 0
+        self.estimated_input = 0
+        self.actual_input = 0
+        self.actual_output = 0
+        # 仅统计有实际用量的调用的估计值，比值才有意义
+        self._estimated_matched = 0
+
+    def record(self, estimated_input: int, actual_input: Optional[int], actual_output: Optional[int]) -> None:
+        with self._lock:
+            self.calls += 1
+            self.estimated_input += int(estimated_input or 0)
+            if actual_input is not None:
+                self.calls_with_usage += 1
+                self._estimated_matched += int(estimated_input or 0)
+                self.actual_input += int(actual_input)
+                self.actual_output += int(actual_output or 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ratio = (self.actual_input / self._estimated_matched) if self._estimated_matched else None
+            return dict(calls=self.calls, calls_with_usage=self.calls_with_usage,
+                        estimated_input=self.estimated_input, actual_input=self.actual_input,
+                        actual_output=self.actual_output, actual_over_estimated=ratio)
+
+
+TOKEN_USAGE = _TokenUsage()
+
+
+def _usage_from_message(msg: Any):
+    """从 AIMessage 读取 (输入 token, 输出 token)；网关未返回用量时为 (None, None)。"""
+    um = getattr(msg, "usage_metadata", None) or {}
+    if um.get("input_tokens") is not None:
+        return int(um.get("input_tokens")), int(um.get("output_tokens") or 0)
+    tu = (getattr(msg, "response_metadata", None) or {}).get("token_usage") or {}
+    if tu.get("prompt_tokens") is not None:
+        return int(tu.get("prompt_tokens")), int(tu.get("completion_tokens") or 0)
+    return None, None
+
+
+# 草拟提示词版本，参与 LLM 缓存键；修改 _lc_draft 的提示词或示例时需要递增
+DRAFT_PROMPT_VERSION = "draft-v1"
+
+
 def _lc_draft(llm, cluster_samples: List[str], trace=None) -> List[Dict[str, Any]]:
     """草拟正则：
     - 输入一簇样本，期望输出“多个”候选规则
@@ -340,7 +574,6 @@ def _lc_draft(llm, cluster_samples: List[str], trace=None) -> List[Dict[str, Any
     """
     from langchain_core.prompts import ChatPromptTemplate
     from langchain_core.output_parsers import JsonOutputParser
-    from langchain_core.runnables import RunnableLambda
 
     system_text = (
             "你是一个自动驾驶系统问题分析专家，负责对报错/日志进行语义归类并抽取正则模板。\n"
@@ -422,11 +655,18 @@ def _lc_draft(llm, cluster_samples: List[str], trace=None) -> List[Dict[str, Any
         trace("draft.prompt", {"messages": [dict(type=m.type, content=m.content) for m in msgs]})
 
     # chain = prompt | llm | JsonOutputParser()
-    
-    chain = prompt | llm | RunnableLambda(_parse_json_after_think)
-      
+    # 不在链尾直接解析，保留 AIMessage 以便读取 usage_metadata，对比估计与实际 token
+    chain = prompt | llm
+
     jsonstr=json.dumps(cluster_samples)
-    out = chain.invoke({"samples":  jsonstr})
+    est_in = sum(_estimate_tokens(m.content) for m in prompt.format_messages(samples=jsonstr))
+    msg = chain.invoke({"samples":  jsonstr})
+    actual_in, actual_out = _usage_from_message(msg)
+    TOKEN_USAGE.record(est_in, actual_in, actual_out)
+    if trace:
+        trace("draft.tokens", {"samples_cnt": len(cluster_samples), "estimated_input": est_in,
+                               "actual_input": actual_in, "actual_output": actual_out})
+    out = _parse_json_after_think(msg)
 
     # 检查解析结果是否为空，如果为空则跳过处理
     if not out or (isinstance(out, list) and len(out) == 0):
@@ -457,6 +697,37 @@ def _lc_draft(llm, cluster_samples: List[str], trace=None) -> List[Dict[str, Any
     return results
 
 
+def _cached_draft(llm, cluster_samples: List[str], trace=None, cache=None, model_id: str = "") -> List[Dict[str, Any]]:
+    """
+    带内容寻址缓存的草拟：命中直接返回；replay 模式未命中返回空结果且不访问网络；
+    只缓存非空结果，解析失败的空结果下次仍会重试。
+    """
+    if cache is None or cache.mode == "off":
+        return _lc_draft(llm, cluster_samples, trace=trace)
+    key = llm_cache.make_key(model_id, DRAFT_PROMPT_VERSION, cluster_samples)
+    cached = cache.get(key)
+    if cached is not None:
+        if trace:
+            trace("draft.cache_hit", {"key": key, "samples_cnt": len(cluster_samples), "results": cached})
+        return cached
+    if cache.replay:
+        if trace:
+            trace("draft.cache_miss_replay", {"key": key, "samples_cnt": len(cluster_samples)})
+        return []
+    results = _lc_draft(llm, cluster_samples, trace=trace)
+    if results:
+        cache.put(key, results, model=model_id, prompt_version=DRAFT_PROMPT_VERSION,
+                  sample_count=len(cluster_samples))
+    return results
+
+
+def _draft_model_id(model_cfg: Dict[str, Any], secrets: Dict[str, Any]) -> str:
+    """缓存键里的模型标识：provider:model_name:temperature。"""
+    model_cfg = model_cfg or {}
+    model_name = _resolve_model_field(model_cfg, "model_name", secrets, env_keys=["LLM_MODEL"], default="gpt-4o-mini")
+    return f"{model_cfg.get('provider', '')}:{model_name}:{model_cfg.get('temperature', 0.0)}"
+
+
 def _lc_adversary(pattern: str, historical_negatives: List[str], trace=None) -> bool:
     cre = re.compile(pattern) if pattern else None
     if not cre:
@@ -484,6 +755,73 @@ def _lc_regression(pattern: str, history_matched: List[str], trace=None) -> bool
     return passed
 
 
+def _validate_drafts(drafts: List[Dict[str, Any]], targets: List[str], orch: Dict[str, Any], trace=None,
+                     session: Optional["CommitteeSession"] = None) -> List[Dict[str, Any]]:
+    """
+    按 orchestration.validation 配置校验草拟结果，返回通过的候选；关闭时原样返回。
+    有会话时借用会话内复用的校验引擎（及其进程池），否则本轮临时建一个、用完关闭。
+    """
+    vcfg = orch.get("validation") or {}
+    if not drafts or not vcfg.get("enabled", True):
+        return drafts
+    t0 = time.perf_counter()
+    negatives, recent, history = validation.load_corpora(
+        unmatched_limit=orch.get("adversary_unmatched_limit", 20000),
+        files_lookback=orch.get("regression_files_lookback", 10),
+        recent_max_keys=vcfg.get("recent_max_keys", 200000),
+        history_limit=vcfg.get("history_limit", 20000),
+        ttl_s=vcfg.get("corpus_ttl_s", 300),
+    )
+    params = dict(
+        workers=vcfg.get("workers", 0),
+        parallel_min_work=vcfg.get("parallel_min_work", 2_000_000),
+        max_fp_rate=vcfg.get("max_fp_rate", 0.01),
+        max_recent_key_share=vcfg.get("max_recent_key_share", 0.3),
+        min_general_keys=vcfg.get("min_general_keys", 20),
+        max_overlap_rate=vcfg.get("max_overlap_rate", 0.2),
+        min_target_coverage=vcfg.get("min_target_coverage", 0.0),
+    )
+    if session is not None:
+        with session.validation_engine((negatives, recent, history), **params) as engine:
+            reports = engine.validate(drafts, targets=targets)
+    else:
+        engine = validation.ValidationEngine(negatives, recent, history, **params)
+        try:
+            reports = engine.validate(drafts, targets=targets)
+        finally:
+            engine.close()
+    passed = [d for d, r in zip(drafts, reports) if r.passed]
+    if trace:
+        trace("validation.result", {
+            "corpora": {"negatives": len(negatives), "recent": len(recent), "recent_weight": recent.total_weight,
+                        "history": len(history)},
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+            "reports": [r._asdict() for r in reports],
+        })
+    return passed
+
+
+def _safety_gate(drafts: List[Dict[str, Any]], orch: Dict[str, Any], trace=None) -> List[Dict[str, Any]]:
+    """按 orchestration.safety_gate 对本轮候选并行做正则安全检测; 不安全的改写或拒绝。"""
+    scfg = orch.get("safety_gate") or {}
+    if not drafts or not scfg.get("enabled", True):
+        return drafts
+    t0 = time.perf_counter()
+    accepted, rejected = regex_safety.screen_candidates(
+        drafts,
+        timeout_sec=scfg.get("timeout_sec", 0.1),
+        workers=scfg.get("workers", 0),
+        ban_warning=bool(scfg.get("ban_warning", False)),
+    )
+    if trace:
+        trace("safety_gate.result", {
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+            "rewritten": [{"from": d["safety_rewrite"], "to": d["pattern"]} for d in accepted if "safety_rewrite" in d],
+            "rejected": rejected,
+        })
+    return accepted
+
+
 def _lc_arbitrate(drafts: List[Dict[str, Any]], trace=None) -> List[Dict[str, Any]]:
     if trace:
         trace("arbiter.result", {"kept": drafts})
@@ -501,7 +839,8 @@ def _build_llms_for_agents(agents_cfg: Dict[str, Any], secrets: Dict[str, Any]):
     }
 
 
-def _run_langchain(samples: List[str], cfg: Dict[str, Any], secrets: Dict[str, Any], run_context: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _run_langchain(samples: List[str], cfg: Dict[str, Any], secrets: Dict[str, Any], run_context: Optional[Dict[str, Any]] = None,
+                   session: Optional["CommitteeSession"] = None) -> List[Dict[str, Any]]:
     samples = _ensure_list_str(samples)
     if not samples:
         return []
@@ -509,14 +848,37 @@ def _run_langchain(samples: List[str], cfg: Dict[str, Any], secrets: Dict[str, A
     max_templates = orch.get("max_templates", 20)
     max_chars = orch.get("max_chars_per_call", 32000)
     max_items = orch.get("max_items_per_call", 120)
-    samples = _truncate_samples_for_llm(samples, max_chars=max_chars, max_items=max_items)
+    prompt_tokens = int(orch.get("draft_prompt_tokens", 2000))
+    shard_tokens = int(orch.get("shard_max_tokens", 6000))
+    context_tokens = int(orch.get("context_tokens", 0) or 0)
+    pack_stats = None
+    if context_tokens > 0:
+        # 按 token 预算打包：单次调用扣除提示词与预期输出后的余量即分片上限，一轮并发调用的总量为打包预算
+        per_call = max(1, context_tokens - prompt_tokens - int(orch.get("max_output_tokens", 4000)))
+        shard_tokens = min(shard_tokens, per_call)
+        budget = shard_tokens * max(1, int(orch.get("draft_concurrency", 4)))
+        samples, pack_stats = _pack_samples_for_llm(samples, budget, max_items=max_items)
+    else:
+        samples = _truncate_samples_for_llm(samples, max_chars=max_chars, max_items=max_items)
 
     trace_enabled, trace_write, trace_path = _trace_prep(orch, run_context)
     if trace_enabled:
-        trace_write("init", {"samples_cnt": len(samples), "max_templates": max_templates})
+        trace_write("init", {"samples_cnt": len(samples), "max_templates": max_templates, "pack": pack_stats})
 
     agents = cfg.get("agents", {})
-    llms = _build_llms_for_agents(agents, secrets)
+    cache = session.cache(orch) if session is not None else llm_cache.from_config(orch)
+    # 当前流程只用到 drafter，只构建它；严格回放模式不构建任何 LLM 客户端，保证全程离线
+    if cache.replay:
+        drafter_lease = contextlib.nullcontext(None)
+    elif session is not None:
+        # 租用期间持有共享连接池的引用，配置重载不会关掉本轮仍在用的连接
+        drafter_lease = session.lease("drafter")
+    else:
+        drafter_lease = contextlib.nullcontext(_build_langchain_llm(agents.get("drafter", {}).get("model", {}), secrets))
+    model_id = _draft_model_id(agents.get("drafter", {}).get("model", {}), secrets)
+
+    def draft_fn(llm, shard, trace=None):
+        return _cached_draft(llm, shard, trace=trace, cache=cache, model_id=model_id)
 
     # 1) 聚类
     # clusters = _lc_cluster(llms["clusterer"], samples, trace=trace_write if trace_enabled else None)
@@ -531,46 +893,55 @@ def _run_langchain(samples: List[str], cfg: Dict[str, Any], secrets: Dict[str, A
     #     for d in d_list:
     #         if isinstance(d, dict) and d.get("pattern"):
     #             drafts.append(d)
-    drafts: List[Dict[str, Any]] = []
-    d_list = _lc_draft(llms["drafter"], samples, trace=trace_write if trace_enabled else None)
-    # 兼容老逻辑：若返回单 dict 则包装为 list
-    if isinstance(d_list, dict):
-        d_list = [d_list]
-    for d in d_list:
-        if isinstance(d, dict) and d.get("pattern"):
-            drafts.append(d)
-
-    # 3) 历史负样本与已有样本集
-    negatives = dao.get_recent_unmatched(limit=orch.get("adversary_unmatched_limit", 100))
-    matched_hist = dao.get_template_samples(limit=100)
+    # 2) 按 token 预算分片并发草拟，合并后按 pattern 去重
+    shards = _shard_samples(
+        samples,
+        max_tokens=shard_tokens,
+        max_items=orch.get("shard_max_items", max_items),
+    )
     if trace_enabled:
-        trace_write("hist.loaded", {"negatives": len(negatives), "matched_hist": len(matched_hist)})
-
-    # 4) 对抗与回归
-    passed = []
-    for d in drafts:
-        # pat = d.get("pattern")
-        # if not pat:
-        #     continue
-        # ok_adv = _lc_adversary(pat, negatives, trace=trace_write if trace_enabled else None)
-        # if not ok_adv:
-        #     continue
-        # ok_reg = _lc_regression(pat, matched_hist, trace=trace_write if trace_enabled else None)
-        # if not ok_reg:
-        #     continue
-        passed.append(d)
+        trace_write("draft.shards", {"shards": [len(s) for s in shards]})
+    with drafter_lease as drafter:
+        if len(shards) <= 1:
+            d_lists = [draft_fn(drafter, samples, trace=trace_write if trace_enabled else None)]
+        else:
+            d_lists = _draft_shards(
+                drafter, shards,
+                concurrency=orch.get("draft_concurrency", 4),
+                tokens_per_minute=orch.get("tokens_per_minute", 0),
+                prompt_tokens=prompt_tokens,
+                trace=trace_write if trace_enabled else None,
+                draft_fn=draft_fn,
+            )
+    drafts: List[Dict[str, Any]] = _merge_drafts(d_lists)
+    if trace_enabled and cache.mode != "off":
+        trace_write("draft.cache_stats", {"mode": cache.mode, "hits": cache.hits, "misses": cache.misses})
+
+    # 3) + 4) 对抗与回归：批量校验引擎一次编译全部候选，对历史负样本、近期文件 uniq 关键文本（按次数加权）
+    #    与已有模板样本做并行检查
+    passed = _validate_drafts(drafts, samples, orch, trace=trace_write if trace_enabled else None, session=session)
+    # 正则安全准入: 灾难回溯风险的模式改写或拒绝, 不让它进入 CompiledIndex
+    passed = _safety_gate(passed, orch, trace=trace_write if trace_enabled else None)
 
     # 5) 仲裁输出最终候选
     finals = _lc_arbitrate(passed, trace=trace_write if trace_enabled else None)
     if trace_enabled:
         trace_write("final", {"kept": finals})
-    # 入库时仅关心必要字段，多余字段不影响
-    return [ _mk_candidate(x.get("pattern",""), x.get("sample_log",""), x.get("semantic_info",""), x.get("advise",""), "langchain") for x in finals ]
+    # 入库时仅关心必要字段，多余字段不影响；安全准入的标记随候选带给 DAO，避免写库时重复检测
+    return [
+        dict(
+            _mk_candidate(x.get("pattern",""), x.get("sample_log",""), x.get("semantic_info",""), x.get("advise",""),
+                          x.get("source") if x.get("source") == "safety_literal" else "langchain"),
+            safety_screened=bool(x.get("safety_screened")),
+        )
+        for x in finals
+    ]
 
 
-def _run_langgraph(samples: List[str], cfg: Dict[str, Any], secrets: Dict[str, Any], run_context: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _run_langgraph(samples: List[str], cfg: Dict[str, Any], secrets: Dict[str, Any], run_context: Optional[Dict[str, Any]] = None,
+                   session: Optional["CommitteeSession"] = None) -> List[Dict[str, Any]]:
     """为保持简单与一致性，这里直接复用上面的逻辑（不是用图编辑器），从而也能完整记录“会话内容”。"""
-    return _run_langchain(samples, cfg, secrets, run_context)
+    return _run_langchain(samples, cfg, secrets, run_context, session=session)
 
 
 def _run_stub(samples: List[str], cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -586,6 +957,227 @@ def _run_stub(samples: List[str], cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
     return outs
 
 
+class _WatchedYaml:
+    """按 mtime 缓存的 YAML 文件：文件未变化时直接返回上次解析结果。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime: Optional[float] = None
+        self.data: Dict[str, Any] = {}
+        self._loaded = False
+
+    def refresh(self) -> bool:
+        """重新检查 mtime，有变化（含首次加载、文件出现/消失）时重新解析并返回 True。"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if self._loaded and mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        self.data = (load_yaml(self.path) or {}) if mtime is not None else {}
+        self._loaded = True
+        return True
+
+
+class _PooledHttpClient:
+    """共享 httpx.Client（或校验引擎）的引用计数包装：退役后等最后一个在途轮次归还才真正关闭。"""
+
+    def __init__(self, client):
+        self.client = client
+        self.refs = 0
+        self.retired = False
+
+    def close_if_idle(self) -> None:
+        if self.retired and self.refs == 0 and self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+            self.client = None
+
+
+class CommitteeSession:
+    """
+    长生命周期的委员会会话：
+    - 缓存 application.yaml / secrets.yaml / agents.yaml 的解析结果，仅在文件 mtime 变化时重载
+    - 各智能体的 LLM 客户端按需懒构建，共享一个 keep-alive 的 httpx 连接池，避免每轮重复握手
+    - 配置变化时丢弃已建客户端，新轮次按新配置重建客户端与连接池；旧连接池由在途轮次引用计数，
+      全部归还后才关闭 (见 lease)
+    - 批量校验引擎及其进程池在语料与参数不变时跨轮次复用，close 时关闭 (见 validation_engine)
+    线程安全：P1 异步模式下多个轮次可并发调用 run。
+    """
+
+    def __init__(self, config_path: Optional[str] = None, app_config_path: str = "configs/application.yaml"):
+        self._lock = threading.RLock()
+        self._config_path = config_path
+        self._app = _WatchedYaml(app_config_path)
+        self._secrets: Optional[_WatchedYaml] = None
+        self._agents: Optional[_WatchedYaml] = None
+        self._llms: Dict[str, Any] = {}
+        self._llm_pools: Dict[str, Optional[_PooledHttpClient]] = {}
+        self._pool: Optional[_PooledHttpClient] = None
+        self._caches: Dict[Any, llm_cache.LLMCache] = {}
+        self._engine: Optional[_PooledHttpClient] = None
+        self._engine_key = None
+        self.reloads = 0
+
+    def _agents_path(self, app_cfg: Dict[str, Any]) -> str:
+        return (self._config_path or os.environ.get("LOG_ANALYZER_AGENTS_PATH")
+                or (((app_cfg.get("first_pass") or {}).get("committee") or {}).get("config_path"))
+                or "configs/agents.yaml")
+
+    def _refresh_locked(self) -> None:
+        changed = self._app.refresh()
+        app_cfg = self._app.data
+        sp = (((app_cfg.get("first_pass") or {}).get("committee") or {}).get("secrets_path")) or _default_secrets_path()
+        if self._secrets is None or self._secrets.path != sp:
+            self._secrets = _WatchedYaml(sp)
+        changed = self._secrets.refresh() or changed
+        ap = self._agents_path(app_cfg)
+        if self._agents is None or self._agents.path != ap:
+            self._agents = _WatchedYaml(ap)
+        changed = self._agents.refresh() or changed
+        if changed:
+            self.reloads += 1
+            self._drop_clients_locked()
+
+    def configs(self):
+        """返回 (committee 配置, secrets)，必要时按 mtime 重载。"""
+        with self._lock:
+            self._refresh_locked()
+            all_cfg = self._agents.data
+            return all_cfg.get("committee", all_cfg), self._secrets.data
+
+    def _pool_client_locked(self, orch: Dict[str, Any]) -> Optional[_PooledHttpClient]:
+        if self._pool is None:
+            try:
+                import httpx
+            except Exception:
+                return None
+            pool = orch.get("http_pool") or {}
+            self._pool = _PooledHttpClient(httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=int(pool.get("max_connections", 16)),
+                    max_keepalive_connections=int(pool.get("max_keepalive", 8)),
+                    keepalive_expiry=float(pool.get("keepalive_expiry_s", 60)),
+                ),
+                # 单次请求的超时仍由各客户端的 timeout_s 控制
+                timeout=None,
+            ))
+        return self._pool
+
+    def llm(self, agent: str):
+        """懒构建指定智能体的 LLM 客户端，配置不变时跨轮次复用。"""
+        with self._lock:
+            self._refresh_locked()
+            return self._llm_locked(agent)
+
+    def _llm_locked(self, agent: str):
+        client = self._llms.get(agent)
+        if client is None:
+            all_cfg = self._agents.data
+            cfg = all_cfg.get("committee", all_cfg)
+            model_cfg = ((cfg.get("agents") or {}).get(agent) or {}).get("model", {})
+            pool = self._pool_client_locked(cfg.get("orchestration") or {})
+            client = _build_langchain_llm(model_cfg, self._secrets.data,
+                                          http_client=pool.client if pool is not None else None)
+            self._llms[agent] = client
+            self._llm_pools[agent] = pool
+        return client
+
+    @contextlib.contextmanager
+    def lease(self, agent: str):
+        """
+        借出智能体的 LLM 客户端供一轮调用使用，期间持有其连接池的引用；
+        轮次进行中即便配置重载，旧连接池也要等归还后才关闭，不会打断在途请求。
+        """
+        with self._lock:
+            self._refresh_locked()
+            client = self._llm_locked(agent)
+            pool = self._llm_pools.get(agent)
+            if pool is not None:
+                pool.refs += 1
+        try:
+            yield client
+        finally:
+            if pool is not None:
+                with self._lock:
+                    pool.refs -= 1
+                    pool.close_if_idle()
+
+    @contextlib.contextmanager
+    def validation_engine(self, corpora, **params):
+        """
+        借出批量校验引擎供一轮校验使用；语料（load_corpora 的缓存对象）与参数不变时复用同一引擎及其进程池。
+        语料缓存刷新或参数变化时退役旧引擎，等在途轮次归还后关闭。
+        """
+        key = (tuple(corpora), tuple(sorted(params.items())))
+        with self._lock:
+            eng = self._engine
+            if eng is None or self._engine_key != key:
+                if eng is not None:
+                    eng.retired = True
+                    eng.close_if_idle()
+                eng = self._engine = _PooledHttpClient(validation.ValidationEngine(*corpora, **params))
+                self._engine_key = key
+            eng.refs += 1
+        try:
+            yield eng.client
+        finally:
+            with self._lock:
+                eng.refs -= 1
+                eng.close_if_idle()
+
+    def cache(self, orch: Dict[str, Any]) -> llm_cache.LLMCache:
+        mode, path = llm_cache.resolve(orch)
+        with self._lock:
+            c = self._caches.get((mode, path))
+            if c is None:
+                c = llm_cache.LLMCache(path=path, mode=mode)
+                self._caches[(mode, path)] = c
+            return c
+
+    def _drop_clients_locked(self) -> None:
+        # 只退役旧连接池：无在途轮次时立即关闭，否则由最后一个 lease 归还时关闭
+        self._llms.clear()
+        self._llm_pools.clear()
+        if self._pool is not None:
+            self._pool.retired = True
+            self._pool.close_if_idle()
+            self._pool = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._drop_clients_locked()
+            self._caches.clear()
+            if self._engine is not None:
+                self._engine.retired = True
+                self._engine.close_if_idle()
+                self._engine = self._engine_key = None
+
+
+_SESSIONS: Dict[Optional[str], CommitteeSession] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(config_path: Optional[str] = None) -> CommitteeSession:
+    """按 agents 配置路径复用进程内的委员会会话。"""
+    with _SESSIONS_LOCK:
+        sess = _SESSIONS.get(config_path)
+        if sess is None:
+            sess = CommitteeSession(config_path=config_path)
+            _SESSIONS[config_path] = sess
+        return sess
+
+
+def close_sessions() -> None:
+    with _SESSIONS_LOCK:
+        for sess in _SESSIONS.values():
+            sess.close()
+        _SESSIONS.clear()
+
+
 def run(samples: List[str], model: str = "stub", phase: str = "v1点0", config_path: str = None, run_context: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
     增强点：
@@ -593,16 +1185,14 @@ def run(samples: List[str], model: str = "stub", phase: str = "v1点0", config_p
     - 每个智能体可用不同模型
     - 安全裁剪样本长度，避免 400 错误
     - 草拟阶段改为“一簇多候选”输出，兼容老逻辑
+    - 配置与 LLM 客户端经由进程内 CommitteeSession 复用，只在配置文件变化时重载
     """
-    app_cfg = _read_application_yaml()
-    secrets = _load_secrets(app_cfg)
-    cfg_path = config_path or os.environ.get("LOG_ANALYZER_AGENTS_PATH") or (((app_cfg.get("first_pass") or {}).get("committee") or {}).get("config_path")) or "configs/agents.yaml"
-    all_cfg = load_yaml(cfg_path) or {}
-    cfg = all_cfg.get("committee", all_cfg)  # 兼容直接放根上的写法
+    session = get_session(config_path)
+    cfg, secrets = session.configs()
     backend = (cfg.get("backend") or model or "stub").lower()
     if backend == "langgraph":
-        return _run_langgraph(samples, cfg, secrets, run_context)
+        return _run_langgraph(samples, cfg, secrets, run_context, session=session)
     elif backend == "langchain":
-        return _run_langchain(samples, cfg, secrets, run_context)
+        return _run_langchain(samples, cfg, secrets, run_context, session=session)
     else:
         return _run_stub(samples, cfg)
@@ -7,11 +7,19 @@ class Indexer:
     def __init__(self):
         self._lock = threading.RLock()
         self._active = None  # type: ignore
+        self._slow_recorder = None
     numeric_pattern = r'[-+]?(?:\d+\.\d*|\.\d+|\d+)'
     def load_initial(self,nomal=True):
         items = [{"template_id": r["template_id"], "pattern_nomal": r["pattern_nomal"], "pattern": r["pattern"]} for r in dao.fetch_all_templates(True)]
         with self._lock:
-            self._active = CompiledIndex(items,nomal=nomal)
+            self._active = CompiledIndex(items,nomal=nomal, slow_recorder=self._slow_recorder)
+
+    def set_slow_recorder(self, recorder):
+        """设置慢匹配采集器; 之后重建的索引沿用同一个采集器。"""
+        with self._lock:
+            self._slow_recorder = recorder
+            if self._active is not None:
+                self._active.slow_recorder = recorder
 
     def get_active(self) -> CompiledIndex:
         with self._lock:
@@ -20,7 +28,7 @@ class Indexer:
     def build_new_index_async(self):
         def _worker():
             items = [{"template_id": r["template_id"], "pattern_nomal": r["pattern_nomal"], "pattern": r["pattern"]} for r in dao.fetch_all_templates(True)]
-            new_idx = CompiledIndex(items)
+            new_idx = CompiledIndex(items, slow_recorder=self._slow_recorder)
             self.atomic_switch(new_idx)
         t = threading.Thread(target=_worker, daemon=True)
         t.start()
@@ -28,7 +36,7 @@ class Indexer:
     # 新增: 同步重建索引, 供同步版 P1 在写入新模板后立即生效
     def build_new_index_sync(self):
         items = [{"template_id": r["template_id"], "pattern_nomal": r["pattern_nomal"], "pattern": r["pattern"]} for r in dao.fetch_all_templates(True)]
-        new_idx = CompiledIndex(items)
+        new_idx = CompiledIndex(items, slow_recorder=self._slow_recorder)
         self.atomic_switch(new_idx)
 
     def atomic_switch(self, new_handle: CompiledIndex):
@@ -59,3 +59,21 @@ def dedup_and_count(key_iter: Iterable[str]) -> Tuple[List[str], Dict[str, int]]
         cnt[k] = cnt.get(k, 0) + 1
     uniq_list = sorted(cnt.keys())
     return uniq_list, cnt
+
+
+_TSV_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+_TSV_UNESCAPES = {v: k for k, v in _TSV_ESCAPES.items()}
+_TSV_ESCAPED = re.compile(r"\\[\\tnr]")
+
+
+def encode_tsv_key(s: str) -> str:
+    """
+    原始关键文本写入 TSV 列时做可逆转义 (\\ \t \n \r), 读回后与 P1 匹配/归属用的文本逐字节一致;
+    不能用 _safe_field 那种把制表符换成空格的有损写法, 否则 TSV 路径下 P2 的关键文本与 P1 对不上
+    """
+    return "".join(_TSV_ESCAPES.get(ch, ch) for ch in s or "")
+
+
+def decode_tsv_key(s: str) -> str:
+    """encode_tsv_key 的逆操作"""
+    return _TSV_ESCAPED.sub(lambda m: _TSV_UNESCAPES[m.group(0)], s or "")
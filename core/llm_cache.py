@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 草拟结果的内容寻址缓存（本地 SQLite）
+- 键: sha256(模型标识 | 提示词版本 | 归一化并排序去重后的样本列表)
+- 模式:
+    off        不读不写
+    readwrite  命中直接返回, 未命中调用 LLM 后写入（默认）
+    replay     严格离线回放: 只读缓存, 未命中返回空结果, 从不访问网络
+- 环境变量 LOG_ANALYZER_LLM_CACHE_MODE / LOG_ANALYZER_LLM_CACHE 可覆盖配置中的模式与路径,
+  便于测试与基准在无网络环境下跑委员会路径
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+MODES = ("off", "readwrite", "replay")
+DEFAULT_PATH = "./data/llm_cache.sqlite3"
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cache_key     TEXT PRIMARY KEY,
+    model         TEXT,
+    prompt_version TEXT,
+    sample_count  INTEGER,
+    response      TEXT,
+    created_at    TEXT,
+    hit_count     INTEGER DEFAULT 0,
+    last_hit_at   TEXT
+) WITHOUT ROWID
+"""
+
+
+def _norm_sample(s: str) -> str:
+    return re.sub(r"\s+", " ", s or "").strip()
+
+
+def make_key(model: str, prompt_version: str, samples: List[str]) -> str:
+    """样本先归一空白再排序去重, 同一批样本换个顺序也命中同一条缓存。"""
+    norm = sorted({_norm_sample(s) for s in samples if s and s.strip()})
+    payload = json.dumps([model or "", prompt_version or "", norm], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = DEFAULT_PATH, mode: str = "readwrite"):
+        mode = (mode or "readwrite").lower()
+        if mode not in MODES:
+            raise ValueError(f"未知的 LLM 缓存模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if mode != "off":
+            parent = os.path.dirname(os.path.abspath(path))
+            if parent and not os.path.exists(parent):
+                os.makedirs(parent, exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                conn.execute(_DDL)
+
+    @property
+    def replay(self) -> bool:
+        return self.mode == "replay"
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 连接的 with 只管事务不会关闭连接, 调用方需配合 closing 使用
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str) -> Optional[Any]:
+        if self.mode == "off":
+            return None
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT response FROM llm_cache WHERE cache_key=?", (key,)).fetchone()
+            if row is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE llm_cache SET hit_count=hit_count+1, last_hit_at=? WHERE cache_key=?",
+                (datetime.utcnow().isoformat(), key),
+            )
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any, model: str = "", prompt_version: str = "", sample_count: int = 0) -> None:
+        if self.mode != "readwrite":
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO llm_cache(cache_key, model, prompt_version, sample_count, response, created_at)
+                VALUES(?,?,?,?,?,?)
+                ON CONFLICT(cache_key) DO UPDATE SET response=excluded.response, created_at=excluded.created_at
+                """,
+                (key, model, prompt_version, int(sample_count),
+                 json.dumps(value, ensure_ascii=False), datetime.utcnow().isoformat()),
+            )
+
+
+def resolve(orch_cfg: Dict[str, Any]):
+    """读取 agents.yaml committee.orchestration.llm_cache, 环境变量优先; 返回 (mode, path)。"""
+    c = (orch_cfg or {}).get("llm_cache") or {}
+    mode = os.environ.get("LOG_ANALYZER_LLM_CACHE_MODE") or c.get("mode", "readwrite")
+    path = os.environ.get("LOG_ANALYZER_LLM_CACHE") or c.get("path", DEFAULT_PATH)
+    return (mode or "readwrite").lower(), path
+
+
+def from_config(orch_cfg: Dict[str, Any]) -> LLMCache:
+    mode, path = resolve(orch_cfg)
+    return LLMCache(path=path, mode=mode)
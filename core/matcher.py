@@ -5,6 +5,7 @@ import threading
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+from time import perf_counter
 from typing import List, NamedTuple, Optional, Any, Dict, Tuple
 import logging
 from core.utils.logger import get_logger 
@@ -28,10 +29,12 @@ class MatchResult(NamedTuple):
 
 
 class CompiledIndex:
-    def __init__(self, items: List[dict], nomal: bool = True, cache_size: int = 20000):
+    def __init__(self, items: List[dict], nomal: bool = True, cache_size: int = 20000, slow_recorder=None):
         self.items: List[Tuple[int, str, re.Pattern]] = []
         self.literal_bins: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
         self.fallback_indices: List[int] = []
+        # 成功编译进索引的模板 ID，供全局关键文本字典校验归属模板是否仍然有效
+        self.template_ids = set()
         pattern_key = "pattern_nomal" if nomal else "pattern"
         for it in items:
             raw = it.get(pattern_key)
@@ -70,12 +73,17 @@ class CompiledIndex:
 
             idx = len(self.items)
             self.items.append((it["template_id"], pattern_key, compiled_pattern))
+            self.template_ids.add(it["template_id"])
             literal_hint = self._extract_literal_hint(raw)
             if literal_hint:
                 self.literal_bins[literal_hint[0]].append((literal_hint, idx))
             else:
                 self.fallback_indices.append(idx)
 
+        # 慢匹配采集 (core.slowlog.SlowMatchRecorder), 为 None 时走不计时的原路径
+        self.slow_recorder = slow_recorder
+        self._timed_n = 0
+        self._timed_lock = threading.Lock()  # 计数在匹配线程池里并发递增
         self._match_one_cached = lru_cache(maxsize=cache_size)(self._match_one_uncached)
 
     @staticmethod
@@ -129,11 +137,31 @@ class CompiledIndex:
             yield self.items[idx]
 
     def _match_one_uncached(self, text: str) -> Optional[int]:
+        rec = self.slow_recorder
+        if rec is not None:
+            with self._timed_lock:
+                self._timed_n += 1
+                timed = self._timed_n % rec.sample_every == 0
+            if timed:
+                return self._match_one_timed(text, rec)
         for tid, _, creg in self._iter_candidates(text):
             if creg.search(text):
                 return tid
         return None
 
+    def _match_one_timed(self, text: str, rec) -> Optional[int]:
+        """逐个候选计时, 超过阈值的 search 交给采集器 (采集器只在内存中抽样缓冲, 不在此处写库)。"""
+        threshold = rec.threshold_s
+        for tid, _, creg in self._iter_candidates(text):
+            t0 = perf_counter()
+            hit = creg.search(text)
+            dt = perf_counter() - t0
+            if dt >= threshold:
+                rec.record(tid, text, dt)
+            if hit:
+                return tid
+        return None
+
     def match_one(self, text: str) -> Optional[int]:
         return self._match_one_cached(text or "")
 
@@ -184,6 +212,10 @@ def match_batch(index_handle: CompiledIndex, parsed_batch: List[Any], workers: i
         return list(executor.map(index_handle.match_one, keys))
 
     key_results = _match_keys(unique_key_texts)
+    # 慢匹配记录在批次匹配结束后、回到调用线程时再落库, 不占用匹配线程
+    rec = index_handle.slow_recorder
+    if rec is not None:
+        rec.maybe_flush()
     key_to_tid = {
         key: key_results[idx] for key, idx in key_to_idx.items()
     }
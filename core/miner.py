@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+本地在线模板挖掘 (Drain 风格), 作为委员会之前的快速通道
+- 输入为已 NUMNUM 归一的关键文本, 按空白切词
+- 前缀树: 词数 -> 前 depth 个词 (含数字/占位符的词按通配处理) -> 簇列表
+- 簇内逐位比较, 不一致的位置泛化为通配符
+- 对结构简单的簇 (支持度够、通配比例低、有稳定字面量) 直接生成 pattern_nomal 候选,
+  其余样本仍交给委员会
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+WILDCARD = "<*>"
+_HAS_DIGIT = re.compile(r"\d|NUMNUM")
+_HAS_ALPHA = re.compile(r"[A-Za-z一-鿿]")
+
+
+class LogCluster:
+    __slots__ = ("cluster_id", "tokens", "samples", "emitted")
+
+    def __init__(self, cluster_id: int, tokens: List[str], sample: str):
+        self.cluster_id = cluster_id
+        self.tokens = list(tokens)
+        self.samples = [sample]
+        self.emitted = False
+
+    @property
+    def size(self) -> int:
+        return len(self.samples)
+
+    def wildcard_ratio(self) -> float:
+        return sum(1 for t in self.tokens if t == WILDCARD) / max(1, len(self.tokens))
+
+    def template_text(self) -> str:
+        return " ".join(self.tokens)
+
+
+class DrainMiner:
+    def __init__(self, depth: int = 2, sim_threshold: float = 0.5, max_children: int = 100):
+        self.depth = max(1, int(depth))
+        self.sim_threshold = float(sim_threshold)
+        self.max_children = int(max_children)
+        # (词数, 前缀词元组) -> 簇列表
+        self._tree: Dict[Tuple[int, Tuple[str, ...]], List[LogCluster]] = {}
+        # 已见过的关键文本 -> 所属簇, 同一 key 重复送入不重复计支持度
+        self._owner: Dict[str, LogCluster] = {}
+        self._next_id = 1
+
+    def _route(self, tokens: List[str]) -> Tuple[int, Tuple[str, ...]]:
+        prefix = []
+        for t in tokens[: self.depth]:
+            prefix.append(WILDCARD if _HAS_DIGIT.search(t) else t)
+        key = (len(tokens), tuple(prefix))
+        # 前缀分支过多时归并到通配分支, 防止树无限膨胀
+        if key not in self._tree and len(self._tree) >= self.max_children * 64:
+            key = (len(tokens), (WILDCARD,) * len(prefix))
+        return key
+
+    @staticmethod
+    def _similarity(template: List[str], tokens: List[str]) -> Tuple[float, int]:
+        same = 0
+        wild = 0
+        for a, b in zip(template, tokens):
+            if a == WILDCARD:
+                wild += 1
+            elif a == b:
+                same += 1
+        return same / max(1, len(tokens)), wild
+
+    def add(self, key_text: str) -> LogCluster:
+        seen = self._owner.get(key_text)
+        if seen is not None:
+            return seen
+        tokens = key_text.split()
+        if not tokens:
+            tokens = [key_text]
+        bucket = self._tree.setdefault(self._route(tokens), [])
+        best: Optional[LogCluster] = None
+        best_sim, best_wild = -1.0, -1
+        for c in bucket:
+            sim, wild = self._similarity(c.tokens, tokens)
+            if sim > best_sim or (sim == best_sim and wild > best_wild):
+                best, best_sim, best_wild = c, sim, wild
+        if best is None or best_sim < self.sim_threshold:
+            c = LogCluster(self._next_id, tokens, key_text)
+            self._next_id += 1
+            bucket.append(c)
+            self._owner[key_text] = c
+            return c
+        merged = [a if a == b else WILDCARD for a, b in zip(best.tokens, tokens)]
+        if merged != best.tokens:
+            # 模板形状变化后允许再次产出候选
+            best.tokens = merged
+            best.emitted = False
+        best.samples.append(key_text)
+        self._owner[key_text] = best
+        return best
+
+
+def cluster_to_pattern(cluster: LogCluster) -> str:
+    """
+    将簇模板转为 pattern_nomal: 字面量 re.escape (NUMNUM 原样保留), 通配为 \\S+, 词间 \\s+。
+    相邻段字符集互斥, 不会引入嵌套量词式的回溯。
+    """
+    parts = [r"\S+" if t == WILDCARD else re.escape(t) for t in cluster.tokens]
+    return "^" + r"\s+".join(parts) + "$"
+
+
+def _is_simple(cluster: LogCluster, min_support: int, max_wildcard_ratio: float) -> bool:
+    if cluster.size < min_support:
+        return False
+    if cluster.wildcard_ratio() > max_wildcard_ratio:
+        return False
+    # 至少要有一个含字母/汉字的稳定词, 避免产出 "^\S+\s+NUMNUM$" 这类过度泛化的模式
+    return any(t != WILDCARD and _HAS_ALPHA.search(t) for t in cluster.tokens)
+
+
+def mine_candidates(miner: DrainMiner, samples: List[str], min_support: int = 2,
+                    max_wildcard_ratio: float = 0.5) -> Tuple[List[Dict[str, str]], List[str]]:
+    """
+    将一批未命中样本送入挖掘器, 返回 (本地候选, 仍需委员会处理的样本)。
+    样本应是未经缓冲近重复过滤的原始未命中: Drain 靠近重复样本聚簇, 过滤后的样本很难达到 min_support。
+    rest 只排除本次新产出候选所在簇的样本; 以前产出过的簇其模板可能被覆盖选择或安全准入丢弃,
+    不算覆盖。候选是否真正入库仍以写库后的活动索引为准, 调用方应据此再筛一遍。
+    候选字段与 committee._mk_candidate 保持一致, source 记为 "miner"。
+    """
+    touched: Dict[int, LogCluster] = {}
+    owner: Dict[str, int] = {}
+    for s in samples:
+        c = miner.add(s)
+        touched[c.cluster_id] = c
+        owner[s] = c.cluster_id
+
+    cands: List[Dict[str, str]] = []
+    covered = set()
+    for cid, c in touched.items():
+        if not _is_simple(c, min_support, max_wildcard_ratio):
+            continue
+        pattern = cluster_to_pattern(c)
+        try:
+            creg = re.compile(pattern)
+        except re.error:
+            continue
+        if not all(creg.search(x) for x in c.samples):
+            continue
+        if c.emitted:
+            continue
+        c.emitted = True
+        covered.add(cid)
+        cands.append(dict(
+            pattern=pattern,
+            pattern_nomal=pattern,
+            sample_log=c.samples[0],
+            semantic_info="本地模板挖掘 分类未知 建议人工复核",
+            advise="",
+            source="miner",
+        ))
+    rest = [s for s in samples if owner.get(s) not in covered]
+    return cands, rest
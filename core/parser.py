@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 import re
-from typing import NamedTuple, Optional
+import time
+import calendar
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# 缺失时间戳的整数哨兵值
+TS_NONE = -1
 
 LINE_RE = re.compile(
     r'^\[(?P<date>\d{8})_(?P<time>\d{6})\]\[(?P<sec>\d+\.\d+)\]\[(?P<level>[A-Z])\]\[(?P<thr>\d+)\]\[MOD:(?P<mod>[^\]]*)\]\[SMOD:(?P<smod>[^\]]*)\](?P<rest>.*)$'
@@ -14,21 +19,52 @@ class ParsedLine(NamedTuple):
     smod: str
     key_text: str
     raw: str
+    epoch: int = TS_NONE   # ts 对应的整数秒，比较 / 分桶直接用它
+    sec_ms: int = 0        # [sec] 高精度字段，换算为整数毫秒
+    dims: Tuple[int, ...] = ()  # 传入符号表时为 (mod, smod, level, thread_id) 的整数编码
+
+
+# 按日期缓存当天 0 点的整数秒，单行只需做时分秒的整数运算
+_DAY_BASE: Dict[str, int] = {}
+
+
+def _day_base(date: str) -> int:
+    base = _DAY_BASE.get(date)
+    if base is None:
+        try:
+            base = calendar.timegm((int(date[0:4]), int(date[4:6]), int(date[6:8]), 0, 0, 0, 0, 0, 0))
+        except ValueError:
+            base = TS_NONE
+        if len(_DAY_BASE) > 4096:
+            _DAY_BASE.clear()
+        _DAY_BASE[date] = base
+    return base
+
 
-def parse_fields(line: str) -> Optional[ParsedLine]:
+def _sec_to_ms(sec: str) -> int:
+    whole, _, frac = sec.partition(".")
+    return int(whole) * 1000 + int((frac + "000")[:3])
+
+
+def parse_fields(line: str, symbols=None) -> Optional[ParsedLine]:
+    """
+    symbols: 可选的 core.symbols.SymbolTable。传入时 mod / smod / level / thread_id
+    会被编码进 dims，字符串字段也改为引用符号表中的同一份实例，不再逐行持有副本。
+    """
     m = LINE_RE.match(line)
     if not m:
         return None
-    date = m.group("date")
-    time_ = m.group("time")
+    date, time_, sec, level, thr, mod, smod, rest = m.groups()
     ts = f"{date} {time_}"
-    level = m.group("level")
-    thr = m.group("thr")
-    mod = m.group("mod") or ""
-    smod = m.group("smod") or ""
-    rest = m.group("rest") or ""
-    key_text = extract_key_text(rest)
-    return ParsedLine(ts=ts, level=level, thread_id=thr, mod=mod, smod=smod, key_text=key_text, raw=line)
+    base = _day_base(date)
+    epoch = TS_NONE if base == TS_NONE else base + int(time_[0:2]) * 3600 + int(time_[2:4]) * 60 + int(time_[4:6])
+    key_text = extract_key_text(rest or "")
+    dims: Tuple[int, ...] = ()
+    if symbols is not None:
+        dims = symbols.encode_dims(mod or "", smod or "", level, thr)
+        mod, smod, level, thr = symbols.decode_dims(dims)
+    return ParsedLine(ts=ts, level=level, thread_id=thr, mod=mod or "", smod=smod or "", key_text=key_text, raw=line,
+                      epoch=epoch, sec_ms=_sec_to_ms(sec), dims=dims)
 
 def extract_key_text(rest: str) -> str:
     s = rest.strip()
@@ -41,3 +77,24 @@ def extract_key_text(rest: str) -> str:
                 continue
         break
     return s.strip()
+
+
+def ts_to_epoch(ts: str) -> int:
+    """
+    将 "YYYYMMDD HHMMSS" 换算为整数秒（按朴素 UTC 处理，仅用于比较与无损往返）。
+    空串或格式不符时返回 TS_NONE。
+    """
+    if not ts or len(ts) != 15:
+        return TS_NONE
+    try:
+        return calendar.timegm((int(ts[0:4]), int(ts[4:6]), int(ts[6:8]),
+                                int(ts[9:11]), int(ts[11:13]), int(ts[13:15]), 0, 0, 0))
+    except ValueError:
+        return TS_NONE
+
+
+def epoch_to_ts(epoch: int) -> str:
+    """ts_to_epoch 的逆运算，TS_NONE 还原为空串。"""
+    if epoch is None or epoch == TS_NONE:
+        return ""
+    return time.strftime("%Y%m%d %H%M%S", time.gmtime(epoch))
@@ -58,3 +58,56 @@ def read_in_chunks(path: str, chunk_lines: int = 10000) -> Iterable[list]:
 
 def split_micro_batches(lines: list, size: int = 20) -> List[list]:
     return [lines[i : i + size] for i in range(0, len(lines), size)]
+
+
+def byte_shards(path: str, n: int) -> List[tuple]:
+    """
+    把未压缩文本按字节均分为 n 段 [(start, end), ...]，每段边界对齐到行首；
+    小文件或行很长时段数可能少于 n。
+    """
+    size = os.path.getsize(path)
+    n = max(1, int(n or 1))
+    bounds = [0]
+    with open(path, "rb") as f:
+        for k in range(1, n):
+            pos = size * k // n
+            if pos <= bounds[-1]:
+                continue
+            # 从 pos-1 读到行尾: 若 pos 恰为行首, readline 只读掉前一行的换行符
+            f.seek(pos - 1)
+            f.readline()
+            b = f.tell()
+            if bounds[-1] < b < size:
+                bounds.append(b)
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def read_shard_in_chunks(path: str, start: int, end: int, chunk_lines: int = 10000) -> Iterable[list]:
+    """
+    读取 byte_shards 给出的一段，分块产出行，与 read_in_chunks 的文本模式逐行结果一致
+    （utf-8 errors="ignore"，\r\n 与单独的 \r 都视为换行）。
+    """
+    buf = []
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            raw = f.readline()
+            if not raw:
+                break
+            pos += len(raw)
+            line = raw.decode("utf-8", errors="ignore")
+            if "\r" in line:
+                line = line.replace("\r\n", "\n").replace("\r", "\n")
+            if line.endswith("\n"):
+                line = line[:-1]
+            if "\n" in line:
+                buf.extend(line.split("\n"))
+            else:
+                buf.append(line)
+            if len(buf) >= chunk_lines:
+                yield buf
+                buf = []
+    if buf:
+        yield buf
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+基于 re._parser 语法树的灾难回溯静态分析
+- 字符集抽象: 每个单字符原子在探测字母表 (ASCII + 少量非 ASCII 代表字符) 上求可匹配字符集合, 用整数位图表示,
+  两个原子“可重叠”即位图交集非空
+- 检查项:
+    ambiguous_loop                   无界循环体可被同一串以多种方式迭代, 如 (a+)+ / (\\w+\\s?)+, 指数级
+    overlapping_alternation_in_loop  循环内两个分支能匹配同一串, 或两个分支拼接后能被单个分支匹配, 如 (a|aa)+, 指数级
+    star_height_N                    无界量词嵌套深度 (仅在 N >= 2 时记录)
+    adjacent_overlapping_quantifiers_K  同一序列中 K 个无界量词首尾相接且字符集重叠 (中间元素也可被吸收), O(n^K)
+    flexible_chain_K                 同一序列中 K 个可变长片段都能吞掉其后的分隔符 (如 NUMNUM 展开后的 .), 对齐方式随 K 组合增长
+- 输出最坏复杂度等级 linear / polynomial / exponential 与多项式次数, 以及针对性的攻击串 (供动态压测使用)
+"""
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import re
+
+try:
+    from re import _compiler as _sre_compile
+    from re import _parser as _sre_parse
+    from re import _constants as _sre_const
+except ImportError:  # pragma: no cover  Python < 3.11
+    import sre_compile as _sre_compile
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_const
+
+MAXREPEAT = _sre_const.MAXREPEAT
+
+_PROBES = [chr(i) for i in range(128)] + ["\u00a0", "\u00e9", "\u2003", "\u4e2d"]
+_ALL = (1 << len(_PROBES)) - 1
+_CATEGORY_RE = {
+    "CATEGORY_DIGIT": r"\d", "CATEGORY_NOT_DIGIT": r"\D",
+    "CATEGORY_SPACE": r"\s", "CATEGORY_NOT_SPACE": r"\S",
+    "CATEGORY_WORD": r"\w", "CATEGORY_NOT_WORD": r"\W",
+    "CATEGORY_LINEBREAK": r"\n", "CATEGORY_NOT_LINEBREAK": r"[^\n]",
+}
+# 选代表字符时的偏好: 数字与字母最能贴近日志文本
+_PREFERRED = "1a0A_ -./:,"
+
+
+class RegexAnalysis(NamedTuple):
+    complexity: str          # linear | polynomial | exponential | unknown
+    degree: int              # 多项式次数 (指数级时为 0)
+    star_height: int
+    flags: List[str]
+    attacks: List[str]
+
+
+def _mask_of(pred) -> int:
+    m = 0
+    for i, ch in enumerate(_PROBES):
+        if pred(ch):
+            m |= 1 << i
+    return m
+
+
+_CAT_MASK: Dict[Tuple[str, int], int] = {}
+
+
+def _category_mask(name: str, flags: int) -> int:
+    key = (name, flags & re.ASCII)
+    if key not in _CAT_MASK:
+        creg = re.compile(_CATEGORY_RE.get(name, r"[\s\S]"), flags & re.ASCII)
+        _CAT_MASK[key] = _mask_of(lambda ch: creg.match(ch) is not None)
+    return _CAT_MASK[key]
+
+
+def _literal_mask(code: int, flags: int) -> int:
+    ch = chr(code)
+    if flags & re.IGNORECASE:
+        variants = {ch, ch.lower(), ch.upper()}
+        return _mask_of(lambda c: c in variants)
+    return _mask_of(lambda c: c == ch)
+
+
+def _atom_mask(op, av, flags: int) -> Optional[int]:
+    """单字符原子的字符集位图; 不是单字符原子返回 None。"""
+    name = str(op)
+    if name == "LITERAL":
+        return _literal_mask(av, flags)
+    if name == "NOT_LITERAL":
+        return _ALL & ~_literal_mask(av, flags)
+    if name == "ANY":
+        return _ALL if flags & re.DOTALL else _ALL & ~_literal_mask(10, 0)
+    if name == "IN":
+        m, neg = 0, False
+        for iop, iav in av:
+            iname = str(iop)
+            if iname == "NEGATE":
+                neg = True
+            elif iname in ("LITERAL",):
+                m |= _literal_mask(iav, flags)
+            elif iname == "RANGE":
+                lo, hi = iav
+                m |= _mask_of(lambda c: lo <= ord(c) <= hi)
+            elif iname == "CATEGORY":
+                m |= _category_mask(str(iav), flags)
+            else:
+                m = _ALL
+        return (_ALL & ~m) if neg else m
+    return None
+
+
+def _is_unbounded(hi) -> bool:
+    return hi >= MAXREPEAT
+
+
+def _repeat(op, av):
+    """返回 (min, max, body) ; 非重复节点返回 None。"""
+    name = str(op)
+    if name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+        return av[0], av[1], av[2]
+    return None
+
+
+def _children(op, av) -> List[Any]:
+    """子序列列表 (SUBPATTERN / BRANCH / 断言 / 原子组)。"""
+    name = str(op)
+    if name == "SUBPATTERN":
+        return [av[-1]]
+    if name == "BRANCH":
+        return list(av[1])
+    if name in ("ASSERT", "ASSERT_NOT"):
+        return [av[1]]
+    if name == "ATOMIC_GROUP":
+        return [av]
+    if name == "GROUPREF_EXISTS":
+        return [x for x in av[1:] if x is not None]
+    rep = _repeat(op, av)
+    if rep:
+        return [rep[2]]
+    return []
+
+
+class _Ctx:
+    def __init__(self, state):
+        self.state = state
+        self.flags = state.flags
+
+    # ---------- 集合与长度 ----------
+    def chars(self, seq) -> int:
+        """序列可能消耗的全部字符。"""
+        m = 0
+        for op, av in seq:
+            a = _atom_mask(op, av, self.flags)
+            if a is not None:
+                m |= a
+                continue
+            if str(op) in ("ASSERT", "ASSERT_NOT"):
+                continue
+            for ch in _children(op, av):
+                m |= self.chars(ch)
+        return m
+
+    def nullable(self, seq) -> bool:
+        try:
+            return _sre_parse.SubPattern(self.state, list(seq)).getwidth()[0] == 0
+        except Exception:
+            return False
+
+    def first(self, seq) -> int:
+        """序列首字符集合 (跳过可空前缀)。"""
+        m = 0
+        for op, av in seq:
+            a = _atom_mask(op, av, self.flags)
+            name = str(op)
+            if a is not None:
+                return m | a
+            if name in ("AT", "ASSERT", "ASSERT_NOT", "GROUPREF"):
+                continue
+            rep = _repeat(op, av)
+            if rep:
+                m |= self.first(rep[2])
+                if rep[0] > 0 and not self.nullable(rep[2]):
+                    return m
+                continue
+            subs = _children(op, av)
+            for ch in subs:
+                m |= self.first(ch)
+            if not self.nullable([(op, av)]):
+                return m
+        return m
+
+    def unbounded(self, op, av) -> bool:
+        try:
+            return _is_unbounded(_sre_parse.SubPattern(self.state, [(op, av)]).getwidth()[1])
+        except Exception:
+            return False
+
+    # ---------- 见证串 ----------
+    def witness(self, seq, reps: int = 1, prefer: int = 0, alt: int = 0) -> str:
+        """构造能被 seq 完整匹配的一条短串; 无界量词取 reps 次, 分支取第 alt 个 (超出取最后一个)。"""
+        out = []
+        for op, av in seq:
+            a = _atom_mask(op, av, self.flags)
+            if a is not None:
+                out.append(_pick(a, prefer))
+                continue
+            name = str(op)
+            rep = _repeat(op, av)
+            if rep:
+                lo, hi, body = rep
+                n = lo if (hi - lo) == 0 else min(hi, max(lo, reps))
+                out.append(self.witness(body, reps, prefer, alt) * n)
+            elif name == "SUBPATTERN":
+                out.append(self.witness(av[-1], reps, prefer, alt))
+            elif name == "BRANCH":
+                out.append(self.witness(av[1][min(alt, len(av[1]) - 1)], reps, prefer, alt))
+            elif name == "ATOMIC_GROUP":
+                out.append(self.witness(av, reps, prefer, alt))
+        return "".join(out)
+
+    def compile(self, seq):
+        try:
+            return _sre_compile.compile(_sre_parse.SubPattern(self.state, list(seq)))
+        except Exception:
+            return None
+
+
+def _pick(mask: int, prefer: int = 0) -> str:
+    if mask <= 0:
+        return "\x00"
+    if prefer:
+        both = mask & prefer
+        if both:
+            mask = both
+    for ch in _PREFERRED:
+        i = _PROBES.index(ch)
+        if mask >> i & 1:
+            return ch
+    i = (mask & -mask).bit_length() - 1
+    return _PROBES[i]
+
+
+def _outside(mask: int) -> str:
+    """挑一个不在 mask 里的字符, 用作让匹配失败的结尾。"""
+    for ch in "!#\x00~@":
+        if not (mask >> _PROBES.index(ch) & 1):
+            return ch
+    return "\uffff"
+
+
+def _branches_of(body) -> Optional[List[Any]]:
+    """循环体是 (分支) 或 (?:分支) 时返回分支列表。"""
+    seq = list(body)
+    while len(seq) == 1 and str(seq[0][0]) == "SUBPATTERN":
+        seq = list(seq[0][1][-1])
+    if len(seq) == 1 and str(seq[0][0]) == "BRANCH":
+        return list(seq[0][1][1])
+    return None
+
+
+class _Analyzer:
+    def __init__(self, parsed):
+        self.ctx = _Ctx(parsed.state)
+        self.flags: List[str] = []
+        self.exponential = False
+        self.degree = 1
+        self.star_height = 0
+        self.attacks: List[str] = []
+
+    def _flag(self, f: str) -> None:
+        if f not in self.flags:
+            self.flags.append(f)
+
+    # ---------- 循环二义 ----------
+    def _check_loop(self, body, prefix: str) -> None:
+        ctx = self.ctx
+        body_chars = ctx.chars(body)
+        tail = _outside(body_chars)
+        if ctx.nullable(body) and any(ctx.unbounded(op, av) for op, av in body):
+            self.exponential = True
+            self._flag("ambiguous_loop")
+            self.attacks.append(prefix + ctx.witness(body, 2) * 16 + tail)
+            return
+        # 一次迭代能匹配的串若也能被两次迭代匹配, 迭代划分就有多种, 失败时回溯按指数增长
+        twice = ctx.compile(list(body) * 2)
+        for reps, alt in ((1, 0), (2, 0), (3, 0), (1, 1), (2, 1), (1, 2)):
+            w = ctx.witness(body, reps, alt=alt)
+            if w and twice is not None and twice.fullmatch(w):
+                self.exponential = True
+                self._flag("ambiguous_loop")
+                self.attacks.append(prefix + w * max(4, 32 // max(1, len(w))) + tail)
+                return
+        branches = _branches_of(body)
+        if not branches or len(branches) < 2:
+            return
+        comp = [ctx.compile(b) for b in branches]
+        wits = [ctx.witness(b, 1) for b in branches]
+        for i, w in enumerate(wits):
+            if not w:
+                continue
+            for j, c in enumerate(comp):
+                if j == i or c is None:
+                    continue
+                # 分支 i 的见证串能被分支 j 匹配, 或拼上某个分支的见证串后能被分支 j 单独匹配
+                hit = w if c.fullmatch(w) else next((w + v for v in wits if v and c.fullmatch(w + v)), None)
+                if hit:
+                    self.exponential = True
+                    self._flag("overlapping_alternation_in_loop")
+                    self.attacks.append(prefix + hit * max(4, 32 // max(1, len(hit))) + tail)
+                    return
+
+    # ---------- 序列级: 相邻重叠量词与可变长片段链 ----------
+    def _check_sequence(self, seq) -> None:
+        ctx = self.ctx
+        items = list(seq)
+        # 相邻重叠无界量词
+        chain, cur = 0, 0
+        best_chain, chain_start, best_span = 0, 0, (0, 0)
+        for k, (op, av) in enumerate(items):
+            rep = _repeat(op, av)
+            single = None
+            if rep and _is_unbounded(rep[1]):
+                body = list(rep[2])
+                single = _atom_mask(*body[0], ctx.flags) if len(body) == 1 else None
+            if single is not None:
+                if chain and single & cur:
+                    chain += 1
+                else:
+                    chain, chain_start = 1, k
+                cur = single
+                if chain > best_chain:
+                    best_chain, best_span = chain, (chain_start, k)
+                continue
+            a = _atom_mask(op, av, ctx.flags)
+            if chain and a is not None and a & cur:
+                continue
+            if chain and (str(op) == "AT" or ctx.nullable([(op, av)])):
+                continue
+            chain, cur = 0, 0
+        if best_chain >= 2:
+            self._flag(f"adjacent_overlapping_quantifiers_{best_chain}")
+            self.degree = max(self.degree, best_chain)
+            s, e = best_span
+            shared = _ALL
+            for op, av in items[s:e + 1]:
+                rep = _repeat(op, av)
+                if rep and _is_unbounded(rep[1]) and len(rep[2]) == 1:
+                    shared &= _atom_mask(*list(rep[2])[0], ctx.flags) or 0
+            head = ctx.witness(items[:s])
+            self.attacks.append(head + _pick(shared) * (3000 if best_chain == 2 else 400) + _outside(ctx.chars(items[s:e + 1])))
+
+        # 可变长片段能吞掉其后的分隔符
+        flex = []
+        for k, (op, av) in enumerate(items):
+            if _atom_mask(op, av, ctx.flags) is not None or not ctx.unbounded(op, av):
+                continue
+            follow = ctx.first(items[k + 1:])
+            if follow and ctx.chars([(op, av)]) & follow:
+                flex.append(k)
+        if len(flex) >= 2:
+            self._flag(f"flexible_chain_{len(flex)}")
+            self.degree = max(self.degree, len(flex))
+            pieces = [ctx.witness([it], 1, prefer=_DIGITS) for it in items]
+            s, e = flex[0], flex[-1]
+            head, span, tail = "".join(pieces[:s]), "".join(pieces[s:e + 1]), "".join(pieces[e + 1:])
+            self.attacks.append(head + span * 6 + tail + _outside(ctx.chars(items)))
+            self.attacks.append(head + span * 6 + _outside(ctx.chars(items)))
+
+    def walk(self, seq, depth: int = 0, prefix: str = "") -> None:
+        self._check_sequence(seq)
+        items = list(seq)
+        for k, (op, av) in enumerate(items):
+            pre = prefix + self.ctx.witness(items[:k]) if depth == 0 else prefix
+            rep = _repeat(op, av)
+            if rep and _is_unbounded(rep[1]):
+                d = depth + 1
+                self.star_height = max(self.star_height, d)
+                self._check_loop(rep[2], pre)
+                self.walk(rep[2], d, pre)
+                continue
+            for ch in _children(op, av):
+                self.walk(ch, depth, pre)
+
+
+_DIGITS = _mask_of(lambda c: c.isdigit())
+
+
+def analyze_pattern(pattern: str) -> RegexAnalysis:
+    """对单条正则做语法树分析; 解析失败返回 unknown。"""
+    try:
+        parsed = _sre_parse.parse(pattern)
+    except Exception:
+        return RegexAnalysis("unknown", 0, 0, ["parse_error"], [])
+    an = _Analyzer(parsed)
+    an.walk(parsed)
+    if an.star_height >= 2:
+        an._flag(f"star_height_{an.star_height}")
+    if an.exponential:
+        complexity, degree = "exponential", 0
+    elif an.degree >= 2:
+        complexity, degree = "polynomial", an.degree
+    else:
+        complexity, degree = "linear", 1
+    seen, attacks = set(), []
+    for a in an.attacks:
+        a = a[:8000]
+        if a and a not in seen:
+            seen.add(a)
+            attacks.append(a)
+    return RegexAnalysis(complexity, degree, an.star_height, an.flags, attacks)
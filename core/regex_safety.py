@@ -2,19 +2,35 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import hashlib
+import json
+import logging
+import os
+import signal
+import threading
 import time
-from dataclasses import dataclass, asdict
-from typing import List, Sequence, Optional, Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as _FutureTimeout
+from dataclasses import dataclass, asdict, replace
+from typing import List, Sequence, Optional, Dict, Any, Tuple
 
-import re as stdre  # 只用于静态分析
+import re as stdre  # 未安装 regex 时用于动态压测
+
+from core.regex_ast import analyze_pattern
 
 try:
-    import regex  # 用于动态压测 + timeout
-except ImportError as e:
-    raise RuntimeError(
-        "模块 'regex' 未安装，本模块需要用它做离线 timeout 检测。\n"
-        "请先执行: pip install regex"
-    ) from e
+    import regex  # 动态压测优先用其 timeout 参数
+except ImportError:
+    # 没有 regex 时退回标准库 re, 由 SIGALRM 限时 (仅主线程可用; 入库准入在进程池 worker 主线程里跑)
+    regex = None
+
+# 与 bin 脚本共用 "myapp" logger (由入口脚本配置输出)
+logger = logging.getLogger("myapp")
+
+# 分析器版本: 静态规则或压测串生成逻辑变化时递增, 扫描缓存中旧版本的结论随之失效
+ANALYZER_VERSION = "2"
+
+_RE_ERRORS: Tuple[type, ...] = (stdre.error,) + ((regex.error,) if regex is not None else ())
 
 
 @dataclass
@@ -28,50 +44,38 @@ class RegexSafetyResult:
     timeout_text_preview: Optional[str]
     timeout_cost: Optional[float]
     samples_tested: int
+    complexity: str = "linear"   # 语法树分析给出的最坏复杂度: linear / polynomial / exponential / unknown
+    degree: int = 1              # 多项式次数
 
     def to_dict(self) -> Dict[str, Any]:
         return asdict(self)
 
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "RegexSafetyResult":
+        return cls(**{k: d[k] for k in cls.__dataclass_fields__ if k in d})
 
-# ---------- 更激进的静态红旗规则 ----------
-
-def _static_red_flags(pattern: str) -> List[str]:
-    """
-    返回静态可疑特征列表。
-
-    这里宁可多报一点“嫌疑人”，也不要漏掉真正危险的。
-    """
-    flags: List[str] = []
 
-    # 1) 嵌套量词，如: (.+)+、(\w+)*、(?:[A-Z]+)+ 等
-    #   粗暴一点：括号里有量词，括号外又跟量词
-    if stdre.search(r"\((?:[^()]*?[+*?][^()]*)\)[+*?]", pattern):
-        flags.append("nested_quantifier_group")
+# ---------- 静态分析 (语法树) ----------
 
-    # 2) 多个 dot-star / plus 组合，容易产生大量回溯
-    if ".*.*" in pattern or ".*.+" in pattern or ".+.*" in pattern:
-        flags.append("multiple_dot_star_like")
+# 多项式次数达到该值记为 warning; 是否升为 danger 由针对性攻击串的动态压测决定
+POLY_WARNING_DEGREE = 3
 
-    # 3) 大分支 + 量词，例如 (foo|bar|baz|...)+
-    if stdre.search(r"\((?:[^()]*\|){3,}[^()]*\)[+*?]", pattern):
-        flags.append("large_alternation_with_quantifier")
 
-    # 4) 看起来比较长、而且没有锚点的正则，也标个 flag 提醒
-    if len(pattern) > 120 and not stdre.search(r"^\^|\$$", pattern):
-        flags.append("long_unanchored_pattern")
-    if stdre.search(
-        r"(?:\(\?:[^)]*?\w[+*][^)]*\)[+*])\s*(?:\\w[+*]|\(\?:[^)]*?\\w[^)]*\)[+*])",
-        pattern,
-    ):
-        flags.append("adjacent_quantified_words")
-    return flags
+def _static_red_flags(pattern: str) -> List[str]:
+    """返回语法树分析得到的可疑特征列表 (见 core.regex_ast)。"""
+    return analyze_pattern(pattern).flags
 
 
 # ---------- 动态压测：构造更“狠”的测试文本 ----------
 
-def _make_test_strings(pattern: str, sample_texts: Sequence[str]) -> List[str]:
+def _make_test_strings(pattern: str, sample_texts: Sequence[str], attacks: Sequence[str] = ()) -> List[str]:
     tests: List[str] = []
 
+    # 语法树分析生成的针对性攻击串最可能触发回溯, 放在最前面
+    for t in attacks:
+        if t and t not in tests:
+            tests.append(t)
+
     # 先把样例日志塞进去
     for t in sample_texts:
         if t and t not in tests:
@@ -136,6 +140,43 @@ def _make_test_strings(pattern: str, sample_texts: Sequence[str]) -> List[str]:
     return out
 
 
+# ---------- 限时搜索 ----------
+
+class _SearchTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _SearchTimeout()
+
+
+def _compile(pattern: str):
+    return regex.compile(pattern) if regex is not None else stdre.compile(pattern)
+
+
+def _timed_search(creg, text: str, timeout_sec: float):
+    """
+    限时执行一次 search 并返回匹配对象, 超时抛 TimeoutError。
+    regex 模块直接用 timeout 参数; 标准库 re 在主线程里用 ITIMER_REAL 打断 (sre 匹配循环会定期检查信号),
+    非主线程无法设置信号, 只能跑完后按耗时判定, 所以准入检查总是放在 worker 进程的主线程里做。
+    """
+    if regex is not None and not isinstance(creg, stdre.Pattern):
+        return creg.search(text, timeout=timeout_sec)
+    if threading.current_thread() is not threading.main_thread() or not hasattr(signal, "setitimer"):
+        return creg.search(text)
+    old = signal.signal(signal.SIGALRM, _on_alarm)
+    try:
+        try:
+            signal.setitimer(signal.ITIMER_REAL, timeout_sec)
+            return creg.search(text)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except _SearchTimeout:
+        raise TimeoutError(f"search exceeded {timeout_sec}s")
+    finally:
+        signal.signal(signal.SIGALRM, old)
+
+
 # ---------- 核心检测函数 ----------
 
 def analyze_regex_safety(
@@ -146,21 +187,22 @@ def analyze_regex_safety(
     """
     对单个正则做“离线安全检测”：
 
-      - 静态：检查典型的灾难回溯结构；
-      - 动态：对多组文本做 regex.search(text, timeout=timeout_sec) 压测。
+      - 静态：遍历 re._parser 语法树，找二义循环、循环内重叠分支、相邻重叠量词等结构并估计最坏复杂度；
+      - 动态：用针对性攻击串 + 样例 + 通用长串做限时 search 压测。
 
     注意：这里是“激进模式”：
-      * 只要有静态红旗，就至少是 warning；
+      * 语法树判定指数级即 danger，高次多项式至少是 warning；
       * 线上推荐：直接把 warning 也当 danger 禁用。
     """
-    static_flags = _static_red_flags(pattern)
+    ast = analyze_pattern(pattern)
+    static_flags = list(ast.flags)
     samples = list(sample_texts or [])
 
     # 1. 编译检测
     try:
-        creg = regex.compile(pattern)
+        creg = _compile(pattern)
         compile_ok = True
-    except regex.error as e:
+    except _RE_ERRORS as e:
         return RegexSafetyResult(
             pattern=pattern,
             level="danger",
@@ -171,10 +213,12 @@ def analyze_regex_safety(
             timeout_text_preview=None,
             timeout_cost=None,
             samples_tested=0,
+            complexity=ast.complexity,
+            degree=ast.degree,
         )
 
     # 2. 动态压测
-    tests = _make_test_strings(pattern, samples)
+    tests = _make_test_strings(pattern, samples, ast.attacks)
     dynamic_timeout = False
     runtime_error: Optional[str] = None
     timeout_text_preview: Optional[str] = None
@@ -187,13 +231,13 @@ def analyze_regex_safety(
 
         t0 = time.perf_counter()
         try:
-            creg.search(text, timeout=timeout_sec)
+            _timed_search(creg, text, timeout_sec)
         except TimeoutError:
             dynamic_timeout = True
             timeout_text_preview = text[:200]
             timeout_cost = time.perf_counter() - t0
             break
-        except regex.error as e:
+        except _RE_ERRORS as e:
             runtime_error = str(e)
             break
         else:
@@ -208,14 +252,14 @@ def analyze_regex_safety(
         tested += 1
 
     # 3. 结果等级：
-    #   - danger: 编译失败 / 动态超时 / 运行时异常
-    #   - warning: 动态 OK，但有静态红旗
-    #   - ok: 都没问题
+    #   - danger: 编译失败 / 动态超时 / 运行时异常 / 语法树判定指数级回溯
+    #   - warning: 动态 OK，但多项式次数 >= POLY_WARNING_DEGREE
+    #   - ok: 其余（低次多项式的特征仍记录在 static_flags 中）
     if not compile_ok or dynamic_timeout or runtime_error:
         level = "danger"
-    elif "nested_quantifier_group" in static_flags:
+    elif ast.complexity == "exponential":
         level = "danger"
-    elif static_flags:
+    elif ast.complexity == "polynomial" and ast.degree >= POLY_WARNING_DEGREE:
         level = "warning"
     else:
         level = "ok"
@@ -230,6 +274,8 @@ def analyze_regex_safety(
         timeout_text_preview=timeout_text_preview,
         timeout_cost=timeout_cost,
         samples_tested=tested,
+        complexity=ast.complexity,
+        degree=ast.degree,
     )
 
 
@@ -242,3 +288,266 @@ def check_regex_safety(pattern: str) -> bool:
     """
     r = analyze_regex_safety(pattern)
     return r.level != "danger"
+
+
+# ---------- 入库准入: 并行检测 + 改写 ----------
+
+_VERDICTS: "OrderedDict[Tuple[str, float], RegexSafetyResult]" = OrderedDict()
+_VERDICTS_MAX = 20000
+_GATE_POOL: Optional[ProcessPoolExecutor] = None
+_GATE_LOCK = threading.Lock()
+
+
+def _analyze_job(job: Tuple[str, List[str], float]) -> RegexSafetyResult:
+    pattern, samples, timeout_sec = job
+    return analyze_regex_safety(pattern, samples, timeout_sec)
+
+
+def verdict_key(pattern: str, sample_texts: Sequence[str], timeout_sec: float) -> str:
+    """检测结论的内容键: 模式、压测样本与时限任一变化都会换键; 分析器版本单独存列比对。"""
+    payload = json.dumps([pattern, [t for t in sample_texts if t], float(timeout_sec)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _gate_pool(workers: int) -> ProcessPoolExecutor:
+    global _GATE_POOL
+    with _GATE_LOCK:
+        if _GATE_POOL is None:
+            _GATE_POOL = ProcessPoolExecutor(max_workers=workers)
+        return _GATE_POOL
+
+
+def close_gate_pool() -> None:
+    global _GATE_POOL
+    with _GATE_LOCK:
+        if _GATE_POOL is not None:
+            _GATE_POOL.shutdown(wait=False, cancel_futures=True)
+            _GATE_POOL = None
+
+
+def _run_jobs(fn, jobs: List[Any], timeout_sec: float, workers: int) -> List[Any]:
+    """
+    主线程且任务少时就地执行, 否则交给进程池 (worker 主线程可用信号限时)。
+    整体超过预算时重建进程池, 返回的结果少于 jobs, 缺的部分由调用方按最坏情况补齐。
+    """
+    in_process = threading.current_thread() is threading.main_thread() and (workers <= 1 or len(jobs) < 2)
+    if in_process:
+        return [fn(j) for j in jobs]
+    # 每条至多约 (测试串数 x timeout), 留足余量; 正常情况远小于该预算
+    budget = 2.0 + timeout_sec * 40 * (len(jobs) / max(1, min(workers, len(jobs))) + 1)
+    results = []
+    try:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        for r in _gate_pool(workers).map(fn, jobs, timeout=budget, chunksize=chunksize):
+            results.append(r)
+    except _FutureTimeout:
+        close_gate_pool()
+    return results
+
+
+def analyze_many(items: Sequence[Tuple[str, Sequence[str]]], timeout_sec: float = 0.1,
+                 workers: int = 0) -> List[RegexSafetyResult]:
+    """
+    批量检测 (pattern, 样本) 列表, 结果按 (pattern, timeout) 记忆, 同一进程内重复提交不再压测。
+    多条或非主线程调用时交给进程池 (worker 主线程可用信号限时); 整体超过预算的条目按 danger 处理并重建进程池。
+    """
+    workers = int(workers) if workers else (os.cpu_count() or 1)
+    out: List[Optional[RegexSafetyResult]] = [None] * len(items)
+    pending: List[int] = []
+    with _GATE_LOCK:
+        for i, (p, _) in enumerate(items):
+            hit = _VERDICTS.get((p, timeout_sec))
+            if hit is not None:
+                out[i] = hit
+            else:
+                pending.append(i)
+    if not pending:
+        return out  # type: ignore[return-value]
+
+    jobs = [(items[i][0], [t for t in items[i][1] if t], timeout_sec) for i in pending]
+    results = _run_jobs(_analyze_job, jobs, timeout_sec, workers)
+    for j in jobs[len(results):]:
+        results.append(RegexSafetyResult(
+            pattern=j[0], level="danger", compile_ok=True, static_flags=_static_red_flags(j[0]),
+            dynamic_timeout=True, runtime_error="analysis_timeout", timeout_text_preview=None,
+            timeout_cost=None, samples_tested=0,
+        ))
+
+    with _GATE_LOCK:
+        for i, r in zip(pending, results):
+            out[i] = r
+            if r.runtime_error != "analysis_timeout":
+                _VERDICTS[(r.pattern, timeout_sec)] = r
+        while len(_VERDICTS) > _VERDICTS_MAX:
+            _VERDICTS.popitem(last=False)
+    return out  # type: ignore[return-value]
+
+
+# 改写按词法记号进行: 转义 / 字符类 / 分组括号 / 量词 (含惰性与占有后缀) 各为一个记号,
+# 不会把 \( 当分组、也不会把 \.* 当成 .*
+_TOKEN = stdre.compile(
+    r"\\.|\[\^?\]?(?:\\.|[^\]\\])*\]|\((?:\?(?:P<[^>]*>|P=[^)]*|[^P]))?|\)"
+    r"|(?:[*+?]|\{\d*(?:,\d*)?\})[?+]?|.",
+    stdre.S,
+)
+_GREEDY_UNBOUNDED = ("*", "+")
+
+
+def _tokenize(pattern: str) -> List[str]:
+    return _TOKEN.findall(pattern)
+
+
+def _is_atom(tok: str) -> bool:
+    """单字符原子: 普通字符、. 、单字符转义与字符类; 分组括号、量词、锚点与分支符除外。"""
+    if tok in ("(", ")", "|", "^", "$") or tok.startswith("(") or _is_quant(tok):
+        return False
+    if tok.startswith("\\"):
+        return tok[1:] not in ("A", "Z", "b", "B") and not tok[1:].isdigit()
+    return True
+
+
+def _is_quant(tok: str) -> bool:
+    return bool(tok) and (tok[0] in "*+?" or (tok[0] == "{" and tok.endswith(("}", "}?", "}+"))))
+
+
+def _has_backref(tokens: List[str]) -> bool:
+    return any((t.startswith("\\") and t[1:].isdigit()) or t.startswith("(?P=") or t == "(?(" for t in tokens)
+
+
+def rewrite_pattern(pattern: str) -> str:
+    """
+    保持匹配语言不变的结构改写: (x+)+ -> (x+), (x+)* / (x*)+ / (x*)* -> (x*), 以及相邻 .* / .+ 合并。
+    只处理贪婪的 * / + (惰性、占有与有界量词不动); 有反向引用时捕获组不改写 (组内捕获内容会变)。
+    不能改写时原样返回; 调用方仍应在样本上核对改写前后的匹配结果 (见 screen_candidates)。
+    """
+    tokens = _tokenize(pattern)
+    if "".join(tokens) != pattern:
+        return pattern
+    keep_capture = _has_backref(tokens)
+    changed = True
+    while changed:
+        changed = False
+        for k in range(len(tokens)):
+            # ( atom q1 ) q2  ->  ( atom q )
+            if (k + 4 < len(tokens) and tokens[k] in ("(", "(?:") and _is_atom(tokens[k + 1])
+                    and tokens[k + 2] in _GREEDY_UNBOUNDED and tokens[k + 3] == ")"
+                    and tokens[k + 4] in _GREEDY_UNBOUNDED
+                    and not (keep_capture and tokens[k] == "(")):
+                q = "+" if tokens[k + 2] == tokens[k + 4] == "+" else "*"
+                tokens[k:k + 5] = [tokens[k], tokens[k + 1], q, ")"]
+                changed = True
+                break
+            # .q1 .q2  ->  .*  /  .+
+            if (k + 3 < len(tokens) and tokens[k] == "." and tokens[k + 2] == "."
+                    and tokens[k + 1] in _GREEDY_UNBOUNDED and tokens[k + 3] in _GREEDY_UNBOUNDED
+                    and "*" in (tokens[k + 1], tokens[k + 3])):
+                q = "+" if "+" in (tokens[k + 1], tokens[k + 3]) else "*"
+                tokens[k:k + 4] = [".", q]
+                changed = True
+                break
+    return "".join(tokens)
+
+
+def _agree_job(job: Tuple[str, str, List[str], float]) -> bool:
+    """原模式与改写在每条样本上的 search 结果 (命中区间) 一致时返回 True; 原模式超时或出错视为无法确认。"""
+    original, rewritten, samples, timeout_sec = job
+    try:
+        a, b = _compile(original), _compile(rewritten)
+        for text in samples:
+            ma = _timed_search(a, text, timeout_sec)
+            mb = _timed_search(b, text, timeout_sec)
+            if (ma.span() if ma else None) != (mb.span() if mb else None):
+                return False
+    except (TimeoutError,) + _RE_ERRORS:
+        return False
+    return bool(samples)
+
+
+def rewrites_agree(items: Sequence[Tuple[str, str, Sequence[str]]], timeout_sec: float = 0.1,
+                   workers: int = 0) -> List[bool]:
+    """批量核对 (原模式, 改写, 样本); 没有样本或超出预算的条目判为不一致。"""
+    workers = int(workers) if workers else (os.cpu_count() or 1)
+    jobs = [(o, r, [t for t in samples if t], timeout_sec) for o, r, samples in items]
+    results = _run_jobs(_agree_job, jobs, timeout_sec, workers)
+    return results + [False] * (len(jobs) - len(results))
+
+
+def _literal_from_sample(sample: str) -> str:
+    """退路: 用样本本身生成锚定字面量模板, NUMNUM 占位保留 (写库时展开为数字正则)。"""
+    return "^" + stdre.escape(sample).replace(stdre.escape("NUMNUM"), "NUMNUM") + "$"
+
+
+def _unsafe(r: RegexSafetyResult, ban_warning: bool) -> bool:
+    return r.level == "danger" or (ban_warning and r.level == "warning")
+
+
+def screen_candidates(cands: List[Dict[str, Any]], timeout_sec: float = 0.1, workers: int = 0,
+                      ban_warning: bool = False,
+                      expand=None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    候选入库前的安全准入。
+    - 检测写库后的 pattern 列 (expand(pattern_nomal), 默认把 NUMNUM 展开为数字正则);
+      它只比 pattern_nomal 多出数字子模式, 检测它即同时覆盖索引按任一列编译的情况
+    - 不安全的先尝试保持语义的结构改写, 再退到由 sample_log 生成的字面量模板, 改写结果同样要过检测;
+      结构改写还须在样本上与原模式的匹配结果一致, 否则丢弃
+    返回 (accepted, rejected); accepted 均为副本并带 safety_screened=True, 写库时不再重复检测;
+    被改写的候选带 safety_rewrite 字段记录原模式, 退到字面量的另将 source 标为 "safety_literal";
+    rejected 为检测结果字典 (附 template 原模式)。
+    """
+    if not cands:
+        return [], []
+    if expand is None:
+        from store.dao import NUMERIC_PATTERN
+        expand = lambda p: p.replace("NUMNUM", NUMERIC_PATTERN)  # noqa: E731
+
+    def _nomal(c):
+        return (c.get("pattern_nomal") or c.get("pattern") or "").strip()
+
+    def _samples(c):
+        return [c.get("sample_log") or ""]
+
+    first = analyze_many([(expand(_nomal(c)), _samples(c)) for c in cands], timeout_sec, workers)
+    bad = [i for i, r in enumerate(first) if _unsafe(r, ban_warning)]
+    if not bad:
+        return [dict(c, safety_screened=True) for c in cands], []
+
+    # 每个不安全候选给出改写方案 (结构改写优先, 字面量兜底), 一起送检
+    alts: List[Tuple[int, str]] = []
+    rewrites = [(i, rewrite_pattern(_nomal(cands[i]))) for i in bad]
+    rewrites = [(i, rw) for i, rw in rewrites if rw != _nomal(cands[i])]
+    agree = rewrites_agree([(_nomal(cands[i]), rw, _samples(cands[i])) for i, rw in rewrites], timeout_sec, workers)
+    structural = {i: rw for (i, rw), ok in zip(rewrites, agree) if ok}
+    for i in bad:
+        if i in structural:
+            alts.append((i, structural[i]))
+        sample = (cands[i].get("sample_log") or "").strip()
+        if sample:
+            alts.append((i, _literal_from_sample(sample)))
+    alt_res = analyze_many([(expand(p), _samples(cands[i])) for i, p in alts], timeout_sec, workers)
+
+    chosen: Dict[int, str] = {}
+    for (i, p), r in zip(alts, alt_res):
+        if i not in chosen and not _unsafe(r, ban_warning):
+            chosen[i] = p
+
+    accepted, rejected = [], []
+    bad_set = set(bad)
+    for i, c in enumerate(cands):
+        if i not in bad_set:
+            accepted.append(dict(c, safety_screened=True))
+        elif i in chosen:
+            nc = dict(c, safety_screened=True)
+            nc["safety_rewrite"] = _nomal(c)
+            nc["pattern"] = nc["pattern_nomal"] = chosen[i]
+            if structural.get(i) != chosen[i]:
+                # 泛化模式换成了单条样本的字面量, 只能命中这一种日志, 显式标出便于事后复核
+                nc["source"] = "safety_literal"
+                logger.warning("不安全模板退为样本字面量: %s -> %s", nc["safety_rewrite"], chosen[i])
+            accepted.append(nc)
+        else:
+            item = replace(first[i]).to_dict()
+            item["pattern_nomal"] = _nomal(c)
+            rejected.append(item)
+            logger.warning("拒绝不安全模板: %s flags=%s timeout=%s",
+                           item["pattern_nomal"], item["static_flags"], item["dynamic_timeout"])
+    return accepted, rejected
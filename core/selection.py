@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+候选模板入库前的覆盖选择（贪心加权集合覆盖）
+- 每个候选在本文件 uniq 关键文本（权重为出现行数）与本轮样本上求命中集合
+- 已被活动模板命中的元素先剔除; 剩余命中为空的候选视为“已被活动模板覆盖”或“无命中”, 直接丢弃
+- 之后每次选“新增覆盖权重”最大的候选, 权重相同选命中更少(更具体)的, 直到没有候选能带来 min_gain 的新增覆盖
+LLM 对同一簇常给出多条互相重叠的模式, 只保留能覆盖样本的一小组, 避免索引膨胀拖慢每次未命中。
+"""
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from core.validation import Corpus, match_indices, required_literal
+
+
+class SelectionResult(NamedTuple):
+    selected: List[Dict[str, Any]]
+    covered_by_active: List[Dict[str, Any]]
+    redundant: List[Dict[str, Any]]
+    covered_weight: int
+
+
+def select_candidates(cands: List[Dict[str, Any]], corpus: Optional[Corpus], samples: Sequence[str] = (),
+                      active=None, min_gain: int = 1) -> SelectionResult:
+    """
+    cands: 候选字典 (取 pattern_nomal / pattern)
+    corpus: 本文件 uniq 关键文本语料 (Corpus, 权重为行数); 可为 None
+    samples: 本轮样本, 不在 corpus 中的按权重 1 加入全集
+    active: 当前活动索引 (CompiledIndex), 用于剔除已被覆盖的元素
+    """
+    corpus = corpus if corpus is not None else Corpus("empty", [])
+    known = set(corpus.texts) if samples else set()
+    extra = Corpus("samples", [s for s in dict.fromkeys(samples) if s not in known])
+
+    def _text(e: Tuple[int, int]) -> str:
+        return corpus.texts[e[1]] if e[0] == 0 else extra.texts[e[1]]
+
+    def _weight(e: Tuple[int, int]) -> int:
+        return int(corpus.weights[e[1]]) if e[0] == 0 else int(extra.weights[e[1]])
+
+    covers: List[Set[Tuple[int, int]]] = []
+    for c in cands:
+        p = (c.get("pattern_nomal") or c.get("pattern") or "").strip()
+        try:
+            creg = re.compile(p) if p else None
+        except re.error:
+            creg = None
+        if creg is None:
+            covers.append(set())
+            continue
+        lit = required_literal(p)
+        cov = {(0, i) for i in match_indices(creg, lit, corpus)}
+        cov |= {(1, i) for i in match_indices(creg, lit, extra)}
+        covers.append(cov)
+
+    # 剔除已被活动模板命中的元素
+    if active is not None:
+        universe = set().union(*covers) if covers else set()
+        already = {e for e in universe if active.match_one(_text(e)) is not None}
+    else:
+        already = set()
+
+    selected, by_active, redundant = [], [], []
+    remaining: Dict[int, Set[Tuple[int, int]]] = {}
+    for i, (c, cov) in enumerate(zip(cands, covers)):
+        left = cov - already
+        if not left:
+            (by_active if cov else redundant).append(c)
+        else:
+            remaining[i] = left
+
+    covered: Set[Tuple[int, int]] = set()
+    covered_weight = 0
+    while remaining:
+        best, best_gain, best_size = None, 0, 0
+        for i, left in remaining.items():
+            gain = sum(_weight(e) for e in left - covered)
+            size = len(covers[i])
+            if gain > best_gain or (gain == best_gain and best is not None and size < best_size):
+                best, best_gain, best_size = i, gain, size
+        if best is None or best_gain < max(1, int(min_gain)):
+            break
+        selected.append(cands[best])
+        covered |= remaining.pop(best)
+        covered_weight += best_gain
+    redundant.extend(cands[i] for i in sorted(remaining))
+    return SelectionResult(selected, by_active, redundant, covered_weight)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+慢匹配采集：匹配热路径上单次 search 超过阈值时记录 (template_id, 文本, 耗时)
+- 计时本身可抽样: sample_every=N 表示每 N 次未缓存匹配计时一次 (默认 100, 1 为全部计时)
+- 写入抽样: 同一模板在一次运行中最多记录 max_per_template 条, 之后按 1/after_cap_every 抽样
+- record 只追加内存缓冲, 从不在匹配线程里写库; 缓冲上限 max_buffer_rows, 超出的记录丢弃并计数
+- 批量写库: 调用方在匹配之外调用 maybe_flush (缓冲满 flush_rows 条才写) 或 flush/close,
+  通过 dao.batch_insert_slow_matches 一次写入; matcher.match_batch 在每批匹配结束后调用 maybe_flush
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from store import dao
+
+
+class SlowMatchRecorder:
+    def __init__(self, run_id: int, threshold_ms: float = 50.0, sample_every: int = 100,
+                 max_per_template: int = 20, after_cap_every: int = 100, flush_rows: int = 200,
+                 max_text_chars: int = 2000, max_buffer_rows: int = 5000):
+        self.run_id = run_id
+        self.threshold_s = float(threshold_ms) / 1000.0
+        self.sample_every = max(1, int(sample_every))
+        self.max_per_template = int(max_per_template)
+        self.after_cap_every = max(1, int(after_cap_every))
+        self.flush_rows = max(1, int(flush_rows))
+        self.max_text_chars = int(max_text_chars)
+        self.max_buffer_rows = max(self.flush_rows, int(max_buffer_rows))
+        self.seen = 0          # 超过阈值的次数 (含被抽样丢弃的)
+        self.recorded = 0
+        self.dropped = 0       # 缓冲已满、等不到 flush 而丢弃的记录
+        self._per_tid: Dict[int, int] = {}
+        self._buf: List[Tuple[int, int, str, float]] = []
+        self._lock = threading.Lock()
+
+    def record(self, template_id: int, text: str, duration_s: float) -> None:
+        """调用方已判断 duration_s >= threshold_s。"""
+        with self._lock:
+            self.seen += 1
+            n = self._per_tid.get(template_id, 0) + 1
+            self._per_tid[template_id] = n
+            if n > self.max_per_template and (n - self.max_per_template) % self.after_cap_every:
+                return
+            if len(self._buf) >= self.max_buffer_rows:
+                self.dropped += 1
+                return
+            self._buf.append((self.run_id, template_id, (text or "")[: self.max_text_chars], duration_s * 1000.0))
+            self.recorded += 1
+
+    def maybe_flush(self) -> None:
+        """缓冲满 flush_rows 条才写库; 供匹配批次之间调用。"""
+        with self._lock:
+            if len(self._buf) < self.flush_rows:
+                return
+            rows, self._buf = self._buf, []
+        dao.batch_insert_slow_matches(rows)
+
+    def flush(self) -> None:
+        with self._lock:
+            rows, self._buf = self._buf, []
+        if rows:
+            dao.batch_insert_slow_matches(rows)
+
+    def close(self) -> None:
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(seen=self.seen, recorded=self.recorded, dropped=self.dropped, templates=len(self._per_tid))
+
+
+def from_config(appcfg: Dict[str, Any], run_id: int) -> Optional[SlowMatchRecorder]:
+    """读取 application.yaml 顶层 slow_match 段; 关闭时返回 None。"""
+    c = (appcfg or {}).get("slow_match") or {}
+    if not c.get("enabled", True):
+        return None
+    return SlowMatchRecorder(
+        run_id,
+        threshold_ms=c.get("threshold_ms", 50),
+        sample_every=c.get("sample_every", 100),
+        max_per_template=c.get("max_per_template", 20),
+        after_cap_every=c.get("after_cap_every", 100),
+        flush_rows=c.get("flush_rows", 200),
+        max_text_chars=c.get("max_text_chars", 2000),
+        max_buffer_rows=c.get("max_buffer_rows", 5000),
+    )
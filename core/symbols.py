@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+单次运行内的符号表：把 mod / smod / level / thread_id 这类低基数字段编码为小整数。
+- 解析阶段编码，聚合与 uniq 构建直接以整数元组为键，避免重复字符串与 strip 开销
+- 编码 0 固定表示空串，便于沿用“空值即假”的判断
+- 仅在写库 / 写产物时解码回字符串
+"""
+from typing import Dict, List, Tuple
+
+FIELDS = ("mod", "smod", "level", "thread_id")
+
+
+class SymbolTable:
+    def __init__(self):
+        self._codes: Dict[str, Dict[str, int]] = {f: {"": 0} for f in FIELDS}
+        self._strings: Dict[str, List[str]] = {f: [""] for f in FIELDS}
+
+    def encode(self, field: str, s: str) -> int:
+        codes = self._codes[field]
+        code = codes.get(s)
+        if code is None:
+            stripped = s.strip()
+            code = codes.get(stripped)
+            if code is None:
+                strings = self._strings[field]
+                code = len(strings)
+                strings.append(stripped)
+                codes[stripped] = code
+            # 未 strip 的原文也记一份别名，下次直接命中
+            codes[s] = code
+        return code
+
+    def decode(self, field: str, code: int) -> str:
+        return self._strings[field][code]
+
+    def encode_dims(self, mod: str, smod: str, level: str, thread_id: str) -> Tuple[int, int, int, int]:
+        return (
+            self.encode("mod", mod or ""),
+            self.encode("smod", smod or ""),
+            self.encode("level", level or ""),
+            self.encode("thread_id", thread_id or ""),
+        )
+
+    def decode_dims(self, dims: Tuple[int, int, int, int]) -> Tuple[str, str, str, str]:
+        return (
+            self._strings["mod"][dims[0]],
+            self._strings["smod"][dims[1]],
+            self._strings["level"][dims[2]],
+            self._strings["thread_id"][dims[3]],
+        )
+
+    def size(self, field: str) -> int:
+        return len(self._strings[field])
+
+    def absorb(self, other: "SymbolTable") -> Dict[str, List[int]]:
+        """
+        把另一张表（如分片 worker 的表）的全部字符串编入本表，
+        返回 {字段: other 编码 -> 本表编码 的映射列表}，用于合并各自编码的部分聚合结果。
+        """
+        return {f: [self.encode(f, s) for s in other._strings[f]] for f in FIELDS}
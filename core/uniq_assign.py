@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+uniq 关键文本归属产物 (xx_uniq_assign.bin)
+- P1 结束前用最终的活动索引对全部 uniq 记录做最后一遍匹配, 按记录顺序写下每条的 template_id
+- 头部记录产物所属的 file_id、所基于的模板代数 (dao.get_template_generation) 与记录数 / 展开总行数,
+  P2 uniq 模式在 file_id、代数与产物都一致时直接按归属聚合, 否则回退重新匹配
+- 与 xx_uniq.bin / xx_uniq_with_count.tsv 同序 (均按归一化关键文本排序), 以下标对齐, 不重复存关键文本
+
+文件布局 (小端):
+  header : MAGIC(8) + version(u32) + pad(u32) + generation/n_rec/total_count (3 x u64) + file_id(32, ascii)
+  tid    : n_rec x i32   (未命中为 MISS)
+"""
+import os
+import struct
+from array import array
+from typing import Iterable, List, NamedTuple, Optional
+
+MAGIC = b"LAUQASN1"
+VERSION = 2
+MISS = -1
+_HEADER = struct.Struct("<8sII3Q32s")
+
+
+class UniqAssignment(NamedTuple):
+    file_id: str
+    generation: int
+    total_count: int
+    template_ids: List[Optional[int]]  # 与 uniq 记录同序, 未命中为 None
+
+
+def write_assignments(path: str, file_id: str, generation: int, total_count: int,
+                      template_ids: Iterable[Optional[int]]) -> int:
+    """先写临时文件再原子替换, 避免 P2 读到半截产物; 返回记录数。"""
+    tids = array("i", (MISS if t is None else int(t) for t in template_ids))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, 0, int(generation), len(tids), int(total_count),
+                             (file_id or "").encode("ascii")))
+        tids.tofile(f)
+    os.replace(tmp, path)
+    return len(tids)
+
+
+def read_assignments(path: str) -> Optional[UniqAssignment]:
+    """读取归属产物; 文件缺失、格式不符或长度不完整时返回 None。"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        head = f.read(_HEADER.size)
+        if len(head) < _HEADER.size:
+            return None
+        magic, version, _, generation, n_rec, total_count, file_id = _HEADER.unpack(head)
+        if magic != MAGIC or version != VERSION:
+            return None
+        tids = array("i")
+        data = f.read()
+        if len(data) != n_rec * tids.itemsize:
+            return None
+        tids.frombytes(data)
+    return UniqAssignment(file_id.rstrip(b"\0").decode("ascii", "replace"), generation, total_count,
+                          [None if t == MISS else t for t in tids])
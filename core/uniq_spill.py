@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+uniq 外排工具: 为 build_uniq_files 提供“溢写有序段 + k 路归并”能力
+- 内存中的关键文本计数超过阈值时, 按 key_text 排序后整段写入临时文件
+- 结束时对所有有序段做 k 路归并, 同一 key_text 的计数/时间范围/首见字段按段顺序合并, 分钟直方图逐分钟相加
+- 段文件为每行一个 JSON 数组 [key_text, info], 保证含制表符等特殊字符时也能无损往返
+"""
+import os
+import json
+import heapq
+from typing import Any, Dict, Iterator, List, Tuple
+
+from core.parser import TS_NONE
+
+# 首见字段: 先出现的非空值优先, 与单遍内存实现保持一致
+_FIRST_SEEN_FIELDS = ("mod", "smod", "level", "sample_log", "sample_log_orien")
+
+
+def merge_uniq_info(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    将 src 合并进 dst (dst 代表更早出现的部分):
+    - count 相加
+    - min_ts / max_ts 为整数秒, 取范围并集, TS_NONE 视为缺失
+    - 首见字段仅在 dst 为空时用 src 补齐
+    - hist ({分钟起点整数秒: 行数}) 逐分钟相加
+    """
+    dst["count"] = int(dst.get("count", 0) or 0) + int(src.get("count", 0) or 0)
+    s_min = src.get("min_ts", TS_NONE)
+    s_max = src.get("max_ts", TS_NONE)
+    if s_min != TS_NONE and (dst.get("min_ts", TS_NONE) == TS_NONE or s_min < dst["min_ts"]):
+        dst["min_ts"] = s_min
+    if s_max != TS_NONE and (dst.get("max_ts", TS_NONE) == TS_NONE or s_max > dst["max_ts"]):
+        dst["max_ts"] = s_max
+    for f in _FIRST_SEEN_FIELDS:
+        if not dst.get(f) and src.get(f):
+            dst[f] = src[f]
+    s_hist = src.get("hist")
+    if s_hist:
+        d_hist = dst.setdefault("hist", {})
+        for m, c in s_hist.items():
+            d_hist[m] = d_hist.get(m, 0) + c
+    return dst
+
+
+def write_sorted_run(counter: Dict[str, Dict[str, Any]], run_dir: str, run_no: int) -> str:
+    """将当前内存计数按 key_text 排序写成一个有序段文件, 返回段文件路径。"""
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, f"run_{run_no:05d}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for k in sorted(counter.keys()):
+            f.write(json.dumps([k, counter[k]], ensure_ascii=False) + "\n")
+    return path
+
+
+def _iter_run(path: str, run_no: int) -> Iterator[Tuple[str, int, Dict[str, Any]]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            k, info = json.loads(line)
+            # JSON 对象键只能是字符串, 直方图的分钟键读回时还原为整数
+            if info.get("hist"):
+                info["hist"] = {int(m): c for m, c in info["hist"].items()}
+            # (key, 段序号, info): 同 key 时按段序号稳定排序, 不会比较到 info
+            yield k, run_no, info
+
+
+def iter_merged_runs(run_paths: List[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """对多个有序段做 k 路归并, 按 key_text 升序产出合并后的 (key_text, info)。"""
+    streams = [_iter_run(p, i) for i, p in enumerate(run_paths)]
+    cur_key = None
+    cur_info: Dict[str, Any] = {}
+    for k, _, info in heapq.merge(*streams):
+        if k == cur_key:
+            merge_uniq_info(cur_info, info)
+            continue
+        if cur_key is not None:
+            yield cur_key, cur_info
+        cur_key, cur_info = k, info
+    if cur_key is not None:
+        yield cur_key, cur_info
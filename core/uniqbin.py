@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+紧凑二进制 uniq 产物 (xx_uniq.bin)
+- 替代 xx_uniq_with_count.tsv 的文本往返: P1 写, P2 以 mmap 直接映射, 无需逐列切分解析
+- 关键文本与原始样本走字符串表; mod/smod/level 走字典编码; 计数与时间戳为 int64
+- TSV 仍可作为导出格式并存
+- v2 起每条记录附带稀疏的分钟直方图 (有日志的分钟 -> 行数), P2 uniq 模式据此直接得到时间分布
+
+文件布局 (小端, 所有段按 8 字节对齐):
+  header   : MAGIC(8) + version(u32) + pad(u32) + n_rec/n_str/n_dict/str_bytes/dict_bytes (5 x u64)
+             v2 追加 n_hist (u64)
+  count    : n_rec x i64
+  min_ts   : n_rec x i64      (parser.ts_to_epoch, 缺失为 TS_NONE)
+  max_ts   : n_rec x i64
+  key_idx  : n_rec x u32      (字符串表下标, 归一化关键文本)
+  raw_idx  : n_rec x u32      (字符串表下标, 原始关键文本样本)
+  mod/smod/level : n_rec x u32 (字典下标, 0 固定为空串)
+  str_off  : (n_str + 1) x u64, str_blob
+  dict_off : (n_dict + 1) x u64, dict_blob
+  hist_off : (n_rec + 1) x u64  (v2, 第 i 条记录的直方图为 [hist_off[i], hist_off[i+1]))
+  hist_min : n_hist x u32       (v2, 分钟序号 epoch // 60, 按升序)
+  hist_cnt : n_hist x u32       (v2, 该分钟的行数)
+"""
+import os
+import mmap
+import struct
+import shutil
+import tempfile
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from core.parser import TS_NONE, ts_to_epoch
+
+MAGIC = b"LAUQBIN1"
+VERSION = 2
+_HEADER_V1 = struct.Struct("<8sII5Q")
+_HEADER = struct.Struct("<8sII6Q")
+
+
+class UniqBinRecord(NamedTuple):
+    count: int
+    key_text_norm: str
+    key_text_raw: str
+    mod: str
+    smod: str
+    level: str
+    min_ts: int
+    max_ts: int
+    hist: Tuple[Tuple[int, int], ...] = ()  # ((分钟起点整数秒, 行数), ...)，v1 产物为空
+
+
+def _pad8(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+class UniqBinWriter:
+    """顺序追加记录, close 时一次性落盘; 字符串先写入临时文件, 避免在内存中常驻。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._count = array("q")
+        self._min_ts = array("q")
+        self._max_ts = array("q")
+        self._key_idx = array("I")
+        self._raw_idx = array("I")
+        self._dims = {"mod": array("I"), "smod": array("I"), "level": array("I")}
+        self._str_off = array("Q", [0])
+        self._hist_off = array("Q", [0])
+        self._hist_min = array("I")
+        self._hist_cnt = array("I")
+        self._dict: Dict[str, int] = {"": 0}
+        self._dict_list: List[str] = [""]
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self._blob = tempfile.TemporaryFile(dir=d)
+
+    def _add_str(self, s: str) -> int:
+        b = (s or "").encode("utf-8")
+        self._blob.write(b)
+        self._str_off.append(self._str_off[-1] + len(b))
+        return len(self._str_off) - 2
+
+    def _code(self, s: str) -> int:
+        s = s or ""
+        code = self._dict.get(s)
+        if code is None:
+            code = len(self._dict_list)
+            self._dict[s] = code
+            self._dict_list.append(s)
+        return code
+
+    def add(self, count: int, key_text_norm: str, key_text_raw: str,
+            mod: str, smod: str, level: str, min_ts, max_ts,
+            hist: Optional[Iterable[Tuple[int, int]]] = None) -> None:
+        """
+        min_ts / max_ts 可传整数秒或 "YYYYMMDD HHMMSS" 字符串。
+        hist: 可选的 (分钟起点整数秒, 行数) 序列，按分钟升序。
+        """
+        if isinstance(min_ts, str):
+            min_ts = ts_to_epoch(min_ts)
+        if isinstance(max_ts, str):
+            max_ts = ts_to_epoch(max_ts)
+        self._count.append(int(count))
+        self._min_ts.append(TS_NONE if min_ts is None else int(min_ts))
+        self._max_ts.append(TS_NONE if max_ts is None else int(max_ts))
+        ki = self._add_str(key_text_norm)
+        if not key_text_raw or key_text_raw == key_text_norm:
+            ri = ki
+        else:
+            ri = self._add_str(key_text_raw)
+        self._key_idx.append(ki)
+        self._raw_idx.append(ri)
+        self._dims["mod"].append(self._code(mod))
+        self._dims["smod"].append(self._code(smod))
+        self._dims["level"].append(self._code(level))
+        if hist:
+            for m, c in hist:
+                self._hist_min.append(m // 60)
+                self._hist_cnt.append(c)
+        self._hist_off.append(len(self._hist_min))
+
+    def close(self) -> None:
+        n_rec = len(self._count)
+        n_str = len(self._str_off) - 1
+        dict_off = array("Q", [0])
+        dict_blob = bytearray()
+        for s in self._dict_list:
+            dict_blob += s.encode("utf-8")
+            dict_off.append(len(dict_blob))
+        str_bytes = self._str_off[-1]
+
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, VERSION, 0, n_rec, n_str, len(self._dict_list), str_bytes, len(dict_blob),
+                                     len(self._hist_min)))
+                for arr in (self._count, self._min_ts, self._max_ts, self._key_idx, self._raw_idx,
+                            self._dims["mod"], self._dims["smod"], self._dims["level"], self._str_off):
+                    b = arr.tobytes()
+                    f.write(b)
+                    f.write(b"\0" * _pad8(len(b)))
+                self._blob.seek(0)
+                shutil.copyfileobj(self._blob, f)
+                f.write(b"\0" * _pad8(str_bytes))
+                f.write(dict_off.tobytes())
+                f.write(bytes(dict_blob))
+                f.write(b"\0" * _pad8(len(dict_blob)))
+                for arr in (self._hist_off, self._hist_min, self._hist_cnt):
+                    b = arr.tobytes()
+                    f.write(b)
+                    f.write(b"\0" * _pad8(len(b)))
+            os.replace(tmp_path, self.path)
+        finally:
+            # 写入失败 (磁盘满等) 时不留下半截的 .tmp
+            self.discard()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def discard(self) -> None:
+        """放弃写出, 释放字符串暂存文件; close 之后调用无副作用。"""
+        self._blob.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class UniqBinReader:
+    """
+    以 mmap 只读映射 xx_uniq.bin, 各数值段直接 cast 为 memoryview, 不做任何解析。
+    支持 len()、下标与切片访问, 可直接替代 P2 的记录列表。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        mv = memoryview(self._mm)
+        magic, version, _ = struct.unpack_from("<8sII", mv, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            self.close()
+            raise ValueError(f"不是可识别的 uniq 二进制产物: {path}")
+        if version == 1:
+            _, _, _, n_rec, n_str, n_dict, str_bytes, dict_bytes = _HEADER_V1.unpack_from(mv, 0)
+            n_hist, pos = 0, _HEADER_V1.size
+        else:
+            _, _, _, n_rec, n_str, n_dict, str_bytes, dict_bytes, n_hist = _HEADER.unpack_from(mv, 0)
+            pos = _HEADER.size
+        self.version = version
+        self._n = n_rec
+
+        def _take(fmt: str, n: int) -> memoryview:
+            nonlocal pos
+            size = n * struct.calcsize(fmt)
+            seg = mv[pos:pos + size].cast(fmt)
+            pos += size + _pad8(size)
+            return seg
+
+        self.counts = _take("q", n_rec)
+        self.min_ts = _take("q", n_rec)
+        self.max_ts = _take("q", n_rec)
+        self._key_idx = _take("I", n_rec)
+        self._raw_idx = _take("I", n_rec)
+        self._mod = _take("I", n_rec)
+        self._smod = _take("I", n_rec)
+        self._level = _take("I", n_rec)
+        self._str_off = _take("Q", n_str + 1)
+        self._str_blob = mv[pos:pos + str_bytes]
+        pos += str_bytes + _pad8(str_bytes)
+        dict_off = _take("Q", n_dict + 1)
+        dict_blob = mv[pos:pos + dict_bytes]
+        pos += dict_bytes + _pad8(dict_bytes)
+        # 字典很小 (数百级), 一次性解码即可
+        self.dims: List[str] = [
+            bytes(dict_blob[dict_off[i]:dict_off[i + 1]]).decode("utf-8") for i in range(n_dict)
+        ]
+        if version >= 2:
+            self._hist_off = _take("Q", n_rec + 1)
+            self._hist_min = _take("I", n_hist)
+            self._hist_cnt = _take("I", n_hist)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def string(self, idx: int) -> str:
+        return bytes(self._str_blob[self._str_off[idx]:self._str_off[idx + 1]]).decode("utf-8")
+
+    def key_text(self, i: int) -> str:
+        return self.string(self._key_idx[i])
+
+    def key_text_raw(self, i: int) -> str:
+        ri = self._raw_idx[i]
+        return self.key_text(i) if ri == self._key_idx[i] else self.string(ri)
+
+    def hist(self, i: int) -> Tuple[Tuple[int, int], ...]:
+        """第 i 条记录的分钟直方图 ((分钟起点整数秒, 行数), ...)；v1 产物返回空元组。"""
+        if self.version < 2:
+            return ()
+        a, b = self._hist_off[i], self._hist_off[i + 1]
+        return tuple(zip((m * 60 for m in self._hist_min[a:b]), self._hist_cnt[a:b]))
+
+    def record(self, i: int) -> UniqBinRecord:
+        ki = self._key_idx[i]
+        ri = self._raw_idx[i]
+        key = self.string(ki)
+        return UniqBinRecord(
+            count=self.counts[i],
+            key_text_norm=key,
+            key_text_raw=key if ri == ki else self.string(ri),
+            mod=self.dims[self._mod[i]],
+            smod=self.dims[self._smod[i]],
+            level=self.dims[self._level[i]],
+            min_ts=self.min_ts[i],
+            max_ts=self.max_ts[i],
+            hist=self.hist(i),
+        )
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.record(j) for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        return self.record(i)
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self.record(i)
+
+    def total_count(self) -> int:
+        return sum(self.counts)
+
+    def close(self) -> None:
+        for name in ("counts", "min_ts", "max_ts", "_key_idx", "_raw_idx", "_mod", "_smod",
+                     "_level", "_str_off", "_str_blob", "_hist_off", "_hist_min", "_hist_cnt"):
+            seg = self.__dict__.pop(name, None)
+            if seg is not None:
+                seg.release()
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
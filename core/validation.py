@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+候选模板批量校验引擎（对抗 / 回归检查）
+- 一批候选只编译一次; 每个候选从正则中抽取“必含字面量”, 先在整段语料 blob 上用 str.find 定位候选行,
+  只对包含字面量的少数行跑正则, 大部分语料不进入 Python 层循环
+- 工作量大时按候选分块交给进程池, 语料在进程初始化时下发一次
+- 语料:
+    negatives 历史未命中 key_text (对抗: 命中即视为误报)
+    recent    最近若干文件 uniq 产物中的关键文本, 按出现次数加权 (过度泛化检查)
+    history   现有模板的 sample_log (回归: 命中说明与已有模板重叠)
+- 过度泛化看命中的近期“不同关键文本”数量与占比, 而不是流量权重: 只覆盖一条高频日志的正确模板不算泛化
+- 重叠率按候选自身的命中计算: 命中的 (已有模板样本 + 本轮样本) 中属于已有模板样本的比例
+- 输出每个候选的误报率、近期流量覆盖率、近期关键文本命中数 / 占比、重叠率以及对本轮样本的覆盖率
+"""
+import bisect
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import re._parser as _sre_parse  # Python 3.11+
+except Exception:  # pragma: no cover
+    import sre_parse as _sre_parse
+
+from store import dao
+
+
+class Corpus:
+    """一份校验语料: 文本与对应权重 (默认每条 1), 以及用于字面量预筛的拼接 blob。"""
+
+    def __init__(self, name: str, texts: Sequence[str], weights: Optional[Sequence[int]] = None):
+        self.name = name
+        self.texts = [t for t in texts]
+        self.weights = list(weights) if weights is not None else [1] * len(self.texts)
+        self.total_weight = sum(self.weights)
+        self.blob = "\n".join(self.texts)
+        self.starts: List[int] = []
+        pos = 0
+        for t in self.texts:
+            self.starts.append(pos)
+            pos += len(t) + 1
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def lines_containing(self, lit: str) -> List[int]:
+        """返回包含字面量 lit 的行下标 (升序去重)。"""
+        out: List[int] = []
+        blob, starts = self.blob, self.starts
+        i = blob.find(lit)
+        while i != -1:
+            ln = bisect.bisect_right(starts, i) - 1
+            out.append(ln)
+            # 跳到下一行开头继续找, 同一行只记一次
+            nxt = starts[ln + 1] if ln + 1 < len(starts) else len(blob)
+            i = blob.find(lit, nxt)
+        return out
+
+
+class ValidationReport(NamedTuple):
+    pattern: str
+    passed: bool
+    reason: str
+    neg_hits: int
+    fp_rate: float
+    recent_coverage: float
+    overlap_rate: float
+    target_coverage: float
+    literal: str
+    recent_keys: int
+    recent_key_share: float
+
+
+def required_literal(pattern: str) -> str:
+    """
+    抽取正则顶层连续字面量中最长的一段, 作为“必含”预筛串; 忽略大小写、顶层分支等无法保证的情况返回空串。
+    """
+    try:
+        parsed = _sre_parse.parse(pattern)
+    except Exception:
+        return ""
+    if parsed.state.flags & re.IGNORECASE:
+        return ""
+    best, cur = "", []
+    for op, av in parsed:
+        name = str(op)
+        if name == "LITERAL":
+            cur.append(chr(av))
+            continue
+        if name == "AT":
+            # ^ $ \b 等零宽断言不打断字面量
+            continue
+        if len("".join(cur)) > len(best):
+            best = "".join(cur)
+        cur = []
+    if len("".join(cur)) > len(best):
+        best = "".join(cur)
+    return best
+
+
+def match_indices(creg, lit: str, corpus: Corpus) -> List[int]:
+    """返回语料中被 creg 命中的行下标; lit 非空时只在包含该字面量的行上跑正则。"""
+    if not len(corpus):
+        return []
+    idxs = corpus.lines_containing(lit) if lit else range(len(corpus))
+    texts = corpus.texts
+    return [i for i in idxs if creg.search(texts[i])]
+
+
+def _count_hits(creg, lit: str, corpus: Corpus) -> Tuple[int, int]:
+    """返回 (命中行数, 命中权重)。"""
+    hits = match_indices(creg, lit, corpus)
+    weights = corpus.weights
+    return len(hits), sum(weights[i] for i in hits)
+
+
+# ------------------------------ 进程池 worker ------------------------------
+_W_CORPORA: Dict[str, Corpus] = {}
+
+
+def _worker_init(corpora: Dict[str, Corpus]) -> None:
+    global _W_CORPORA
+    _W_CORPORA = corpora
+
+
+def _eval_patterns(patterns: List[str], corpora: Optional[Dict[str, Corpus]] = None) -> List[Dict[str, Any]]:
+    corpora = corpora if corpora is not None else _W_CORPORA
+    out = []
+    for p in patterns:
+        try:
+            creg = re.compile(p)
+        except re.error as e:
+            out.append(dict(error=str(e)))
+            continue
+        lit = required_literal(p)
+        row: Dict[str, Any] = dict(literal=lit)
+        for name, corpus in corpora.items():
+            row[name] = _count_hits(creg, lit, corpus)
+        out.append(row)
+    return out
+
+
+class ValidationEngine:
+    def __init__(self, negatives: Corpus, recent: Corpus, history: Corpus, workers: int = 0,
+                 parallel_min_work: int = 2_000_000, max_fp_rate: float = 0.0,
+                 max_recent_key_share: float = 0.3, min_general_keys: int = 20,
+                 max_overlap_rate: float = 0.2, min_target_coverage: float = 0.0):
+        self.corpora = {"negatives": negatives, "recent": recent, "history": history}
+        self.workers = int(workers) if workers else (os.cpu_count() or 1)
+        self.parallel_min_work = int(parallel_min_work)
+        self.max_fp_rate = float(max_fp_rate)
+        self.max_recent_key_share = float(max_recent_key_share)
+        self.min_general_keys = int(min_general_keys)
+        self.max_overlap_rate = float(max_overlap_rate)
+        self.min_target_coverage = float(min_target_coverage)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _evaluate(self, patterns: List[str]) -> List[Dict[str, Any]]:
+        corpus_size = sum(len(c.blob) for c in self.corpora.values())
+        if self.workers <= 1 or len(patterns) < 2 or corpus_size * len(patterns) < self.parallel_min_work:
+            return _eval_patterns(patterns, self.corpora)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_worker_init,
+                                             initargs=(self.corpora,))
+        n = min(self.workers, len(patterns))
+        chunks = [patterns[i::n] for i in range(n)]
+        results = list(self._pool.map(_eval_patterns, chunks))
+        # 还原 i::n 交错分块的原始顺序
+        out: List[Optional[Dict[str, Any]]] = [None] * len(patterns)
+        for ci, chunk_res in enumerate(results):
+            for j, r in enumerate(chunk_res):
+                out[ci + j * n] = r
+        return out  # type: ignore[return-value]
+
+    def validate(self, cands: List[Dict[str, Any]], targets: Sequence[str] = ()) -> List[ValidationReport]:
+        """
+        cands: 候选字典 (取 pattern_nomal / pattern); targets: 本轮送委员会的样本,
+        候选至少要覆盖 min_target_coverage 比例 (为 0 时至少命中一条或自身 sample_log)。
+        命中的近期关键文本不少于 min_general_keys 条且占比超过 max_recent_key_share 时视为过度泛化。
+        """
+        patterns = [(c.get("pattern_nomal") or c.get("pattern") or "").strip() for c in cands]
+        rows = self._evaluate(patterns)
+        neg, recent, hist = self.corpora["negatives"], self.corpora["recent"], self.corpora["history"]
+        target_corpus = Corpus("targets", list(targets))
+        reports = []
+        for c, p, row in zip(cands, patterns, rows):
+            if not p or "error" in row:
+                reports.append(ValidationReport(p, False, f"compile_error: {row.get('error', 'empty')}",
+                                                0, 0.0, 0.0, 0.0, 0.0, "", 0, 0.0))
+                continue
+            creg = re.compile(p)
+            lit = row["literal"]
+            neg_n, _ = row["negatives"]
+            rec_n, rec_w = row["recent"]
+            hist_n, _ = row["history"]
+            tgt_n, _ = _count_hits(creg, lit, target_corpus)
+            fp_rate = neg_n / len(neg) if len(neg) else 0.0
+            rec_cov = rec_w / recent.total_weight if recent.total_weight else 0.0
+            rec_share = rec_n / len(recent) if len(recent) else 0.0
+            overlap = hist_n / (hist_n + tgt_n) if hist_n else 0.0
+            tgt_cov = tgt_n / len(target_corpus) if len(target_corpus) else 0.0
+
+            reason = ""
+            if fp_rate > self.max_fp_rate:
+                reason = "adversary_fp"
+            elif rec_n >= self.min_general_keys and rec_share > self.max_recent_key_share:
+                reason = "too_general"
+            elif overlap > self.max_overlap_rate:
+                reason = "overlap_existing"
+            elif self.min_target_coverage > 0 and tgt_cov < self.min_target_coverage:
+                reason = "low_target_coverage"
+            elif self.min_target_coverage <= 0 and tgt_n == 0 and not creg.search(c.get("sample_log") or ""):
+                reason = "matches_nothing"
+            reports.append(ValidationReport(p, not reason, reason, neg_n, fp_rate, rec_cov, overlap, tgt_cov, lit,
+                                            rec_n, rec_share))
+        return reports
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# ------------------------------ 语料加载 ------------------------------
+def _uniq_artifacts(raw_path: str) -> Tuple[str, str]:
+    """与 P1 的产物命名一致: xx.log(.gz) -> xx.normal_uniq.bin / xx.normal_uniq_with_count.tsv。"""
+    if raw_path.endswith(".gz"):
+        base = raw_path[:-3]
+    else:
+        base, _ = os.path.splitext(raw_path)
+    base = (base or raw_path) + ".normal"
+    return base + "_uniq.bin", base + "_uniq_with_count.tsv"
+
+
+def load_recent_uniq_keys(paths: Sequence[str], max_keys: int = 200000) -> Corpus:
+    """合并最近文件的 uniq 关键文本与计数; 优先读二进制产物, 其次 TSV, 找不到的文件跳过。"""
+    counts: Dict[str, int] = {}
+    for p in paths:
+        bin_path, tsv_path = _uniq_artifacts(p)
+        try:
+            if os.path.exists(bin_path):
+                from core.uniqbin import UniqBinReader
+                with UniqBinReader(bin_path) as r:
+                    for i in range(len(r)):
+                        k = r.key_text(i)
+                        counts[k] = counts.get(k, 0) + int(r.counts[i])
+            elif os.path.exists(tsv_path):
+                with open(tsv_path, "r", encoding="utf-8", errors="ignore") as f:
+                    for ln in f:
+                        parts = ln.rstrip("\n").split("\t")
+                        if len(parts) >= 2 and parts[0].isdigit():
+                            counts[parts[1]] = counts.get(parts[1], 0) + int(parts[0])
+        except Exception:
+            continue
+    items = sorted(counts.items(), key=lambda kv: kv[1], reverse=True)[:max_keys]
+    return Corpus("recent", [k for k, _ in items], [c for _, c in items])
+
+
+_CORPUS_CACHE: Dict[Any, Tuple[float, Tuple[Corpus, Corpus, Corpus]]] = {}
+_CORPUS_LOCK = threading.Lock()
+
+
+def load_corpora(unmatched_limit: int = 20000, files_lookback: int = 10, recent_max_keys: int = 200000,
+                 history_limit: int = 20000, ttl_s: float = 300.0) -> Tuple[Corpus, Corpus, Corpus]:
+    """从数据库与 uniq 产物装载三份语料, 按参数缓存 ttl_s 秒, 避免每轮委员会都重新读盘。"""
+    key = (unmatched_limit, files_lookback, recent_max_keys, history_limit)
+    now = time.monotonic()
+    with _CORPUS_LOCK:
+        hit = _CORPUS_CACHE.get(key)
+        if hit is not None and now - hit[0] < ttl_s:
+            return hit[1]
+    negatives = Corpus("negatives", dao.get_recent_unmatched(limit=unmatched_limit))
+    recent = load_recent_uniq_keys(dao.get_recent_file_paths(limit=files_lookback), max_keys=recent_max_keys)
+    history = Corpus("history", dao.get_template_samples(limit=history_limit))
+    corpora = (negatives, recent, history)
+    with _CORPUS_LOCK:
+        _CORPUS_CACHE[key] = (now, corpora)
+    return corpora
+
+
+def invalidate_corpora() -> None:
+    """新模板写库后 history 语料已过期, 调用方可主动清缓存。"""
+    with _CORPUS_LOCK:
+        _CORPUS_CACHE.clear()
@@ -14,6 +14,9 @@ from datetime import datetime
 from typing import List, Dict, Any, Iterable, Tuple
 
 DEFAULT_DB = os.environ.get("LOG_ANALYZER_DB", "./data/log_analyzer.sqlite3")
+# 入库准入: 写模板前做正则安全检测 (静态 + 限时压测), 设为 0 可关闭
+SAFETY_GATE = os.environ.get("LOG_ANALYZER_SAFETY_GATE", "1") != "0"
+SAFETY_TIMEOUT_SEC = float(os.environ.get("LOG_ANALYZER_SAFETY_TIMEOUT", "0.1"))
 
 # 统一的数字正则，用于替换 NUMNUM 占位符
 NUMERIC_PATTERN = r'[-+]?(?:\d+.\d*|.\d+|\d+)'
@@ -36,9 +39,17 @@ def init_db(db_path: str = DEFAULT_DB, schema_path: str = None):
     with _connect(db_path) as conn:
         with open(schema_path, "r", encoding="utf-8") as f:
             conn.executescript(f.read())
+        _ensure_column(conn, "key_text_dict", "attempts", "INTEGER DEFAULT 0")
         conn.commit()
 
 
+def _ensure_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    """旧库补列: CREATE TABLE IF NOT EXISTS 不会给已存在的表加新列。"""
+    cols = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if cols and column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
 def register_file(file_id: str, path: str, sha256: str = "", size_bytes: int = 0, gz_mtime: str = ""):
     now = datetime.utcnow().isoformat()
     with _connect() as conn:
@@ -119,7 +130,7 @@ def fetch_all_templates(active_only: bool = True) -> List[sqlite3.Row]:
         return cur.fetchall()
 
 
-def write_templates(cands: List[Dict[str, Any]]) -> List[int]:
+def write_templates(cands: List[Dict[str, Any]], safety_gate: bool = None) -> List[int]:
     """
     将候选模板写入 regex_template / template_history。
 
@@ -129,9 +140,18 @@ def write_templates(cands: List[Dict[str, Any]]) -> List[int]:
         * regex_template.pattern_nomal 保存原始模式
         * regex_template.pattern 将其中的 NUMNUM 统一替换为 NUMERIC_PATTERN
     - 按 pattern_nomal 做去重，避免插入重复正则
+    - 写库前过正则安全准入 (core.regex_safety.screen_candidates)：
+      有灾难回溯风险的模式先尝试改写，改写不了的拒绝（由准入记日志），不会进入 CompiledIndex；
+      已在上游（委员会安全准入）检测过的候选带 safety_screened=True，不再重复检测
     """
     if not cands:
         return []
+    if SAFETY_GATE if safety_gate is None else safety_gate:
+        from core import regex_safety
+        todo = [c for c in cands if not c.get("safety_screened")]
+        if todo:
+            screened, _ = regex_safety.screen_candidates(todo, timeout_sec=SAFETY_TIMEOUT_SEC)
+            cands = [c for c in cands if c.get("safety_screened")] + screened
 
     ids: List[int] = []
     now = datetime.utcnow().isoformat()
@@ -172,6 +192,8 @@ def write_templates(cands: List[Dict[str, Any]]) -> List[int]:
             )
             tid = cur.lastrowid
             ids.append(tid)
+            if cur.rowcount:
+                _log_template_change(conn, tid, "add", now)
 
             # 历史表：保留真实 pattern，后续如需要也可以扩展 pattern_nomal 字段
             # conn.execute(
@@ -201,104 +223,414 @@ def write_unmatched(run_id: int, file_id: str, key_text: str, raw_log: str, reas
 def batch_upsert_log_match_summary(rows: List[Dict[str, Any]]):
     if not rows:
         return
-    now = datetime.utcnow().isoformat()
     with _connect() as conn:
-        for r in rows:
-            conn.execute(
-                """
-                INSERT INTO log_match_summary(
-                    run_id,
-                    file_id,
-                    template_id,
-                    mod,
-                    smod,
-                    classification,
-                    level,
-                    thread_id,
-                    first_ts,
-                    last_ts,
-                    line_count,
-                    updated_at
-                )
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    r["run_id"],
-                    r["file_id"],
-                    r["template_id"],
-                    r.get("mod", "") or "",
-                    r.get("smod", "") or "",
-                    r.get("classification", "") or "",
-                    r.get("level", "") or "",
-                    r.get("thread_id", "") or "",
-                    r.get("first_ts", "") or "",
-                    r.get("last_ts", "") or "",
-                    int(r.get("line_count", 0) or 0),
-                    now,
-                ),
+        _insert_log_match_summary(conn, rows)
+        conn.commit()
+
+
+def _insert_log_match_summary(conn: sqlite3.Connection, rows: List[Dict[str, Any]]) -> None:
+    now = datetime.utcnow().isoformat()
+    for r in rows:
+        conn.execute(
+            """
+            INSERT INTO log_match_summary(
+                run_id,
+                file_id,
+                template_id,
+                mod,
+                smod,
+                classification,
+                level,
+                thread_id,
+                first_ts,
+                last_ts,
+                line_count,
+                updated_at
             )
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                r["run_id"],
+                r["file_id"],
+                r["template_id"],
+                r.get("mod", "") or "",
+                r.get("smod", "") or "",
+                r.get("classification", "") or "",
+                r.get("level", "") or "",
+                r.get("thread_id", "") or "",
+                r.get("first_ts", "") or "",
+                r.get("last_ts", "") or "",
+                int(r.get("line_count", 0) or 0),
+                now,
+            ),
+        )
+
+
+def _delete_by_file(table: str, file_id: str, template_ids: Iterable[int] = None) -> None:
+    if not file_id:
+        return
+    with _connect() as conn:
+        _delete_by_file_in(conn, table, file_id, template_ids)
         conn.commit()
 
 
-def delete_log_match_summary_by_file(file_id: str) -> None:
+def _delete_by_file_in(conn: sqlite3.Connection, table: str, file_id: str, template_ids: Iterable[int] = None) -> None:
+    if template_ids is None:
+        conn.execute(f"DELETE FROM {table} WHERE file_id=?", (file_id,))
+    else:
+        conn.executemany(
+            f"DELETE FROM {table} WHERE file_id=? AND template_id=?",
+            [(file_id, int(t)) for t in template_ids],
+        )
+
+
+def delete_log_match_summary_by_file(file_id: str, template_ids: Iterable[int] = None) -> None:
     """
-    清空指定 file_id 之前的 log_match_summary 记录，避免重复统计。
+    清空指定 file_id 之前的 log_match_summary 记录，避免重复统计；
+    传 template_ids 时只清这些模板的行（增量重跑只重算受影响的模板）。
     """
-    if not file_id:
+    _delete_by_file("log_match_summary", file_id, template_ids)
+def batch_upsert_key_time_bucket(rows: List[Dict[str, Any]]):
+    """
+    时间桶计数累加写入：同一 (run, file, 模板, 维度, 粒度, 桶起点) 已存在时 count_in_bucket 相加，
+    调用方可以分多次 flush 部分计数。
+    """
+    if not rows:
         return
     with _connect() as conn:
-        conn.execute(
-            "DELETE FROM log_match_summary WHERE file_id=?",
-            (file_id,),
+        _upsert_key_time_bucket(conn, rows)
+        conn.commit()
+
+
+def _upsert_key_time_bucket(conn: sqlite3.Connection, rows: List[Dict[str, Any]]) -> None:
+    now = datetime.utcnow().isoformat()
+    conn.executemany(
+        """
+        INSERT INTO key_time_bucket(
+            run_id,
+            file_id,
+            template_id,
+            mod,
+            smod,
+            classification,
+            level,
+            thread_id,
+            bucket_granularity,
+            bucket_start,
+            count_in_bucket,
+            updated_at
         )
+        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(run_id, file_id, template_id, mod, smod, classification, level, thread_id,
+                    bucket_granularity, bucket_start)
+        DO UPDATE SET count_in_bucket = count_in_bucket + excluded.count_in_bucket,
+                      updated_at = excluded.updated_at
+        """,
+        [
+            (
+                r["run_id"],
+                r["file_id"],
+                r["template_id"],
+                r.get("mod", "") or "",
+                r.get("smod", "") or "",
+                r.get("classification", "") or "",
+                r.get("level", "") or "",
+                r.get("thread_id", "") or "",
+                r.get("bucket_granularity", "") or "",
+                r.get("bucket_start", "") or "",
+                int(r.get("count_in_bucket", 0) or 0),
+                now,
+            )
+            for r in rows
+        ],
+    )
+
+
+def delete_key_time_bucket_by_file(file_id: str, template_ids: Iterable[int] = None) -> None:
+    """
+    清空指定 file_id 之前的 key_time_bucket 记录，与 delete_log_match_summary_by_file 配合用于重跑。
+    """
+    _delete_by_file("key_time_bucket", file_id, template_ids)
+
+
+# ---------------- 模板代数与 P2 增量状态 ----------------
+def _log_template_change(conn: sqlite3.Connection, template_id: int, change: str, at: str) -> None:
+    conn.execute(
+        "INSERT INTO template_change(template_id, change, changed_at) VALUES(?, ?, ?)",
+        (template_id, change, at),
+    )
+
+
+def get_template_generation() -> int:
+    """当前模板集合的代数：模板每新增 / 停用一次加一，未记录过变更时为 0。"""
+    with _connect() as conn:
+        row = conn.execute("SELECT COALESCE(MAX(generation), 0) FROM template_change").fetchone()
+        return int(row[0])
+
+
+def get_template_changes(since_generation: int) -> Dict[str, List[int]]:
+    """返回代数 since_generation 之后的变更 {"add": [...], "deactivate": [...]}。"""
+    out: Dict[str, List[int]] = {"add": [], "deactivate": []}
+    with _connect() as conn:
+        for r in conn.execute(
+            "SELECT template_id, change FROM template_change WHERE generation > ? ORDER BY generation",
+            (int(since_generation),),
+        ):
+            out.setdefault(r["change"], []).append(int(r["template_id"]))
+    return out
+
+
+def get_p2_file_state(file_id: str):
+    with _connect() as conn:
+        return conn.execute(
+            "SELECT file_id, generation, source_sig, run_id, updated_at FROM p2_file_state WHERE file_id=?",
+            (file_id,),
+        ).fetchone()
+
+
+def upsert_p2_file_state(file_id: str, generation: int, source_sig: str, run_id: int) -> None:
+    with _connect() as conn:
+        _upsert_p2_file_state(conn, file_id, generation, source_sig, run_id)
         conn.commit()
-def batch_upsert_key_time_bucket(rows: List[Dict[str, Any]]):
+
+
+def _upsert_p2_file_state(conn: sqlite3.Connection, file_id: str, generation: int, source_sig: str,
+                          run_id: int) -> None:
+    conn.execute(
+        """
+        INSERT INTO p2_file_state(file_id, generation, source_sig, run_id, updated_at)
+        VALUES(?, ?, ?, ?, ?)
+        ON CONFLICT(file_id) DO UPDATE SET generation=excluded.generation, source_sig=excluded.source_sig,
+            run_id=excluded.run_id, updated_at=excluded.updated_at
+        """,
+        (file_id, int(generation), source_sig or "", run_id, datetime.utcnow().isoformat()),
+    )
+
+
+def get_p2_key_assignments(file_id: str) -> Dict[str, Any]:
+    """{key_text: template_id 或 None}"""
+    with _connect() as conn:
+        return {
+            r[0]: r[1]
+            for r in conn.execute("SELECT key_text, template_id FROM p2_key_assignment WHERE file_id=?", (file_id,))
+        }
+
+
+def upsert_p2_key_assignments(file_id: str, rows: Iterable[Tuple[str, Any]]) -> None:
+    """rows: (key_text, template_id 或 None)"""
+    with _connect() as conn:
+        _upsert_p2_key_assignments(conn, file_id, rows)
+        conn.commit()
+
+
+def _upsert_p2_key_assignments(conn: sqlite3.Connection, file_id: str, rows: Iterable[Tuple[str, Any]]) -> None:
+    conn.executemany(
+        """
+        INSERT INTO p2_key_assignment(file_id, key_text, template_id) VALUES(?, ?, ?)
+        ON CONFLICT(file_id, key_text) DO UPDATE SET template_id=excluded.template_id
+        """,
+        [(file_id, k, t) for k, t in rows],
+    )
+
+
+def commit_p2_results(file_id: str, summary_rows: List[Dict[str, Any]], bucket_rows: Iterable[Dict[str, Any]],
+                      assignments: Iterable[Tuple[str, Any]] = None, state: Tuple[int, str, int] = None,
+                      template_ids: Iterable[int] = None, chunk_size: int = 5000) -> None:
+    """
+    P2 结束时的单个事务：先删旧的 summary / 时间桶（传 template_ids 时只删这些模板，增量重跑；
+    为 None 时整文件替换，同时清空逐关键文本匹配结果），再写 summary 与时间桶
+    （bucket_rows 可为迭代器，按 chunk_size 分块累加 upsert），最后写逐关键文本匹配结果与文件状态
+    state = (generation, source_sig, run_id)；任一步失败整体回滚，中断时旧结果与旧文件状态原样保留。
+    """
+    with _connect() as conn:
+        if template_ids is None:
+            conn.execute("DELETE FROM p2_key_assignment WHERE file_id=?", (file_id,))
+        else:
+            template_ids = list(template_ids)
+        _delete_by_file_in(conn, "log_match_summary", file_id, template_ids)
+        _delete_by_file_in(conn, "key_time_bucket", file_id, template_ids)
+        if summary_rows:
+            _insert_log_match_summary(conn, summary_rows)
+        chunk: List[Dict[str, Any]] = []
+        for row in bucket_rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                _upsert_key_time_bucket(conn, chunk)
+                chunk = []
+        if chunk:
+            _upsert_key_time_bucket(conn, chunk)
+        if assignments is not None:
+            _upsert_p2_key_assignments(conn, file_id, assignments)
+        if state is not None:
+            _upsert_p2_file_state(conn, file_id, *state)
+        conn.commit()
+
+
+def lookup_key_dict(keys: Iterable[str], chunk_size: int = 500) -> Dict[str, Tuple[Any, int]]:
+    """
+    批量查询全局关键文本字典。
+    返回 {key_text: (template_id, attempts)}，未收录的 key 不出现在结果中；template_id 可能为 None，
+    attempts 为该 key 送委员会的次数。
+    """
+    keys = [k for k in dict.fromkeys(keys) if k]
+    out: Dict[str, Any] = {}
+    if not keys:
+        return out
+    with _connect() as conn:
+        for i in range(0, len(keys), chunk_size):
+            part = keys[i : i + chunk_size]
+            cur = conn.execute(
+                f"SELECT key_text, template_id, attempts FROM key_text_dict WHERE key_text IN ({','.join('?' * len(part))})",
+                part,
+            )
+            for r in cur.fetchall():
+                out[r["key_text"]] = (r["template_id"], int(r["attempts"] or 0))
+    return out
+
+
+def upsert_key_dict(rows: Iterable[Tuple[str, Any]], file_id: str = "", attempted: bool = False) -> None:
+    """
+    写入全局关键文本字典，rows 为 (key_text, template_id)。
+    - 首次出现时记录 first_file_id / first_seen_at
+    - 已存在时以本次结果覆盖归属模板（包括归属模板失效后重新匹配为 None 的情况）
+    - attempted=True 表示这批 key 刚送过委员会，attempts 加一
+    """
+    inc = 1 if attempted else 0
+    upsert_key_dict_rows(((k, tid, inc) for k, tid in rows), file_id=file_id)
+
+
+def upsert_key_dict_rows(rows: Iterable[Tuple[str, Any, int]], file_id: str = "") -> None:
+    """
+    批量写入全局关键文本字典，rows 为 (key_text, template_id, 本次新增送审次数)，一个事务提交；
+    供调用方攒批后一次落库。
+    """
+    rows = [(k, tid, int(inc or 0)) for k, tid, inc in rows if k]
     if not rows:
         return
     now = datetime.utcnow().isoformat()
     with _connect() as conn:
-        for r in rows:
-            conn.execute(
-                """
-                INSERT INTO key_time_bucket(
-                    run_id,
-                    file_id,
-                    template_id,
-                    mod,
-                    smod,
-                    classification,
-                    level,
-                    thread_id,
-                    bucket_granularity,
-                    bucket_start,
-                    count_in_bucket,
-                    updated_at
-                )
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    r["run_id"],
-                    r["file_id"],
-                    r["template_id"],
-                    r.get("mod", "") or "",
-                    r.get("smod", "") or "",
-                    r.get("classification", "") or "",
-                    r.get("level", "") or "",
-                    r.get("thread_id", "") or "",
-                    r.get("bucket_granularity", "") or "",
-                    r.get("bucket_start", "") or "",
-                    int(r.get("count_in_bucket", 0) or 0),
-                    now,
-                ),
+        conn.executemany(
+            """
+            INSERT INTO key_text_dict(key_text, template_id, first_file_id, first_seen_at, updated_at, attempts)
+            VALUES(?, ?, ?, ?, ?, ?)
+            ON CONFLICT(key_text) DO UPDATE SET
+                template_id=excluded.template_id,
+                updated_at=excluded.updated_at,
+                attempts=COALESCE(key_text_dict.attempts, 0) + excluded.attempts
+            """,
+            [(k, tid, file_id, now, now, inc) for k, tid, inc in rows],
+        )
+        conn.commit()
+
+
+def get_safety_verdicts(keys: List[str], analyzer_version: str, chunk_size: int = 500) -> Dict[str, Dict[str, Any]]:
+    """按内容键批量读取正则安全结论, 只返回分析器版本一致的记录。"""
+    out: Dict[str, Dict[str, Any]] = {}
+    if not keys:
+        return out
+    with _connect() as conn:
+        for i in range(0, len(keys), chunk_size):
+            part = keys[i : i + chunk_size]
+            cur = conn.execute(
+                f"SELECT verdict_key, result_json FROM regex_safety_verdict "
+                f"WHERE analyzer_version=? AND verdict_key IN ({','.join('?' * len(part))})",
+                [analyzer_version] + part,
             )
+            for r in cur.fetchall():
+                out[r["verdict_key"]] = json.loads(r["result_json"])
+    return out
+
+
+def upsert_safety_verdicts(rows: Iterable[Tuple[str, Dict[str, Any]]], analyzer_version: str) -> None:
+    """rows 为 (verdict_key, RegexSafetyResult.to_dict())。"""
+    now = datetime.utcnow().isoformat()
+    data = [(k, analyzer_version, d.get("pattern"), d.get("level"), json.dumps(d, ensure_ascii=False), now)
+            for k, d in rows]
+    if not data:
+        return
+    with _connect() as conn:
+        conn.executemany(
+            """
+            INSERT INTO regex_safety_verdict(verdict_key, analyzer_version, pattern, level, result_json, checked_at)
+            VALUES(?, ?, ?, ?, ?, ?)
+            ON CONFLICT(verdict_key) DO UPDATE SET
+                analyzer_version=excluded.analyzer_version,
+                level=excluded.level,
+                result_json=excluded.result_json,
+                checked_at=excluded.checked_at
+            """,
+            data,
+        )
         conn.commit()
 
+
+def batch_insert_slow_matches(rows: Iterable[Tuple[int, int, str, float]]) -> None:
+    """rows 为 (run_id, template_id, text, duration_ms)。"""
+    now = datetime.utcnow().isoformat()
+    data = [(run_id, tid, text, float(ms), now) for run_id, tid, text, ms in rows]
+    if not data:
+        return
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT INTO slow_match(run_id, template_id, text, duration_ms, created_at) VALUES(?, ?, ?, ?, ?)",
+            data,
+        )
+        conn.commit()
+
+
+def get_slow_match_ranking(limit: int = 50, min_run_id: int = 0, min_hits: int = 1) -> List[sqlite3.Row]:
+    """按累计慢匹配耗时给模板排序, 附带模板当前模式、是否启用与最慢一次的文本。"""
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT s.template_id, COUNT(*) AS hits, SUM(s.duration_ms) AS total_ms,
+                   MAX(s.duration_ms) AS max_ms, AVG(s.duration_ms) AS avg_ms,
+                   COUNT(DISTINCT s.run_id) AS runs, MAX(s.created_at) AS last_seen,
+                   t.pattern, t.pattern_nomal, t.is_active,
+                   (SELECT x.text FROM slow_match x WHERE x.template_id = s.template_id
+                     ORDER BY x.duration_ms DESC LIMIT 1) AS slowest_text
+            FROM slow_match s LEFT JOIN regex_template t ON t.template_id = s.template_id
+            WHERE s.run_id >= ?
+            GROUP BY s.template_id
+            HAVING COUNT(*) >= ?
+            ORDER BY total_ms DESC
+            LIMIT ?
+            """,
+            (min_run_id, min_hits, limit),
+        )
+        return cur.fetchall()
+
+
+def get_slow_match_texts(template_ids: List[int], per_template: int = 3) -> Dict[int, List[str]]:
+    """每个模板耗时最长的若干条文本, 供安全扫描作为真实压测样本。"""
+    out: Dict[int, List[str]] = {}
+    if not template_ids:
+        return out
+    with _connect() as conn:
+        for tid in template_ids:
+            cur = conn.execute(
+                "SELECT DISTINCT text FROM slow_match WHERE template_id=? ORDER BY duration_ms DESC LIMIT ?",
+                (tid, per_template),
+            )
+            texts = [r["text"] for r in cur.fetchall() if r["text"]]
+            if texts:
+                out[tid] = texts
+    return out
+
+
 def get_recent_unmatched(limit: int = 200) -> List[str]:
     with _connect() as conn:
         cur = conn.execute("SELECT key_text FROM unmatched_log ORDER BY um_id DESC LIMIT ?", (limit,))
         return [r["key_text"] for r in cur.fetchall()]
 
 
+def get_recent_file_paths(limit: int = 10) -> List[str]:
+    """最近登记的若干文件路径, 按 ingested_at 倒序, 供校验引擎装载其 uniq 产物。"""
+    with _connect() as conn:
+        cur = conn.execute("SELECT path FROM file_registry ORDER BY ingested_at DESC LIMIT ?", (limit,))
+        return [r["path"] for r in cur.fetchall()]
+
+
 def get_template_samples(limit: int = 200) -> List[str]:
     with _connect() as conn:
         cur = conn.execute(
@@ -324,6 +656,8 @@ def deactivate_template(template_id: int) -> bool:
                 "UPDATE regex_template SET is_active = 0, updated_at = ? WHERE template_id = ? AND is_active = 1",
                 (datetime.utcnow().isoformat(), template_id)
             )
+            if cur.rowcount > 0:
+                _log_template_change(conn, template_id, "deactivate", datetime.utcnow().isoformat())
             conn.commit()
             return cur.rowcount > 0
     except Exception as e:
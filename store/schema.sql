@@ -116,4 +116,68 @@ CREATE TABLE IF NOT EXISTS key_time_bucket (
   FOREIGN KEY(run_id) REFERENCES run_session(run_id),
   FOREIGN KEY(file_id) REFERENCES file_registry(file_id),
   FOREIGN KEY(template_id) REFERENCES regex_template(template_id)
-);
\ No newline at end of file
+);
+-- 时间桶按 (运行, 文件, 模板, 维度, 粒度, 桶起点) 唯一，写入时累加计数
+CREATE UNIQUE INDEX IF NOT EXISTS uq_key_time_bucket ON key_time_bucket(
+  run_id, file_id, template_id, mod, smod, classification, level, thread_id, bucket_granularity, bucket_start
+);
+
+-- 全局关键文本字典：跨文件记录已见过的归一化关键文本及其归属模板
+-- template_id 为 NULL 表示该关键文本已送入委员会但尚无模板覆盖; attempts 为送委员会的次数,
+-- 未达上限的 NULL key 在后续文件中会再次送委员会 (LLM 失败 / 空结果 / 安全准入拒绝都不应永久隐藏它)
+CREATE TABLE IF NOT EXISTS key_text_dict (
+  key_text TEXT PRIMARY KEY,
+  template_id INTEGER,
+  first_file_id TEXT,
+  first_seen_at TEXT,
+  updated_at TEXT,
+  attempts INTEGER DEFAULT 0
+) WITHOUT ROWID;
+
+-- 正则安全扫描结论缓存：按 (模式, 压测样本, 时限) 的内容哈希存放，分析器版本不一致时视为过期
+CREATE TABLE IF NOT EXISTS regex_safety_verdict (
+  verdict_key TEXT PRIMARY KEY,
+  analyzer_version TEXT,
+  pattern TEXT,
+  level TEXT,
+  result_json TEXT,
+  checked_at TEXT
+) WITHOUT ROWID;
+
+-- 慢匹配记录：生产运行中单次 search 超过阈值的 (模板, 文本, 耗时)，批量、抽样写入
+CREATE TABLE IF NOT EXISTS slow_match (
+  sm_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  run_id INTEGER,
+  template_id INTEGER,
+  text TEXT,
+  duration_ms REAL,
+  created_at TEXT,
+  FOREIGN KEY(run_id) REFERENCES run_session(run_id),
+  FOREIGN KEY(template_id) REFERENCES regex_template(template_id)
+);
+CREATE INDEX IF NOT EXISTS idx_slow_match_template ON slow_match(template_id, duration_ms);
+
+-- 模板集合变更日志：每新增 / 停用一个模板追加一行，自增 generation 即模板集合的代数
+CREATE TABLE IF NOT EXISTS template_change (
+  generation INTEGER PRIMARY KEY AUTOINCREMENT,
+  template_id INTEGER,
+  change TEXT,            -- add / deactivate
+  changed_at TEXT
+);
+
+-- P2 uniq 模式逐关键文本的匹配结果（template_id 为 NULL 表示未命中），增量重跑只重匹配未命中与受停用影响的关键文本
+CREATE TABLE IF NOT EXISTS p2_key_assignment (
+  file_id TEXT,
+  key_text TEXT,
+  template_id INTEGER,
+  PRIMARY KEY(file_id, key_text)
+) WITHOUT ROWID;
+
+-- P2 每个文件最近一次完整 / 增量运行所基于的模板代数与输入产物签名
+CREATE TABLE IF NOT EXISTS p2_file_state (
+  file_id TEXT PRIMARY KEY,
+  generation INTEGER,
+  source_sig TEXT,
+  run_id INTEGER,
+  updated_at TEXT
+);
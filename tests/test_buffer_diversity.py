@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from core.buffer import DiversityBuffer
+
+
+def test_near_duplicates_are_filtered(cluster_samples_vx):
+    """近重复样本只入缓冲一条，结构不同的样本仍可进入。"""
+    buf = DiversityBuffer(size_threshold=10, max_per_micro_batch=10, jaccard_threshold=0.7)
+    misses = cluster_samples_vx + ["upload success", "seletct_mot_id: NUMNUM NUMNUM"]
+    picked = buf.pick_for_buffer(misses)
+    buf.add(picked)
+    assert picked[0] == cluster_samples_vx[0]
+    assert sum(1 for s in buf.samples if s.startswith("Auto gen vx graph")) == 1
+    assert "upload success" in buf.samples and "seletct_mot_id: NUMNUM NUMNUM" in buf.samples
+    # 后续批次中的近重复同样被挡在缓冲外
+    assert buf.pick_for_buffer(["Auto gen vx graph(DAADBevDetTemporal9v) failed"]) == []
+
+
+def test_exact_only_when_threshold_disabled(cluster_samples_vx):
+    buf = DiversityBuffer(size_threshold=3, max_per_micro_batch=10, jaccard_threshold=None)
+    buf.add(buf.pick_for_buffer(cluster_samples_vx + cluster_samples_vx))
+    assert buf.samples == cluster_samples_vx
+    assert buf.reached_threshold()
+
+
+def test_discard_rebuilds_lsh(cluster_samples_vx):
+    """复查命中的样本移出缓冲后, 其近重复可以重新进入。"""
+    buf = DiversityBuffer(size_threshold=10, max_per_micro_batch=10, jaccard_threshold=0.7)
+    buf.add(buf.pick_for_buffer([cluster_samples_vx[0], "upload success"]))
+    assert buf.discard({cluster_samples_vx[0]}) == 1
+    assert buf.samples == ["upload success"]
+    assert buf.pick_for_buffer([cluster_samples_vx[1]]) == [cluster_samples_vx[1]]
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import os
+
+from core import committee
+from core.committee import CommitteeSession
+
+
+def _write(path, text, mtime):
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def test_session_reuses_clients_until_config_changes(tmp_path, monkeypatch):
+    """配置未变时跨轮次复用客户端且只构建用到的智能体；agents.yaml mtime 变化后重载并重建。"""
+    app = tmp_path / "application.yaml"
+    agents = tmp_path / "agents.yaml"
+    _write(app, f"first_pass:\n  committee:\n    secrets_path: {tmp_path / 'none.yaml'}\n", 1000)
+    _write(agents, "committee:\n  backend: langchain\n  agents:\n    drafter:\n      model: {model_name: a}\n", 1000)
+
+    built = []
+
+    def fake_build(model_cfg, secrets, http_client=None):
+        built.append(model_cfg["model_name"])
+        return object()
+
+    monkeypatch.setattr(committee, "_build_langchain_llm", fake_build)
+    sess = CommitteeSession(config_path=str(agents), app_config_path=str(app))
+    c1 = sess.llm("drafter")
+    assert sess.llm("drafter") is c1
+    assert sess.configs()[0]["backend"] == "langchain"
+    assert built == ["a"] and sess.reloads == 1
+
+    _write(agents, "committee:\n  backend: langchain\n  agents:\n    drafter:\n      model: {model_name: b}\n", 2000)
+    c2 = sess.llm("drafter")
+    assert c2 is not c1
+    assert built == ["a", "b"] and sess.reloads == 2
+
+
+def test_run_uses_shared_session(tmp_path):
+    agents = tmp_path / "agents.yaml"
+    _write(agents, "committee:\n  backend: stub\n", 1000)
+    out = committee.run(["upload success"], config_path=str(agents))
+    assert out and out[0]["source"] == "stub"
+    assert committee.get_session(str(agents)) is committee.get_session(str(agents))
+    committee.close_sessions()
+
+
+def test_reload_defers_pool_close_until_lease_returned(tmp_path, monkeypatch):
+    """在途轮次持有旧连接池时配置重载：旧池待归还后才关闭，新轮次拿到新的池。"""
+    app = tmp_path / "application.yaml"
+    agents = tmp_path / "agents.yaml"
+    _write(app, f"first_pass:\n  committee:\n    secrets_path: {tmp_path / 'none.yaml'}\n", 1000)
+    _write(agents, "committee:\n  agents:\n    drafter:\n      model: {model_name: a}\n", 1000)
+
+    class FakeHttp:
+        def __init__(self):
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    pools = []
+
+    def fake_pool(self, orch):
+        if self._pool is None:
+            self._pool = committee._PooledHttpClient(FakeHttp())
+            pools.append(self._pool.client)
+        return self._pool
+
+    monkeypatch.setattr(CommitteeSession, "_pool_client_locked", fake_pool)
+    monkeypatch.setattr(committee, "_build_langchain_llm", lambda m, s, http_client=None: http_client)
+    sess = CommitteeSession(config_path=str(agents), app_config_path=str(app))
+    with sess.lease("drafter") as old:
+        _write(agents, "committee:\n  agents:\n    drafter:\n      model: {model_name: b}\n", 2000)
+        with sess.lease("drafter") as new:
+            assert new is not old and not old.closed
+        assert not old.closed and not new.closed
+    assert old.closed and not new.closed
+    sess.close()
+    assert new.closed and len(pools) == 2
+
+
+def test_validation_engine_reused_across_rounds(tmp_path, monkeypatch):
+    """语料与参数不变时各轮复用同一校验引擎; 语料刷新后旧引擎退役关闭, 会话 close 时关闭当前引擎。"""
+    closed = []
+
+    class FakeEngine:
+        def __init__(self, *corpora, **params):
+            self.corpora = corpora
+
+        def validate(self, drafts, targets=()):
+            return [committee.validation.ValidationReport(d["pattern"], True, "", 0, 0.0, 0.0, 0.0, 0.0, "", 0, 0.0)
+                    for d in drafts]
+
+        def close(self):
+            closed.append(self)
+
+    corpora = [(object(), object(), object())]
+    monkeypatch.setattr(committee.validation, "ValidationEngine", FakeEngine)
+    monkeypatch.setattr(committee.validation, "load_corpora", lambda **kw: corpora[0])
+    sess = CommitteeSession(app_config_path=str(tmp_path / "application.yaml"))
+    drafts = [{"pattern": "^a$", "sample_log": "a"}]
+    engines = []
+    for _ in range(2):
+        assert committee._validate_drafts(drafts, ["a"], {}, session=sess) == drafts
+        engines.append(sess._engine.client)
+    assert engines[0] is engines[1] and not closed
+
+    corpora[0] = (object(), object(), object())
+    committee._validate_drafts(drafts, ["a"], {}, session=sess)
+    assert closed == [engines[0]] and sess._engine.client is not engines[0]
+    current = sess._engine.client
+    sess.close()
+    assert closed == [engines[0], current]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from core import committee
+from core.committee import _estimate_tokens, _merge_drafts, _sample_tokens, _shard_samples
+
+
+def test_shard_samples_respects_budget():
+    """分片不超过 token 预算与条数上限，且保持原有顺序。"""
+    samples = [f"sample {i} " + "x" * 40 for i in range(50)]
+    shards = _shard_samples(samples, max_tokens=100, max_items=8)
+    assert [s for sh in shards for s in sh] == samples
+    for sh in shards:
+        assert len(sh) <= 8
+        assert sum(_sample_tokens(s) for s in sh) <= 100
+    assert _estimate_tokens("定位丢失") == 4
+
+
+def test_draft_shards_run_concurrently_and_merge(monkeypatch):
+    """分片并发草拟：同时在途数达到且不超过并发上限，失败分片被丢弃，结果按 pattern 去重。"""
+    active, peak, calls = [0], [0], []
+    lock = threading.Lock()
+    # 两个分片必须同时在途才能越过屏障；串行执行会超时打破屏障，断言据此失败而不依赖墙钟
+    barrier = threading.Barrier(2, timeout=10)
+
+    def fake_draft(llm, shard, trace=None):
+        with lock:
+            calls.append(shard[0])
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        barrier.wait()
+        with lock:
+            active[0] -= 1
+        if shard[0] == "boom":
+            raise RuntimeError("bad gateway")
+        return [{"pattern": "^common"}, {"pattern": f"^{shard[0]}"}]
+
+    monkeypatch.setattr(committee, "_lc_draft", fake_draft)
+    shards = [["a"], ["b"], ["boom"], ["c"]]
+    out = committee._draft_shards(None, shards, concurrency=2)
+    assert sorted(calls) == ["a", "b", "boom", "c"]
+    assert peak[0] == 2 and not barrier.broken
+    assert out[2] == []
+    merged = _merge_drafts(out)
+    assert [d["pattern"] for d in merged] == ["^common", "^a", "^b", "^c"]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import urllib.error
+import urllib.request
+
+import pytest
+
+from bin import fake_llm_server
+from bin.fake_llm_server import FakeLLMConfig
+
+
+def _chat(server, user_content):
+    body = json.dumps({"model": "m", "messages": [
+        {"role": "system", "content": "sys"}, {"role": "user", "content": user_content}]}).encode("utf-8")
+    req = urllib.request.Request(fake_llm_server.base_url(server) + "/chat/completions", data=body,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        return json.loads(resp.read())
+
+
+def test_heuristic_answer_covers_samples():
+    """启发式应答为 _lc_draft 可解析的 JSON 数组, 且每条样本都能被某个 pattern 命中。"""
+    samples = ["link NUMNUM has NUMNUM lanes id=0xNUMNUMa", "link NUMNUM has NUMNUM lanes id=0xfNUMNUM", "upload success"]
+    server = fake_llm_server.start_in_thread(FakeLLMConfig())
+    try:
+        data = _chat(server, json.dumps(samples))
+        items = json.loads(data["choices"][0]["message"]["content"])
+        assert all(any(re.search(it["pattern"], s) for it in items) for s in samples)
+        assert data["usage"]["total_tokens"] == data["usage"]["prompt_tokens"] + data["usage"]["completion_tokens"] > 0
+    finally:
+        server.shutdown()
+
+
+def test_script_and_error_injection():
+    cfg = FakeLLMConfig(script={"seletct": '[{"pattern":"^seletct"}]'}, completion_tokens=7, seed=1)
+    server = fake_llm_server.start_in_thread(cfg)
+    try:
+        data = _chat(server, '["seletct_mot_id: NUMNUM"]')
+        assert data["choices"][0]["message"]["content"] == '[{"pattern":"^seletct"}]'
+        assert data["usage"]["completion_tokens"] == 7
+        cfg.error_rate, cfg.error_codes = 1.0, (429,)
+        with pytest.raises(urllib.error.HTTPError) as ei:
+            _chat(server, '["x"]')
+        assert ei.value.code == 429
+        assert server.stats.snapshot()["errors"] == 1
+    finally:
+        server.shutdown()
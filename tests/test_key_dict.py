@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+from store import dao
+
+
+def _use_db(tmp_path, monkeypatch, name="k.sqlite3"):
+    db = str(tmp_path / name)
+    connect = dao._connect
+    monkeypatch.setattr(dao, "_connect", lambda db_path=db: connect(db_path))
+    return db
+
+
+def test_sent_keys_count_attempts(tmp_path, monkeypatch):
+    """送过委员会的 key 累计送审次数, 命中结果写回不增加次数; 未收录的 key 不出现在结果中。"""
+    db = _use_db(tmp_path, monkeypatch)
+    dao.init_db(db)
+    dao.upsert_key_dict([("a NUMNUM", None), ("b ok", None)], file_id="f1", attempted=True)
+    dao.upsert_key_dict([("a NUMNUM", None)], file_id="f2", attempted=True)
+    dao.upsert_key_dict([("b ok", 7)], file_id="f2")
+    got = dao.lookup_key_dict(["a NUMNUM", "b ok", "never"])
+    assert got == {"a NUMNUM": (None, 2), "b ok": (7, 1)}
+
+
+def test_init_db_adds_attempts_to_old_dict(tmp_path, monkeypatch):
+    """旧库的 key_text_dict 没有 attempts 列, init_db 补列后照常读写。"""
+    db = _use_db(tmp_path, monkeypatch, "old.sqlite3")
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE key_text_dict (key_text TEXT PRIMARY KEY, template_id INTEGER, "
+                     "first_file_id TEXT, first_seen_at TEXT, updated_at TEXT) WITHOUT ROWID")
+        conn.execute("INSERT INTO key_text_dict(key_text, template_id) VALUES('x', NULL)")
+    dao.init_db(db)
+    dao.upsert_key_dict([("x", None)], attempted=True)
+    assert dao.lookup_key_dict(["x"]) == {"x": (None, 1)}
+
+
+def test_p1_dict_writer_batches_in_one_transaction(tmp_path, monkeypatch):
+    """P1 字典写入攒批: 未到批次数不落库, 同一 key 归属取最后一次、送审次数累加。"""
+    from bin import p1_run_first_pass as p1
+
+    calls = []
+    monkeypatch.setattr(p1.dao, "upsert_key_dict_rows", lambda rows, file_id="": calls.append(sorted(rows)))
+    w = p1._KeyDictWriter("f1", flush_batches=2)
+    w.add([("a", None), ("b", 3)], attempted=True)
+    w.batch_done()
+    assert calls == []
+    w.add([("a", 5)])
+    w.batch_done()
+    assert calls == [[("a", 5, 1), ("b", 3, 1)]]
+    w.flush()
+    assert len(calls) == 1
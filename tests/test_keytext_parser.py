@@ -6,3 +6,11 @@ def test_extract_key_text_basic():
     raw = "[20250929_183904][3499.966][I][40433][MOD:vgnss][SMOD:log][ INFO ] [RTK] sensor:3500813, age=1.00, ns_r=32, ns_b=39"
     kt = extract_key_text(raw)
     assert "sensor:3500813, age=1.00, ns_r=32, ns_b=39" in kt
+
+def test_parse_fields_epoch_and_sec():
+    from core.parser import parse_fields, ts_to_epoch, epoch_to_ts
+    raw = "[20250929_183904][3499.966][I][40433][MOD:vgnss][SMOD:log][ INFO ] [RTK] sensor:3500813"
+    p = parse_fields(raw)
+    assert p.epoch == ts_to_epoch("20250929 183904")
+    assert epoch_to_ts(p.epoch) == p.ts
+    assert p.sec_ms == 3499966
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from core import committee
+from core.llm_cache import LLMCache, make_key
+
+
+def test_key_ignores_order_and_whitespace():
+    a = make_key("openai:qwen:0.0", "draft-v1", ["upload  success", "seletct_mot_id: NUMNUM"])
+    b = make_key("openai:qwen:0.0", "draft-v1", ["seletct_mot_id: NUMNUM", "upload success "])
+    assert a == b
+    assert a != make_key("openai:qwen:0.0", "draft-v2", ["upload success", "seletct_mot_id: NUMNUM"])
+
+
+def test_readwrite_then_strict_replay(tmp_path, monkeypatch):
+    """读写模式首次调用 LLM 并落缓存；回放模式命中直接返回，未命中返回空且不调用 LLM。"""
+    calls = []
+
+    def fake_draft(llm, samples, trace=None):
+        calls.append(list(samples))
+        return [{"pattern": "^upload success$", "sample_log": samples[0]}]
+
+    monkeypatch.setattr(committee, "_lc_draft", fake_draft)
+    path = str(tmp_path / "cache.sqlite3")
+    rw = LLMCache(path, mode="readwrite")
+    out1 = committee._cached_draft(None, ["upload success"], cache=rw, model_id="m")
+    out2 = committee._cached_draft(None, ["upload success"], cache=rw, model_id="m")
+    assert out1 == out2 and len(calls) == 1 and rw.hits == 1
+
+    def no_network(*a, **k):
+        raise AssertionError("replay 模式不应调用 LLM")
+
+    monkeypatch.setattr(committee, "_lc_draft", no_network)
+    rp = LLMCache(path, mode="replay")
+    assert committee._cached_draft(None, ["upload success"], cache=rp, model_id="m") == out1
+    assert committee._cached_draft(None, ["never seen"], cache=rp, model_id="m") == []
+    with pytest.raises(ValueError):
+        LLMCache(path, mode="bogus")
+
+
+def test_connections_closed_after_each_call(tmp_path, monkeypatch):
+    """get/put 每次用完即关闭连接，长时间运行不累积打开的句柄。"""
+    import sqlite3
+
+    opened = []
+    cache = LLMCache(str(tmp_path / "cache.sqlite3"), mode="readwrite")
+    connect = cache._connect
+
+    def tracking_connect():
+        conn = connect()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(cache, "_connect", tracking_connect)
+    cache.put("k", [1], model="m")
+    assert cache.get("k") == [1] and cache.get("missing") is None
+    assert len(opened) == 3
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import re
+
+from core.miner import DrainMiner, mine_candidates
+
+
+def test_simple_cluster_becomes_candidate():
+    """同结构的样本聚为一簇并产出能覆盖全部成员的 pattern_nomal, 单条样本留给委员会。"""
+    samples = [
+        "link NUMNUM has NUMNUM lanes id=0xNUMNUMa",
+        "link NUMNUM has NUMNUM lanes id=0xNUMNUMbNUMNUM",
+        "link NUMNUM has NUMNUM lanes id=0xfNUMNUM",
+        "upload success",
+    ]
+    miner = DrainMiner()
+    cands, rest = mine_candidates(miner, samples, min_support=2)
+    assert len(cands) == 1
+    c = cands[0]
+    assert c["source"] == "miner" and c["pattern"] == c["pattern_nomal"]
+    assert all(re.search(c["pattern_nomal"], s) for s in samples[:3])
+    assert not re.search(c["pattern_nomal"], "link NUMNUM has NUMNUM roads id=0x1")
+    assert rest == ["upload success"]
+
+
+def test_over_generalized_cluster_goes_to_committee():
+    """通配占比过高的簇不产出候选; 已产出的簇不重复产出, 但其样本也不视为已覆盖 (以活动索引为准)。"""
+    miner = DrainMiner()
+    wide = ["task run alpha beta NUMNUM", "task run gamma delta NUMNUM"]
+    cands, rest = mine_candidates(miner, wide, min_support=2, max_wildcard_ratio=0.3)
+    assert cands == [] and rest == wide
+
+    cands, _ = mine_candidates(miner, ["open file x ok", "open file y ok"], min_support=2)
+    assert len(cands) == 1
+    cands, rest = mine_candidates(miner, ["open file y ok"], min_support=2)
+    assert cands == [] and rest == ["open file y ok"]
+
+
+def test_miner_sees_raw_misses_before_diversity_buffer():
+    """P1 先把原始未命中送挖掘器再进缓冲: 近重复过滤后的样本聚不出簇, 原始未命中可以。"""
+    from bin import p1_run_first_pass as p1
+    from core.buffer import DiversityBuffer
+
+    misses = [f"sensor:NUMNUM, age=NUMNUM, ns_r=NUMNUM cam{i}" for i in range(7)]
+    misses += [f"task lane_NUMNUM finished in NUMNUM ms worker{i}" for i in range(7)]
+
+    # 旧顺序: 缓冲过滤后再挖掘, 同结构样本只剩各一条, 达不到 min_support
+    buf = DiversityBuffer(size_threshold=100, max_per_micro_batch=15, jaccard_threshold=0.7)
+    buffered = buf.pick_for_buffer(misses)
+    assert len(buffered) < len(misses)
+    assert mine_candidates(DrainMiner(), buffered, min_support=2)[0] == []
+
+    written = []
+
+    class _Active:
+        def match_one(self, k):
+            for i, c in enumerate(written, 1):
+                if re.search(c["pattern_nomal"], k):
+                    return i
+            return None
+
+    def write_and_swap(cands, samples):
+        # 模拟覆盖选择丢弃第二个候选: 其样本必须继续进缓冲
+        written.extend(cands[:1])
+
+    buf = DiversityBuffer(size_threshold=100, max_per_micro_batch=15, jaccard_threshold=0.7)
+    cands, rest, hits = p1.mine_misses(DrainMiner(), misses, write_and_swap, _Active, min_support=2)
+    assert len(cands) == 2 and len(hits) == 7
+    assert rest == [m for m in misses if not re.search(written[0]["pattern_nomal"], m)]
+    buf.add(buf.pick_for_buffer(rest))
+    assert buf.samples and all(s in rest for s in buf.samples)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from bin import p2_run_second_pass as p2
+from core.matcher import CompiledIndex
+from core.symbols import SymbolTable
+from store import dao
+
+
+class _Idx:
+    def __init__(self, items):
+        self._h = CompiledIndex(items, nomal=False)
+
+    def get_active(self):
+        return self._h
+
+
+def _rec(key, count, ts):
+    return p2._UniqAggRecord(count, key, key, "m", "", "I", ts, ts, ((ts - ts % 60, count),))
+
+
+def test_template_generation_log(tmp_path, monkeypatch):
+    """新增与停用模板各推进一次代数, 按代数取回变更。"""
+    db = str(tmp_path / "g.sqlite3")
+    dao.init_db(db)
+    connect = dao._connect
+    monkeypatch.setattr(dao, "_connect", lambda db_path=db: connect(db_path))
+    assert dao.get_template_generation() == 0
+    (tid,) = dao.write_templates([{"pattern_nomal": r"^alpha$"}], safety_gate=False)
+    dao.write_templates([{"pattern_nomal": r"^alpha$"}], safety_gate=False)  # 重复不计
+    g1 = dao.get_template_generation()
+    assert dao.deactivate_template(tid)
+    assert dao.get_template_generation() == g1 + 1 == 2
+    assert dao.get_template_changes(g1) == {"add": [], "deactivate": [tid]}
+    assert dao.get_template_changes(0)["add"] == [tid]
+
+
+def test_incremental_rematches_only_affected_keys():
+    """只重匹配未命中与归属已停用的关键文本, 只为受影响模板重新聚合。"""
+    t0 = 1759171140
+    records = [_rec("alpha 1", 3, t0), _rec("beta 2", 5, t0 + 60), _rec("gamma 3", 7, t0 + 120)]
+    prev = {"alpha 1": 1, "beta 2": 2, "gamma 3": None}
+    idx = _Idx([
+        {"template_id": 1, "pattern": r"^alpha \d$", "pattern_nomal": ""},
+        {"template_id": 3, "pattern": r"^beta \d$", "pattern_nomal": ""},
+        {"template_id": 4, "pattern": r"^gamma \d$", "pattern_nomal": ""},
+    ])
+    summary = {}
+    sym = SymbolTable()
+    roll = p2.TimeRollup(9, "f", sym, levels=("minute",), fields=("mod", "smod", "level"))
+    total, matched, affected, changed = p2._process_uniq_incremental(
+        records, prev, {"add": [3, 4], "deactivate": [2]}, 100, 1, idx, summary, "f", 9, sym, roll,
+    )
+    assert (total, matched) == (15, 15)
+    assert affected == [2, 3, 4]
+    assert sorted(changed) == [("beta 2", 3), ("gamma 3", 4)]
+    # 模板 1 未受影响, 其统计行保持原样, 不会重新聚合
+    assert sorted((k[0], v["line_count"]) for k, v in summary.items()) == [(3, 5), (4, 7)]
+    assert roll.total() == 12
+
+
+def test_p2_state_written_with_results(tmp_path, monkeypatch):
+    """删除旧行、写统计行与文件状态同一事务: 写入失败整体回滚, 旧结果与旧文件状态原样保留。"""
+    db = str(tmp_path / "s.sqlite3")
+    dao.init_db(db)
+    connect = dao._connect
+    monkeypatch.setattr(dao, "_connect", lambda db_path=db: connect(db_path))
+    row = dict(run_id=1, file_id="f", template_id=1, line_count=3)
+    other = dict(run_id=1, file_id="f", template_id=2, line_count=4)
+    dao.commit_p2_results("f", [row, other], [], [("k", 1), ("j", 2)], (4, "sig", 1))
+    assert dao.get_p2_file_state("f")["generation"] == 4
+
+    with pytest.raises(KeyError):
+        dao.commit_p2_results("f", [row], [{"run_id": 1}], [("k", 2)], (5, "sig", 2), template_ids=[1])
+    assert dao.get_p2_file_state("f")["generation"] == 4
+    assert dao.get_p2_key_assignments("f") == {"k": 1, "j": 2}
+    with dao._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM log_match_summary").fetchone()[0] == 2
+
+    # 增量: 只替换受影响模板的统计行
+    dao.commit_p2_results("f", [dict(row, line_count=5)], [], [("k", 1)], (5, "sig", 2), template_ids=[1])
+    with dao._connect() as conn:
+        got = conn.execute("SELECT template_id, line_count FROM log_match_summary ORDER BY 1").fetchall()
+    assert [tuple(r) for r in got] == [(1, 5), (2, 4)]
+    # 整文件替换同时清空逐关键文本结果
+    dao.commit_p2_results("f", [row], [], [("k", 1)], (6, "sig", 3))
+    assert dao.get_p2_key_assignments("f") == {"k": 1}
+    with dao._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM log_match_summary").fetchone()[0] == 1
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import csv
+import os
+import re
+
+import pytest
+
+from core.regex_ast import analyze_pattern
+from core.regex_safety import _timed_search, analyze_regex_safety
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_exponential_loops_detected():
+    """嵌套二义循环与循环内可拼接的重叠分支判为指数级, 无二义的嵌套循环只记录星高。"""
+    for p in (r"^(a+)+$", r"(a|aa)+$", r"^(\w+\s?)+$", r"^(?:[a-z]+|\d+)+$"):
+        assert analyze_pattern(p).complexity == "exponential", p
+    safe = analyze_pattern(r"(ab+)+")
+    assert safe.complexity == "linear" and "star_height_2" in safe.flags
+    assert analyze_pattern(r"^(?:foo|bar)+$").complexity == "linear"
+
+
+def test_polynomial_degree_and_attack_strings():
+    """相邻重叠量词给出多项式次数, 攻击串确实能拖慢匹配。"""
+    a = analyze_pattern(r"\d+\d+x")
+    assert (a.complexity, a.degree) == ("polynomial", 2)
+    with pytest.raises(TimeoutError):
+        _timed_search(re.compile(r"\d+\d+x"), max(a.attacks, key=len), 0.05)
+    assert analyze_pattern(r"^upload\ success$").complexity == "linear"
+
+
+def test_slow_regex_csv_template_is_flagged():
+    """slow_regex.csv 中实测 4 秒的模板: 静态识别出长可变长片段链, 攻击串在时限内触发超时。"""
+    with open(os.path.join(ROOT, "slow_regex.csv"), encoding="utf-8-sig") as f:
+        row = next(r for r in csv.DictReader(f))
+    res = analyze_regex_safety(row["Pattern"], [], timeout_sec=0.05)
+    assert res.complexity == "polynomial" and res.degree >= 10
+    assert res.level == "danger" and res.dynamic_timeout
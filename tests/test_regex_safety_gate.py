@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import re
+
+import pytest
+
+from core import regex_safety
+from store import dao
+from core.regex_safety import _timed_search, rewrite_pattern, screen_candidates
+
+
+def _c(p, sample=""):
+    return {"pattern": p, "pattern_nomal": p, "sample_log": sample}
+
+
+def test_timed_search_interrupts_catastrophic_backtracking():
+    """标准库 re 的灾难回溯也会在时限内被打断。"""
+    with pytest.raises(TimeoutError):
+        _timed_search(re.compile(r"^(a+)+$"), "a" * 40 + "b", 0.05)
+
+
+def test_rewrite_keeps_language():
+    """单原子嵌套量词与相邻 .* 的改写不改变匹配结果。"""
+    assert rewrite_pattern(r"^(a+)+$") == r"^(a+)$"
+    assert rewrite_pattern(r"^(?:\s*)*x .*.*y") == r"^(?:\s*)x .*y"
+    assert rewrite_pattern(r"(ab+)+") == r"(ab+)+"
+    # 惰性 / 占有量词、转义括号、转义点与反向引用都不改写
+    assert rewrite_pattern(r"(a+)+?") == r"(a+)+?"
+    assert rewrite_pattern(r"x\(a+)+") == r"x\(a+)+"
+    assert rewrite_pattern(r"\.*.*") == r"\.*.*"
+    assert rewrite_pattern(r"a.*?.*b") == r"a.*?.*b"
+    assert rewrite_pattern(r"(a+)+b\1") == r"(a+)+b\1"
+    assert rewrite_pattern(r"(?:a+)+b\1") == r"(?:a+)b\1"
+    assert rewrite_pattern(r"[(]\w+.+.*") == r"[(]\w+.+"
+
+
+def test_rewrite_discarded_when_samples_disagree(monkeypatch):
+    """改写须在样本上与原模式的匹配区间一致, 否则不采用。"""
+    assert regex_safety.rewrites_agree([(r"^(a+)+$", r"^(a+)$", ["aaa"])], 0.05, workers=1) == [True]
+    assert regex_safety.rewrites_agree([(r"^(a+)+$", r"^(a+)$", [])], 0.05, workers=1) == [False]
+    monkeypatch.setattr(regex_safety, "_VERDICTS", regex_safety.OrderedDict())
+    monkeypatch.setattr(regex_safety, "rewrite_pattern", lambda p: r"^(b+)$")
+    accepted, rejected = screen_candidates([_c(r"^(a+)+$", "aaa")], timeout_sec=0.05, workers=1)
+    assert [c["pattern_nomal"] for c in accepted] == [r"^aaa$"]
+
+
+def test_screen_rewrites_or_rejects_unsafe(monkeypatch):
+    """安全候选原样通过; 不安全的先结构改写, 再退到样本字面量, 都不行才拒绝。"""
+    monkeypatch.setattr(regex_safety, "_VERDICTS", regex_safety.OrderedDict())
+    cands = [
+        _c(r"^upload NUMNUM$", "upload NUMNUM"),
+        _c(r"^(a+)+$", "aaa"),
+        _c(r"^(\w+\s?)+$", "foo bar NUMNUM"),
+        _c(r"^(\w+\s?)+$x"),
+    ]
+    accepted, rejected = screen_candidates(cands, timeout_sec=0.05, workers=1)
+    assert [c["pattern_nomal"] for c in accepted] == [r"^upload NUMNUM$", r"^(a+)$", r"^foo\ bar\ NUMNUM$"]
+    assert accepted[1]["safety_rewrite"] == r"^(a+)+$"
+    assert accepted[2]["source"] == "safety_literal" and "source" not in accepted[1]
+    assert all(c["safety_screened"] for c in accepted) and "safety_screened" not in cands[0]
+    assert [r["pattern_nomal"] for r in rejected] == [r"^(\w+\s?)+$x"]
+
+
+def test_write_templates_skips_screened(tmp_path, monkeypatch):
+    """上游已检测过的候选写库时不再重复检测, 其余候选照常过准入。"""
+    db = str(tmp_path / "t.sqlite3")
+    dao.init_db(db)
+    connect = dao._connect
+    monkeypatch.setattr(dao, "_connect", lambda db_path=db: connect(db_path))
+    seen = []
+
+    def fake_screen(cands, timeout_sec=0.1):
+        seen.extend(c["pattern_nomal"] for c in cands)
+        return [dict(c, safety_screened=True) for c in cands], []
+
+    monkeypatch.setattr(regex_safety, "screen_candidates", fake_screen)
+    ids = dao.write_templates([dict(_c(r"^a \d+$"), safety_screened=True), _c(r"^b \d+$")], safety_gate=True)
+    assert len(ids) == 2
+    assert seen == [r"^b \d+$"]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from bin import scan_regex_templates as scan
+
+
+def _row(tid, pattern, nomal, sample):
+    return {"template_id": tid, "pattern": pattern, "pattern_nomal": nomal, "sample_log": sample}
+
+
+def test_second_scan_only_checks_changed_templates(monkeypatch):
+    """第二次扫描只检测新增/变更模板, 其余结论来自缓存; 与 pattern 一致的 pattern_nomal 不重复检测。"""
+    store = {}
+    rows = [
+        _row(1, r"^upload\ success$", r"^upload\ success$", "upload success"),
+        _row(2, r"^(a+)+$", r"^(a+)+$", "aaa"),
+    ]
+    monkeypatch.setattr(scan, "fetch_all_templates", lambda active_only=True: list(rows))
+    monkeypatch.setattr(scan, "get_safety_verdicts",
+                        lambda keys, ver: {k: store[k][1] for k in keys if k in store and store[k][0] == ver})
+    monkeypatch.setattr(scan, "upsert_safety_verdicts",
+                        lambda items, ver: store.update({k: (ver, d) for k, d in items}))
+    monkeypatch.setattr(scan, "get_slow_match_ranking", lambda limit=50: [])
+    monkeypatch.setattr(scan, "get_slow_match_texts", lambda tids, per_template=3: {})
+
+    first = scan.scan_templates(timeout_sec=0.05, workers=1)
+    assert first["summary"]["analyzed"] == 2 and first["summary"]["danger"] == 1
+
+    rows.append(_row(3, r"^task\ done$", r"^task\ done$", "task done"))
+    second = scan.scan_templates(timeout_sec=0.05, workers=1)
+    assert second["summary"]["analyzed"] == 1 and second["summary"]["cache_hits"] == 2
+    assert [d["cached"] for d in second["details"]] == [True, True, False]
+    assert second["summary"]["danger"] == 1
+
+    monkeypatch.setattr(scan, "ANALYZER_VERSION", "test-bump")
+    third = scan.scan_templates(timeout_sec=0.05, workers=1)
+    assert third["summary"]["analyzed"] == 3
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from core.selection import select_candidates
+from core.validation import Corpus
+
+
+class _Active:
+    """只认识固定文本的活动索引替身。"""
+
+    def __init__(self, known):
+        self.known = set(known)
+
+    def match_one(self, text):
+        return 1 if text in self.known else None
+
+
+def _c(p):
+    return {"pattern_nomal": p, "pattern": p}
+
+
+def test_greedy_cover_prefers_heavy_and_drops_redundant():
+    """重叠候选中只保留覆盖行数最多的一组, 被完全包含的候选丢弃。"""
+    corpus = Corpus("uniq", ["task lane done", "task obj done", "upload ok"], [50, 30, 5])
+    cands = [_c(r"^task lane done$"), _c(r"^task \S+ done$"), _c(r"^upload ok$"), _c(r"^task obj done$")]
+    res = select_candidates(cands, corpus)
+    assert [c["pattern"] for c in res.selected] == [r"^task \S+ done$", r"^upload ok$"]
+    assert len(res.redundant) == 2
+    assert res.covered_weight == 85
+
+
+def test_drops_candidates_covered_by_active():
+    """命中元素全部已被活动模板覆盖的候选直接丢弃; 不在语料中的样本按权重 1 参与覆盖。"""
+    corpus = Corpus("uniq", ["upload ok"], [5])
+    res = select_candidates([_c(r"^upload ok$"), _c(r"^fresh \d+$")], corpus,
+                            samples=["fresh 1"], active=_Active(["upload ok"]))
+    assert [c["pattern"] for c in res.selected] == [r"^fresh \d+$"]
+    assert [c["pattern"] for c in res.covered_by_active] == [r"^upload ok$"]
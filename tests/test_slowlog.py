@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from bin import scan_regex_templates as scan
+from core import slowlog
+from core.matcher import CompiledIndex
+
+
+def test_recorder_samples_and_batches(monkeypatch):
+    """每个模板超过上限后按间隔抽样; record 只缓冲, maybe_flush 缓冲满才批量写库。"""
+    written = []
+    monkeypatch.setattr(slowlog.dao, "batch_insert_slow_matches", lambda rows: written.append(list(rows)))
+    rec = slowlog.SlowMatchRecorder(run_id=7, threshold_ms=1, max_per_template=2, after_cap_every=3, flush_rows=3)
+    for _ in range(8):
+        rec.record(1, "x" * 10, 0.002)
+    assert rec.stats() == {"seen": 8, "recorded": 4, "dropped": 0, "templates": 1}
+    assert written == []
+    rec.maybe_flush()
+    assert len(written) == 1 and len(written[0]) == 4
+    rec.record(2, "y", 0.002)
+    rec.maybe_flush()
+    assert len(written) == 1
+    rec.close()
+    rows = [r for batch in written for r in batch]
+    assert len(rows) == 5 and rows[0][:3] == (7, 1, "x" * 10)
+
+
+def test_recorder_buffer_bounded(monkeypatch):
+    """两次写库之间缓冲有上限, 超出的记录丢弃计数, 热路径上从不写库。"""
+    monkeypatch.setattr(slowlog.dao, "batch_insert_slow_matches",
+                        lambda rows: (_ for _ in ()).throw(AssertionError("record 不应写库")))
+    rec = slowlog.SlowMatchRecorder(run_id=1, threshold_ms=0, flush_rows=2, max_buffer_rows=3)
+    for i in range(5):
+        rec.record(i, "t", 0.1)
+    assert rec.stats()["recorded"] == 3 and rec.stats()["dropped"] == 2
+
+
+def test_compiled_index_reports_slow_search(monkeypatch):
+    """挂上采集器后, 超过阈值的 search 以 (模板, 文本) 记录, 命中结果不变。"""
+    monkeypatch.setattr(slowlog.dao, "batch_insert_slow_matches", lambda rows: None)
+    rec = slowlog.SlowMatchRecorder(run_id=1, threshold_ms=0, sample_every=1)
+    idx = CompiledIndex([{"template_id": 3, "pattern_nomal": r"^task\ \d+$", "pattern": ""}], slow_recorder=rec)
+    assert idx.match_one("task 12") == 3
+    assert rec.stats()["recorded"] == 1 and rec._buf[0][1:3] == (3, "task 12")
+
+
+def test_timing_is_sampled_by_default(monkeypatch):
+    """默认每 100 次未缓存匹配才计时一次。"""
+    monkeypatch.setattr(slowlog.dao, "batch_insert_slow_matches", lambda rows: None)
+    rec = slowlog.SlowMatchRecorder(run_id=1, threshold_ms=0)
+    idx = CompiledIndex([{"template_id": 3, "pattern_nomal": r"^task\ \d+$", "pattern": ""}], slow_recorder=rec)
+    for i in range(250):
+        assert idx.match_one("task %d" % i) == 3
+    assert rec.stats()["recorded"] == 2
+
+
+def test_scan_uses_captured_slow_texts(monkeypatch):
+    """样例上很快的模板, 用采集到的慢文本压测后判为 danger, 并进入慢匹配排名。"""
+    slow_text = "{sd_link " + " , ".join("2000%d/2000%d/0" % (i, i) for i in range(20)) + " ,  }"
+    from store.dao import NUMERIC_PATTERN as N
+    pattern = "^{sd_link " + " , ".join(["NUMNUM\\/NUMNUM\\/NUMNUM"] * 4) + " ,  }$"
+    rows = [{"template_id": 9, "pattern": pattern.replace("NUMNUM", N), "pattern_nomal": pattern,
+             "sample_log": "{sd_link 1/1/1 ,  }"}]
+    monkeypatch.setattr(scan, "fetch_all_templates", lambda active_only=True: rows)
+    monkeypatch.setattr(scan, "get_safety_verdicts", lambda keys, ver: {})
+    monkeypatch.setattr(scan, "upsert_safety_verdicts", lambda items, ver: None)
+    monkeypatch.setattr(scan, "get_slow_match_ranking",
+                        lambda limit=50: [{"template_id": 9, "hits": 5, "total_ms": 20000.0, "max_ms": 4300.0}])
+    monkeypatch.setattr(scan, "get_slow_match_texts", lambda tids, per_template=3: {9: [slow_text]})
+    out = scan.scan_templates(timeout_sec=0.05, workers=1, slow_only=True)
+    assert out["summary"]["danger"] == 1
+    assert out["summary"]["slow_ranked"][0]["template_id"] == 9
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import itertools
+import os
+import sqlite3
+
+import pytest
+
+from core import aggregator
+from core.aggregator import Aggregator, TimeBucketCounter
+from core.symbols import SymbolTable
+from store import dao
+
+
+def _batch(sym):
+    d1 = sym.encode_dims("M", "S", "I", "")[:3]
+    d2 = sym.encode_dims("M", "S", "E", "")[:3]
+    base = 1759171140  # 2025-09-29T18:39:00
+    tids = [1, 1, 1, 2, 1, 1]
+    dims = [d1, d1, d1, d2, d1, d1]
+    epochs = [base + 1, base + 59, base + 60, base + 5, -1, base + 3]
+    return tids, dims, epochs
+
+
+def test_batch_counts_per_minute(monkeypatch):
+    """微批分组按分钟计数, 无时间戳的行跳过, 写库时解码维度。"""
+    written = []
+    monkeypatch.setattr(aggregator.dao, "batch_upsert_key_time_bucket", lambda rows: written.extend(rows))
+    monkeypatch.setattr(aggregator, "np", None)
+    sym = SymbolTable()
+    bc = TimeBucketCounter(1, "f", sym, fields=("mod", "smod", "level"))
+    bc.add_batch(*_batch(sym))
+    bc.flush()
+    got = {(r["template_id"], r["level"], r["bucket_start"]): r["count_in_bucket"] for r in written}
+    assert got == {
+        (1, "I", "2025-09-29T18:39:00"): 3,
+        (1, "I", "2025-09-29T18:40:00"): 1,
+        (2, "E", "2025-09-29T18:39:00"): 1,
+    }
+    assert all(r["thread_id"] == "" and r["bucket_granularity"] == "minute" for r in written)
+
+
+def test_numpy_path_matches_counter(monkeypatch):
+    """numpy 分组与 Counter 回退结果一致。"""
+    pytest.importorskip("numpy")
+    sym = SymbolTable()
+    a = TimeBucketCounter(1, "f", sym, fields=("mod", "smod", "level"), numpy_min_batch=1)
+    a.add_batch(*_batch(sym))
+    monkeypatch.setattr(aggregator, "np", None)
+    b = TimeBucketCounter(1, "f", sym, fields=("mod", "smod", "level"))
+    b.add_batch(*_batch(sym))
+    assert a.counts == b.counts
+
+
+def test_bounded_flush_is_additive(tmp_path, monkeypatch):
+    """键数达到上限即写库, 多次 flush 的计数在库里累加。"""
+    db = str(tmp_path / "tb.sqlite3")
+    dao.init_db(db)
+    connect = dao._connect
+    monkeypatch.setattr(dao, "_connect", lambda db_path=db: connect(db_path))
+    sym = SymbolTable()
+    agg = Aggregator(run_id=901, file_id="tb-file", symbols=sym, bucket_max_keys=1)
+    tids, dims, epochs = _batch(sym)
+    agg.add_batch(tids, [d + (0,) for d in dims], epochs)
+    agg.add_match(1, "M", "S", "", "I", "", "20250929 183910")
+    agg.flush()
+    with sqlite3.connect(db) as conn:
+        rows = conn.execute(
+            "SELECT template_id, bucket_start, count_in_bucket FROM key_time_bucket WHERE file_id='tb-file'"
+            " ORDER BY template_id, bucket_start"
+        ).fetchall()
+    assert rows == [(1, "2025-09-29T18:39:00", 4), (1, "2025-09-29T18:40:00", 1), (2, "2025-09-29T18:39:00", 1)]
+
+
+def test_rollup_levels_match_bruteforce(monkeypatch):
+    """单遍级联得到的各粒度计数与逐行按桶宽取整的结果一致, 包括晚到的更早时间戳。"""
+    monkeypatch.setattr(aggregator, "np", None)
+    sym = SymbolTable()
+    d = sym.encode_dims("M", "", "I", "")[:3]
+    base = 1759190390  # 2025-09-29T23:59:50
+    epochs = [base + 5, base + 5, base + 30, base + 3700, base - 90000, -1, base + 86400 * 2]
+    tids = [1] * len(epochs)
+    roll = aggregator.TimeRollup(1, "f", sym, levels=aggregator.ROLLUP_LEVELS, fields=("mod", "smod", "level"))
+    roll.add_batch(tids[:4], [d] * 4, epochs[:4])
+    roll.add_batch(tids[4:], [d] * 3, epochs[4:])
+
+    got = {}
+    for series, g, e, c in roll.iter_buckets():
+        got[(g, e)] = got.get((g, e), 0) + c
+    want = {}
+    for e in epochs:
+        if e == -1:
+            continue
+        for g, w in aggregator.GRANULARITY_SECONDS.items():
+            want[(g, e - e % w)] = want.get((g, e - e % w), 0) + 1
+    assert got == want
+    assert roll.total() == 6
+
+    written = []
+    monkeypatch.setattr(aggregator.dao, "batch_upsert_key_time_bucket", lambda rows: written.extend(rows))
+    roll.flush()
+    assert len(written) == len(want) and not roll.minutes
+    assert {r["bucket_start"] for r in written if r["bucket_granularity"] == "day"} == {
+        "2025-09-28T00:00:00", "2025-09-29T00:00:00", "2025-09-30T00:00:00", "2025-10-01T00:00:00",
+    }
+
+
+def test_rollup_sparse_and_bounded(monkeypatch, tmp_path):
+    """跨度极大的时间戳只占稀疏的格子, 越界时间戳丢弃, 键数达到上限即暂存到临时文件而不写库, 默认不写秒级桶。"""
+    written = []
+    monkeypatch.setattr(aggregator.dao, "batch_upsert_key_time_bucket", lambda rows: written.extend(rows))
+    sym = SymbolTable()
+    roll = aggregator.TimeRollup(1, "f", sym, fields=("mod", "smod", "level"), max_keys=250,
+                                 spill_dir=str(tmp_path))
+    assert roll.levels == ("minute", "hour", "day")
+    for t in range(200):
+        roll.add((t, 0, 0, 0), 1759190390)
+    roll.add((0, 0, 0, 0), 1)  # 1970-01-01T00:00:01
+    roll.add((0, 0, 0, 0), -5)
+    assert roll.n_keys == 201 and roll.dropped == 1 and not roll.spill_paths
+    for t in range(200, 260):
+        roll.add((t, 0, 0, 0), 1759190390)
+    assert roll.n_keys == 11 and len(roll.spill_paths) == 1  # 第 250 个键触发暂存, 之后再进 11 个
+    assert not written
+    rows = list(roll.iter_rows())
+    assert not os.listdir(tmp_path) and roll.n_keys == 0
+    assert roll.flushed_rows == len(rows)
+    assert sum(r["count_in_bucket"] for r in rows if r["bucket_granularity"] == "day") == 261
+    assert "1970-01-01T00:00:00" in {r["bucket_start"] for r in rows}
+    assert not any(r["bucket_granularity"] == "second" for r in rows)
+
+
+def test_rollup_spill_merged_and_committed_once(tmp_path, monkeypatch):
+    """分片的暂存文件随 merge 交给主汇总, 结束时与 summary 同一事务写库; 写库失败不留任何时间桶行。"""
+    db = str(tmp_path / "b.sqlite3")
+    dao.init_db(db)
+    connect = dao._connect
+    monkeypatch.setattr(dao, "_connect", lambda db_path=db: connect(db_path))
+
+    def _rollup():
+        main = aggregator.TimeRollup(1, "f", SymbolTable(), fields=("mod", "smod", "level"), max_keys=2,
+                                     spill_dir=str(tmp_path))
+        part = aggregator.TimeRollup(1, "f", SymbolTable(), fields=("mod", "smod", "level"), max_keys=2,
+                                     spill_dir=str(tmp_path))
+        for t in range(3):
+            part.add((t, 0, 0, 0), 1759190390)
+        main.add((0, 0, 0, 0), 1759190390)
+        main.merge(part)
+        assert part.spill_paths == [] and len(main.spill_paths) == 2
+        return main
+
+    main = _rollup()
+    with pytest.raises(KeyError):
+        dao.commit_p2_results("f", [], itertools.chain(main.iter_rows(), [{"run_id": 1}]))
+    main.discard()
+    with dao._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM key_time_bucket").fetchone()[0] == 0
+
+    main = _rollup()
+    dao.commit_p2_results("f", [], main.iter_rows())
+    with dao._connect() as conn:
+        got = conn.execute(
+            "SELECT template_id, count_in_bucket FROM key_time_bucket WHERE bucket_granularity='day' ORDER BY 1"
+        ).fetchall()
+    assert [tuple(r) for r in got] == [(0, 2), (1, 1), (2, 1)]
+    main.discard()
+    assert [p for p in os.listdir(tmp_path) if p.endswith(".pkl")] == []
+
+
+def test_bucket_label_is_utc_isoformat():
+    """分桶标签按 UTC 格式化，与旧版 isoformat 输出一致，不依赖已弃用的 utcfromtimestamp。"""
+    assert aggregator._bucket_label(0) == "1970-01-01T00:00:00"
+    assert aggregator._bucket_label(1759171140) == "2025-09-29T18:39:00"
@@ -9,3 +9,26 @@ def test_truncate_samples_len_and_items():
     assert sum(len(s)+1 for s in out) <= 5000
     # 应优先保留短文本
     assert out[0] == "short"
+
+
+def test_pack_samples_by_token_budget():
+    """按 token 预算打包：不超预算，先轮转覆盖各结构，放不下的长样本跳过但不影响后面的短样本。"""
+    from core.committee import _pack_samples_for_llm, _sample_tokens
+    samples = ["seletct_mot_id: NUMNUM NUMNUM"] + [f"task lane_{i} finished" for i in range(50)] \
+        + ["定位丢失 " * 200, "upload success"]
+    out, stats = _pack_samples_for_llm(samples, token_budget=60, max_items=100)
+    assert sum(_sample_tokens(s) for s in out) == stats["estimated_tokens"] <= 60
+    assert "seletct_mot_id: NUMNUM NUMNUM" in out and "upload success" in out
+    assert "定位丢失 " * 200 not in out
+    assert stats["dropped"] == len(samples) - len(out)
+
+
+def test_usage_from_message():
+    from core.committee import _usage_from_message
+
+    class Msg:
+        usage_metadata = {"input_tokens": 120, "output_tokens": 30}
+        response_metadata = {}
+
+    assert _usage_from_message(Msg()) == (120, 30)
+    assert _usage_from_message("plain text") == (None, None)
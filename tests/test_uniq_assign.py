@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from bin import p2_run_second_pass as p2
+from core import uniq_assign
+
+
+def _rec(key, count):
+    return p2._UniqAggRecord(count, key, key, "m", "", "I", 1759171140, 1759171140, ((1759171140, count),))
+
+
+def test_uniq_assign_roundtrip(tmp_path):
+    """归属产物写入后读回，未命中还原为 None，截断文件视为不可用。"""
+    path = str(tmp_path / "x_uniq_assign.bin")
+    assert uniq_assign.write_assignments(path, "f" * 32, 5, 12, [3, None, 7]) == 3
+    got = uniq_assign.read_assignments(path)
+    assert got == ("f" * 32, 5, 12, [3, None, 7])
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 2)
+    assert uniq_assign.read_assignments(path) is None
+    assert uniq_assign.read_assignments(str(tmp_path / "missing.bin")) is None
+
+
+def test_p2_uses_p1_assignments_only_when_consistent(tmp_path):
+    """file_id 与模板代数一致且与 uniq 产物对齐时直接按归属聚合，否则回退匹配。"""
+    path = str(tmp_path / "x_uniq_assign.bin")
+    records = [_rec("alpha 1", 3), _rec("beta 2", 5)]
+    uniq_assign.write_assignments(path, "a" * 32, 4, 8, [1, None])
+    assert p2._load_p1_assignments(path, "a" * 32, 4, records) == [1, None]
+    assert p2._load_p1_assignments(path, "b" * 32, 4, records) is None
+    assert p2._load_p1_assignments(path, "a" * 32, 5, records) is None
+    assert p2._load_p1_assignments(path, "a" * 32, 4, records[:1]) is None
+
+    summary = {}
+    sym = p2.SymbolTable()
+    total, matched = p2._process_uniq_mode(records, 1, 1, None, summary, "f", 9, sym, preassigned=[1, None])
+    assert (total, matched) == (8, 3)
+    assert [k[0] for k in summary] == [1]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import os
+
+from bin import p1_run_first_pass as p1
+
+
+def _write_normal(path):
+    lines = []
+    for i in range(60):
+        ts = f"20250929_18{i % 60:02d}{(59 - i) % 60:02d}"
+        lines.append(f"[{ts}][3499.966][I][40433][MOD:m{i % 3}][SMOD:s{i % 2}] key {i % 7} hex 0x{i:04x}")
+    lines.append("no header line 1")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_spill_mode_equals_in_memory(tmp_path):
+    """外排模式与纯内存模式产出完全一致：计数、时间范围与首见字段均正确合并。"""
+    a = tmp_path / "a.normal.txt"
+    b = tmp_path / "b.normal.txt"
+    _write_normal(a)
+    _write_normal(b)
+
+    ra = p1.build_uniq_files(str(a), chunk_lines=5)
+    rb = p1.build_uniq_files(str(b), chunk_lines=5, spill_keys=3)
+
+    assert ra[2:] == rb[2:]
+    for pa, pb in zip(ra[:2], rb[:2]):
+        with open(pa, encoding="utf-8") as fa, open(pb, encoding="utf-8") as fb:
+            assert fa.read() == fb.read()
+    # 临时有序段目录需清理干净
+    assert sorted(x.name for x in tmp_path.iterdir() if x.is_dir()) == []
+
+
+def test_spill_threshold_checked_per_record(tmp_path, monkeypatch):
+    """大块读取时内存中的去重键数也不超过 spill_keys，不会按整块超出阈值。"""
+    from core import uniq_spill
+
+    sizes = []
+    write_run = uniq_spill.write_sorted_run
+
+    def spy(counter, run_dir, seq):
+        sizes.append(len(counter))
+        return write_run(counter, run_dir, seq)
+
+    monkeypatch.setattr(uniq_spill, "write_sorted_run", spy)
+    a = tmp_path / "e.normal.txt"
+    _write_normal(a)
+    p1.build_uniq_files(str(a), chunk_lines=1000, spill_keys=3)
+    assert len(sizes) > 1 and max(sizes) <= 3
+
+
+def test_tsv_hist_roundtrip(tmp_path):
+    """TSV 第 10 列的分钟直方图可被 P2 还原, 各分钟行数之和等于有时间戳的行数。"""
+    from bin import p2_run_second_pass as p2
+
+    a = tmp_path / "c.normal.txt"
+    _write_normal(a)
+    _, tsv, total, _ = p1.build_uniq_files(str(a), chunk_lines=5, write_bin=False)
+    records = p2._load_uniq_records(tsv)
+    assert sum(r.count for r in records) == total
+    assert sum(c for r in records for _, c in r.hist) == 60
+    for r in records:
+        if r.hist:
+            assert r.hist[0][0] <= r.min_ts < r.hist[0][0] + 60
+            assert r.hist[-1][0] <= r.max_ts < r.hist[-1][0] + 60
+
+
+def test_tsv_raw_key_matches_bin(tmp_path):
+    """TSV 路径读回的原始关键文本 (含制表符) 与 bin 路径、P1 归属流式读回的键逐字节一致。"""
+    from bin import p2_run_second_pass as p2
+
+    a = tmp_path / "t.normal.txt"
+    a.write_text("[2025-09-30 02:39:00][m][I] job\tdone  x\\t 1\n[2025-09-30 02:39:01][m][I] plain 2\n",
+                 encoding="utf-8")
+    _, tsv, _, _ = p1.build_uniq_files(str(a), chunk_lines=5)
+    bin_path = tsv[: -len("_uniq_with_count.tsv")] + "_uniq.bin"
+    raw_keys = list(p1.iter_uniq_raw_keys(bin_path, tsv))
+    assert list(p1.iter_uniq_raw_keys("", tsv)) == raw_keys
+    from_tsv = [r.key_text_raw for r in p2._load_uniq_records(tsv)]
+    bin_records = p2._load_uniq_bin(bin_path)
+    try:
+        from_bin = [r.key_text_raw for r in bin_records]
+    finally:
+        bin_records.close()
+    assert from_tsv == from_bin == raw_keys
+    assert any("\t" in k for k in from_tsv)
+
+
+def test_no_tsv_reported_when_disabled(tmp_path):
+    """write_tsv=False 时不返回 TSV 路径，并删除上一轮遗留的 TSV。"""
+    a = tmp_path / "d.normal.txt"
+    _write_normal(a)
+    _, tsv, _, _ = p1.build_uniq_files(str(a), chunk_lines=5)
+    assert os.path.exists(tsv)
+    _, tsv2, _, _ = p1.build_uniq_files(str(a), chunk_lines=5, write_tsv=False)
+    assert tsv2 == "" and not os.path.exists(tsv)
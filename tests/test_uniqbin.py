@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from core import uniqbin
+from core.parser import TS_NONE, ts_to_epoch
+
+
+def test_uniq_bin_roundtrip(tmp_path):
+    """二进制 uniq 产物写入后经 mmap 读回，字段与计数保持一致。"""
+    path = str(tmp_path / "x_uniq.bin")
+    rows = [
+        (3, "age=NUMNUM", "age=1.00", "vgnss", "log", "I", "20250929 183904", "20250929 183910"),
+        (1, "中文 日志 NUMNUM", "", "planning", "", "E", "", ""),
+        (7, "tab\tinside", "tab\tinside", "vgnss", "log", "W", "20250101 000000", "20250101 000001"),
+    ]
+    with uniqbin.UniqBinWriter(path) as w:
+        for r in rows:
+            w.add(*r)
+
+    with uniqbin.UniqBinReader(path) as rd:
+        assert len(rd) == 3
+        assert rd.total_count() == 11
+        got = list(rd)
+        assert got[0].key_text_raw == "age=1.00"
+        assert got[0].min_ts == ts_to_epoch("20250929 183904")
+        assert got[1].key_text_raw == "中文 日志 NUMNUM"
+        assert got[1].min_ts == TS_NONE and got[1].smod == ""
+        assert got[2].key_text_norm == "tab\tinside" and got[2].level == "W"
+        assert [r.count for r in rd[1:]] == [1, 7]
+
+
+def test_uniq_bin_minute_hist(tmp_path):
+    """分钟直方图随记录写入并按记录读回; 未带直方图的记录为空元组。"""
+    path = str(tmp_path / "h_uniq.bin")
+    m0 = ts_to_epoch("20250929 183900")
+    with uniqbin.UniqBinWriter(path) as w:
+        w.add(5, "a", "", "m", "", "I", m0 + 5, m0 + 130, hist=[(m0, 2), (m0 + 120, 3)])
+        w.add(1, "b", "", "m", "", "I", "", "")
+        w.add(2, "c", "", "m", "", "I", m0, m0, hist=[(m0, 2)])
+
+    with uniqbin.UniqBinReader(path) as rd:
+        assert rd.version == uniqbin.VERSION
+        assert rd[0].hist == ((m0, 2), (m0 + 120, 3))
+        assert rd[1].hist == ()
+        assert rd.hist(2) == ((m0, 2),)
+
+
+def test_uniq_bin_failed_write_leaves_no_tmp(tmp_path, monkeypatch):
+    """写出中途失败时删除 .tmp，也不产生目标文件。"""
+    import pytest
+
+    def boom(src, dst):
+        raise OSError("no space left on device")
+
+    monkeypatch.setattr(uniqbin.shutil, "copyfileobj", boom)
+    path = str(tmp_path / "x_uniq.bin")
+    w = uniqbin.UniqBinWriter(path)
+    w.add(1, "a NUMNUM", "a 1", "m", "", "I", "", "")
+    with pytest.raises(OSError):
+        w.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == []
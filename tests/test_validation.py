@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from core.validation import Corpus, ValidationEngine, required_literal
+
+
+def test_required_literal_and_prefilter():
+    assert required_literal(r"^link\ NUMNUM\ has\s+NUMNUM") == "link NUMNUM has"
+    assert required_literal(r"(?i)^upload success$") == ""
+    assert required_literal(r"a|b") == ""
+    c = Corpus("c", ["upload success", "x", "upload retry upload"])
+    assert c.lines_containing("upload") == [0, 2]
+
+
+def _engine(**kw):
+    negatives = Corpus("negatives", ["system started ok", "upload success"])
+    recent = Corpus("recent", ["seletct_mot_id: NUMNUM", "task lane_NUMNUM finished", "upload success",
+                               "job a done", "job b done", "job c done"], [10, 85, 5, 1, 1, 1])
+    history = Corpus("history", ["valid_goal_point_num : NUMNUM"])
+    return ValidationEngine(negatives, recent, history, min_general_keys=3, **kw)
+
+
+def test_engine_reasons_and_parallel_equivalence():
+    """误报、过度泛化、重叠与零覆盖分别被拒；只命中一条高频日志的模板不算泛化；进程池结果与串行一致。"""
+    cands = [
+        {"pattern_nomal": r"^seletct_mot_id:\s+NUMNUM$", "sample_log": "seletct_mot_id: NUMNUM"},
+        {"pattern_nomal": r"^upload\ success$"},
+        {"pattern_nomal": r"^task\ lane"},
+        {"pattern_nomal": r"^valid_goal_point_num"},
+        {"pattern_nomal": r"^never\ seen$"},
+        {"pattern_nomal": r"(unclosed"},
+        {"pattern_nomal": r"^job\ \w\ done$"},
+    ]
+    targets = ["seletct_mot_id: NUMNUM", "upload success", "task lane_NUMNUM finished", "valid_goal_point_num : NUMNUM"]
+    serial = _engine(workers=1).validate(cands, targets)
+    assert [r.reason for r in serial] == ["", "adversary_fp", "", "overlap_existing",
+                                          "matches_nothing", serial[5].reason, "too_general"]
+    assert serial[0].passed and serial[5].reason.startswith("compile_error")
+    assert serial[2].recent_keys == 1 and abs(serial[2].recent_coverage - 85 / 103) < 1e-9
+    assert serial[3].overlap_rate == 0.5
+    assert serial[6].recent_keys == 3 and serial[6].recent_key_share == 0.5
+
+    eng = _engine(workers=2, parallel_min_work=0)
+    try:
+        assert eng.validate(cands, targets) == serial
+    finally:
+        eng.close()